@@ -3,35 +3,32 @@ Flask Application Configuration with Connexion and CORS
 
 This module configures a RESTful API service using Flask, Connexion (OpenAPI/Swagger),
 and CORS handling. It includes a simple health check endpoint and security configurations.
+
+create_app() is the application factory used by production servers, e.g.
+    gunicorn -c gunicorn.conf.py "app:create_app()"
+    uvicorn app:create_app --factory --workers 4
+while `python app.py` starts a single development server.
 """
 
 from flask import jsonify
 from flask_cors import CORS  # For Cross-Origin Resource Sharing protection
 import os
+import columnar
 import config
-
-# Initialize Connexion app with OpenAPI/Swagger specification
-app = config.connex_app  # Get pre-configured Connexion app from config
+import metrics
+import routes
 
 # CORS Security Configuration
 # Extract allowed origins from environment variable (comma-separated list)
 # Default is empty string which results in no allowed origins
 ALLOWED_ORIGINS = os.environ.get("ALLOWED_ORIGINS", "").split(",")
 
-# Configure Cross-Origin Resource Sharing (CORS) policies
-CORS(
-    app.app,  # Apply to underlying Flask app (Connexion wraps Flask)
-    resources={
-        r"/api/*": {  # Apply CORS only to API endpoints
-            "origins": ["*"]  # Whitelist of allowed domains
-        }
-    },
-    expose_headers=["X-Total-Count"],  # Custom headers exposed to clients
-    supports_credentials=True  # Allow cookies and authentication headers
-)
+
+def refresh_changed_datasets():
+    """Pick up datasets changed by ingest.py before serving the request"""
+    routes.sync_cache_versions()
 
 
-@app.app.route("/")
 def home():
     """Health check endpoint providing basic service information
 
@@ -41,7 +38,47 @@ def home():
     return jsonify({"message": "Hello from Flask!"})
 
 
-if __name__ == "__main__":
-    # Запускаем только при старте приложения, не на каждом reload
+def create_app():
+    """
+    Build the API application: register the swagger.yml routes, CORS, the health
+    check and metrics endpoints, and start warming the caches and listening to table
+    changes. Called once per worker process.
+
+    Returns:
+        connexion.App: ASGI application serving the API
+    """
+    if config.analytics_backend == "duckdb":
+        columnar.require()
+
+    # Initialize Connexion app with OpenAPI/Swagger specification
+    app = config.connex_app  # Get pre-configured Connexion app from config
     app.add_api(config.basedir / "swagger.yml")
-    app.run(host="0.0.0.0", port=8000)
+
+    # Configure Cross-Origin Resource Sharing (CORS) policies
+    CORS(
+        app.app,  # Apply to underlying Flask app (Connexion wraps Flask)
+        resources={
+            r"/api/*": {  # Apply CORS only to API endpoints
+                "origins": ["*"]  # Whitelist of allowed domains
+            }
+        },
+        expose_headers=["X-Total-Count"],  # Custom headers exposed to clients
+        supports_credentials=True  # Allow cookies and authentication headers
+    )
+
+    # Registered first, so the measured time includes the other request hooks
+    metrics.instrument(app.app)
+    app.app.before_request(refresh_changed_datasets)
+    app.app.add_url_rule("/", view_func=home)
+    app.app.add_url_rule("/metrics", view_func=metrics.endpoint)
+
+    if config.warm_up_caches:
+        routes.warm_up()
+    # DuckDB reads static Parquet files, which publish no changes
+    if config.listen_table_changes and config.analytics_backend == "postgres":
+        routes.listen_for_changes()
+    return app
+
+
+if __name__ == "__main__":
+    create_app().run(host="0.0.0.0", port=8000)
@@ -0,0 +1,269 @@
+"""
+Endpoint Benchmark Suite
+
+Measures every GET route of swagger.yml, both as a direct call of its routes.py
+function and as an HTTP request through the full Connexion stack:
+    - cold: every run starts with all caches cleared, so it includes the database reads
+    - warm: runs served from the caches
+For each it reports p50/p95/p99 latency, the table rows read per cold run (from
+pg_stat_user_tables), the peak RSS of the process and the response size.
+
+Each route is measured in a fresh process, so caches, memory peaks and connections
+of one route do not leak into the next. Results are saved as JSON; given a previous
+result file, the suite exits with status 1 when a latency percentile regresses by
+more than the threshold.
+
+With --scales, the database is regenerated with generate.py at every scale before it
+is measured, which REPLACES its contents: point DB_NAME at a dedicated database.
+
+Usage (from the backend folder):
+    python benchmark.py --output results.json
+    python benchmark.py --scales 1 5 10 --output results.json
+    python benchmark.py --baseline results.json --threshold 0.2
+"""
+
+from collections import namedtuple
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+import yaml
+
+from config import app, basedir, db
+
+# A benchmarked request: API path (relative to /api) with its path parameters filled
+# in, the operationId serving it, the values of its path parameters and query parameters
+Benchmark = namedtuple("Benchmark", ["path", "operation", "path_parameters", "query"])
+
+# Parameters of the routes that cannot be called without any: the datasets of the
+# Tasks and UserRating pages of the frontend
+REQUIRED_QUERIES = {
+    "/batch": {"datasets": ["topics", "topics_distribution_by_rating", "topics_solvability", "topics_correlation",
+                            "users_rating_distribution_by_experience",
+                            "users_rating_distribution_by_solutions_amount",
+                            "users_rating_distribution_by_solutions_rating",
+                            "users_rating_distribution_by_solutions_solvability"]},
+}
+
+# Representative parameter sets measured in addition to the bare route
+EXTRA_QUERIES = {
+    "/topics_distribution_by_rating": [{"min_rating": 1200, "max_rating": 2000}],
+    "/topics_correlation": [{"tags": ["dp", "math", "greedy"]}],
+    "/topics_by_month": [{"tags": ["dp", "math"], "month_from": "2020-01"}],
+    "/users_rating_distribution_by_experience": [{"mode": "hist2d"}, {"mode": "hexbin"},
+                                                 {"mode": "sample", "points": 2000}],
+}
+
+# Values of path parameters; routes whose path parameters have no value here are
+# skipped. The default handle is a user of generate.py's synthetic data.
+PATH_PARAMETERS = {"handle": os.getenv("BENCHMARK_HANDLE", "user1")}
+
+PERCENTILES = (50, 95, 99)
+
+
+def benchmarks():
+    """
+    Returns:
+        list[Benchmark]: Every GET route of swagger.yml, plus EXTRA_QUERIES
+    """
+    spec = yaml.safe_load((basedir / "swagger.yml").read_text())
+    found = []
+    for template, methods in spec["paths"].items():
+        if "get" not in methods:
+            continue
+        names = re.findall(r"{(\w+)}", template)
+        if not set(names) <= set(PATH_PARAMETERS):
+            continue
+        path_parameters = {name: PATH_PARAMETERS[name] for name in names}
+        path = template.format(**path_parameters)
+        operation = methods["get"]["operationId"]
+        for query in [REQUIRED_QUERIES.get(template, {})] + EXTRA_QUERIES.get(template, []):
+            found.append(Benchmark(path, operation, path_parameters, query))
+    return found
+
+
+def label(benchmark):
+    """Readable name of a benchmark, e.g. /topics_correlation?tags=dp,math"""
+    return benchmark.path + ("?" + query_string(benchmark.query) if benchmark.query else "")
+
+
+def query_string(query):
+    """Encode query parameters, with arrays in the comma separated form of swagger.yml"""
+    return urlencode({name: ",".join(value) if isinstance(value, list) else value
+                      for name, value in query.items()})
+
+
+def rows_read():
+    """Table rows read so far by all sessions, as counted by the statistics collector"""
+    with db.engine.connect() as connection:
+        connection.execute(db.text("SELECT pg_stat_clear_snapshot()"))
+        return int(connection.execute(db.text(
+            "SELECT COALESCE(SUM(seq_tup_read + COALESCE(idx_tup_fetch, 0)), 0) FROM pg_stat_user_tables"
+        )).scalar())
+
+
+def flush_statistics():
+    """Close pooled connections, whose backends report their statistics on exit"""
+    for engine in db.engines.values():
+        engine.dispose()
+    time.sleep(0.5)
+
+
+def timings(call, runs, before=None):
+    """Latencies of `runs` calls in milliseconds, running `before` ahead of each untimed"""
+    latencies = []
+    for _ in range(runs):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {f"p{percentile}_ms": float(np.percentile(latencies, percentile)) for percentile in PERCENTILES}
+
+
+def measure(benchmark, cold_runs, warm_runs, connection):
+    """
+    Measure one benchmark; runs in its own process and sends the result to the parent.
+
+    Args:
+        benchmark (Benchmark): Route to measure
+        cold_runs (int): Number of runs with cleared caches
+        warm_runs (int): Number of runs served from the caches
+        connection (multiprocessing.connection.Connection): Pipe to the parent
+    """
+    import cache
+    from formats import COMPRESSORS
+    import routes
+    from app import create_app
+
+    connex_app = create_app()
+    client = connex_app.test_client()
+    url = "/api" + label(benchmark)
+    function = getattr(routes, benchmark.operation.split(".", 1)[1])
+
+    def call_function():
+        with app.test_request_context(url):
+            # Reading the body waits for streamed responses to complete
+            function(**benchmark.path_parameters, **benchmark.query).get_data()
+
+    def call_http():
+        response = client.get(url, headers={"Accept-Encoding": "identity"})
+        assert response.status_code == 200, f"{url}: HTTP {response.status_code}"
+
+    result = {"benchmark": label(benchmark)}
+    for target, call in (("function", call_function), ("http", call_http)):
+        with app.app_context():
+            flush_statistics()
+            read_before = rows_read()
+        cold = timings(call, cold_runs, before=cache.clear_all)
+        with app.app_context():
+            flush_statistics()
+            cold["rows_read"] = (rows_read() - read_before) / cold_runs
+        call()
+        result[target] = {"cold": cold, "warm": timings(call, warm_runs)}
+
+    body = client.get(url, headers={"Accept-Encoding": "identity"}).content
+    result["response_bytes"] = len(body)
+    # The test client decompresses responses, so the compressed size is recomputed
+    result["response_bytes_br"] = len(COMPRESSORS["br"](body))
+    # Linux reports the peak resident set size in kilobytes
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    connection.send(result)
+    connection.close()
+
+
+def run_suite(cold_runs, warm_runs):
+    """
+    Measure every benchmark in a fresh process each.
+
+    Returns:
+        list[dict]: One result per benchmark
+    """
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for benchmark in benchmarks():
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=measure, args=(benchmark, cold_runs, warm_runs, sender))
+        process.start()
+        # Closing the parent's end lets recv fail instead of waiting forever if the child dies
+        sender.close()
+        try:
+            result = receiver.recv()
+        except EOFError:
+            raise RuntimeError(f"Benchmark process of {label(benchmark)} failed") from None
+        finally:
+            process.join()
+        print(f"{result['benchmark']}: cold p50 {result['http']['cold']['p50_ms']:.1f} ms, "
+              f"warm p50 {result['http']['warm']['p50_ms']:.2f} ms, "
+              f"{result['http']['cold']['rows_read']:.0f} rows, {result['response_bytes']} bytes")
+        results.append(result)
+    return results
+
+
+def regressions(results, baseline, threshold):
+    """
+    Compare latency percentiles with a previous run.
+
+    Args:
+        results (dict): Scale -> list of benchmark results
+        baseline (dict): Results of the previous run in the same format
+        threshold (float): Tolerated relative slowdown, e.g. 0.2 for 20%
+
+    Returns:
+        list[str]: Description of every regression
+    """
+    found = []
+    for scale, scale_results in results.items():
+        previous = {result["benchmark"]: result for result in baseline.get(scale, [])}
+        for result in scale_results:
+            if result["benchmark"] not in previous:
+                continue
+            for target in ("function", "http"):
+                for state in ("cold", "warm"):
+                    for percentile in PERCENTILES:
+                        key = f"p{percentile}_ms"
+                        old = previous[result["benchmark"]][target][state][key]
+                        new = result[target][state][key]
+                        if new > old * (1 + threshold):
+                            found.append(f"scale {scale} {result['benchmark']} {target} {state} {key}: "
+                                         f"{old:.2f} -> {new:.2f}")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the API endpoints")
+    parser.add_argument("--scales", type=int, nargs="*",
+                        help="Regenerate the database at each scale with generate.py (replaces its contents)")
+    parser.add_argument("--cold-runs", type=int, default=5, help="Runs with cleared caches per benchmark")
+    parser.add_argument("--warm-runs", type=int, default=50, help="Runs from the caches per benchmark")
+    parser.add_argument("--output", type=argparse.FileType("w"), help="Write the results as JSON")
+    parser.add_argument("--baseline", type=argparse.FileType("r"), help="Results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Tolerated relative slowdown")
+    args = parser.parse_args()
+
+    # Measured processes must not load every dataset in the background at startup
+    os.environ["WARM_UP_CACHES"] = "0"
+
+    results = {}
+    for scale in args.scales or [None]:
+        if scale is not None:
+            import generate
+            print(f"Generating scale {scale}")
+            with app.app_context():
+                generate.to_postgres(scale)
+        results[str(scale or "current")] = run_suite(args.cold_runs, args.warm_runs)
+
+    if args.output:
+        json.dump(results, args.output, indent=2)
+    if args.baseline:
+        found = regressions(results, json.load(args.baseline), args.threshold)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if found else 0)
@@ -0,0 +1,392 @@
+"""
+Result Cache Engine
+
+Caches the results of expensive functions per argument key with:
+    - a time-to-live for every key, measured from the moment its value was computed
+    - single-flight recomputation: concurrent callers of a missing key wait for one
+      computation instead of each running the same query
+    - stale-while-revalidate: expired values are still served for a grace period
+      while one background thread recomputes them
+    - refresh-ahead: values close to expiry are recomputed in the background before
+      any caller sees them expire
+    - a bounded number of keys (and optionally a bounded total weight, e.g. rows)
+      with least-recently-used eviction
+    - optionally, values shared with the other worker processes through a
+      shared_store.SharedStore: one process computes a key, the others map its result
+    - keys holding objects with a cache_token (the frames) by their token only: when
+      such a cached object is replaced, the values computed from it are dropped
+    - peek and prefetch for callers that cannot wait: a value is taken only if it is
+      cached, and otherwise computed in the background for the next callers
+Lookups, fills and background refreshes are counted in metrics.py.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import functools
+import logging
+import threading
+import time
+import weakref
+
+import metrics
+import shared_store
+
+logger = logging.getLogger(__name__)
+
+# Default bound of the grace period during which expired values are still served
+# (seconds); a whole ttl of days would keep serving week-old values after failures
+MAX_STALE_TTL = 3600
+
+# Shared pool running background refreshes for every cached function
+_refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+
+# Every live cache, for clear_all
+_instances = weakref.WeakSet()
+
+
+class _Entry:
+    """Cached value together with its timing information"""
+    __slots__ = ("value", "weight", "refresh_at", "expires_at", "stale_until")
+
+    def __init__(self, value, weight, ttl, refresh_ahead, stale_ttl, age=0.0):
+        # Values computed by another process are already `age` seconds old
+        now = time.monotonic() - age
+        self.value = value
+        self.weight = weight
+        self.refresh_at = now + ttl * (1.0 - refresh_ahead)
+        self.expires_at = now + ttl
+        self.stale_until = now + ttl + stale_ttl
+
+
+class _Token:
+    """Stands for an object carrying a cache_token (e.g. a frame) in the cache keys"""
+    __slots__ = ("cache_token",)
+
+    def __init__(self, cache_token):
+        self.cache_token = cache_token
+
+    def __eq__(self, other):
+        return isinstance(other, _Token) and other.cache_token == self.cache_token
+
+    def __hash__(self):
+        return hash(self.cache_token)
+
+    def __repr__(self):
+        return f"<{self.cache_token}>"
+
+
+def _keyed(value):
+    """Argument as it appears in a cache key"""
+    token = getattr(value, "cache_token", None)
+    return value if token is None else _Token(token)
+
+
+class _Flight:
+    """Computation of one key that other callers can wait for"""
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TimedCache:
+    """
+    Cache wrapping a single function. Instances are callable with the same
+    arguments as the wrapped function; arguments must be hashable.
+
+    Args:
+        func (callable): Function whose results are cached
+        ttl (float): Seconds a computed value stays fresh
+        refresh_ahead (float): Fraction of ttl before expiry when a background refresh starts
+        stale_ttl (float): Seconds after expiry an old value may still be served while refreshing,
+            or None for the ttl bounded by MAX_STALE_TTL
+        maxsize (int): Maximum number of cached keys
+        context (callable): Factory of a context manager entered around background refreshes
+            (e.g. Flask's app.app_context), or None
+        maxweight (float): Maximum total weight of the cached values, or None for no bound
+        weigher (callable): Function giving the weight of a value (e.g. len), required with maxweight
+        shared (shared_store.SharedStore): Store sharing the values across processes, or None;
+            values and keys must then be picklable and describable by shared_store.digest.
+            Mapped values having a share method (e.g. formats.Payload) are handed the
+            store and their key, to share the bytes they derive too
+    """
+
+    def __init__(self, func, ttl, refresh_ahead=0.1, stale_ttl=None, maxsize=128, context=None,
+                 maxweight=None, weigher=None, shared=None):
+        self.func = func
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.stale_ttl = min(ttl, MAX_STALE_TTL) if stale_ttl is None else stale_ttl
+        self.maxsize = maxsize
+        self.context = context or contextlib.nullcontext
+        self.maxweight = maxweight
+        self.weigher = weigher
+        self.shared = shared
+        # Values whose computation started before this Unix time are outdated (see mark_stale)
+        self._stale_before = 0.0
+        self._weight = 0
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        functools.update_wrapper(self, func)
+        _instances.add(self)
+
+    @staticmethod
+    def make_key(args, kwargs):
+        """
+        Build a hashable cache key from call arguments. Arguments carrying a
+        cache_token (the frames) are keyed by their token, so that cached keys do not
+        keep replaced frames alive.
+        """
+        args = tuple(_keyed(arg) for arg in args)
+        return args + tuple(sorted((name, _keyed(value)) for name, value in kwargs.items())) if kwargs else args
+
+    def __call__(self, *args, **kwargs):
+        key = self.make_key(args, kwargs)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._serve(key, args, kwargs, now)
+            if entry is not None:
+                return entry.value
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        metrics.CACHE_REQUESTS.inc(self.__name__, "miss")
+
+        if not leader:
+            # Another caller is computing this key: wait for its result
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        self._compute(key, flight, args, kwargs)
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _serve(self, key, args, kwargs, now):
+        """
+        Find the servable entry of a key, counting the hit; the lock must be held.
+
+        Returns:
+            _Entry: The entry, or None if the key is missing or past its stale window
+        """
+        entry = self._entries.get(key)
+        if entry is None or now >= entry.stale_until:
+            return None
+        self._entries.move_to_end(key)
+        # Fresh values are returned as is; values past their refresh point
+        # (or already expired but within the stale window) trigger one
+        # background recomputation and are served meanwhile
+        if now >= entry.refresh_at and key not in self._flights:
+            self._flights[key] = _Flight()
+            _refresh_pool.submit(self._refresh, key, args, kwargs)
+        metrics.CACHE_REQUESTS.inc(self.__name__, "hit" if now < entry.expires_at else "stale")
+        return entry
+
+    def peek(self, *args, **kwargs):
+        """
+        Return the cached value for the arguments like a call would, but None instead
+        of computing a missing value.
+        """
+        with self._lock:
+            entry = self._serve(self.make_key(args, kwargs), args, kwargs, time.monotonic())
+        return None if entry is None else entry.value
+
+    def prefetch(self, *args, **kwargs):
+        """
+        Start computing the value for the arguments in a background thread, unless it
+        is cached or already being computed. Callers of the key meanwhile wait for
+        this computation.
+        """
+        key = self.make_key(args, kwargs)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is not None and now < entry.stale_until) or key in self._flights:
+                return
+            self._flights[key] = _Flight()
+        _refresh_pool.submit(self._refresh, key, args, kwargs)
+
+    def _compute(self, key, flight, args, kwargs):
+        """Run the wrapped function for a key and publish the result to waiters"""
+        try:
+            with metrics.scoped(self.__name__):
+                if self.shared is None:
+                    computed_at = time.time()
+                    with metrics.CACHE_FILL_SECONDS.time(self.__name__):
+                        flight.value, age = self.func(*args, **kwargs), 0.0
+                else:
+                    flight.value, age, computed_at = self._compute_shared(key, args, kwargs)
+            self._store(key, flight.value, age, computed_at)
+        except Exception as error:
+            flight.error = error
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _compute_shared(self, key, args, kwargs):
+        """
+        Take the value of a key from the shared store, computing and storing it
+        first unless another process already did.
+
+        Returns:
+            tuple: (value, its age in seconds, Unix time its computation started)
+        """
+        name, key_digest = self.__name__, shared_store.digest(key)
+        with self.shared.lock(name, key_digest):
+            found = self.shared.get(name, key_digest)
+            if found is not None:
+                value, computed_at = found
+                age = max(time.time() - computed_at, 0.0)
+                if age < self.ttl * (1.0 - self.refresh_ahead) and computed_at >= self._stale_before:
+                    metrics.CACHE_REQUESTS.inc(name, "shared")
+                    return self._share(value, key_digest), age, computed_at
+
+            computed_at = time.time()
+            with metrics.CACHE_FILL_SECONDS.time(name):
+                value = self.func(*args, **kwargs)
+            replaced = getattr(found[0], "cache_token", None) if found is not None else None
+            if self.shared.put(name, key_digest, value, max_age=self.ttl + self.stale_ttl,
+                               computed_at=computed_at):
+                # Keep the mapped copy rather than this process's private one
+                found = self.shared.get(name, key_digest)
+                if found is not None:
+                    value = self._share(found[0], key_digest)
+        if replaced is not None and replaced != getattr(value, "cache_token", None):
+            # Values computed from the replaced frame go with it; workers still using it
+            # recompute what they need
+            self.shared.retire(replaced)
+        return value, 0.0, computed_at
+
+    def _share(self, value, key_digest):
+        """Let a mapped value share what it derives under its key"""
+        share = getattr(value, "share", None)
+        if share is not None:
+            share(self.shared, self.__name__, key_digest, self.ttl + self.stale_ttl)
+        return value
+
+    def _refresh(self, key, args, kwargs):
+        """Recompute a key in a background thread, keeping the old value on failure"""
+        with self._lock:
+            flight = self._flights.get(key)
+        if flight is None:
+            return
+        with self.context():
+            self._compute(key, flight, args, kwargs)
+        metrics.CACHE_REFRESHES.inc(self.__name__, "ok" if flight.error is None else "error")
+        if flight.error is not None:
+            logger.warning("Background refresh of %s%r failed: %r", self.__name__, key, flight.error)
+
+    def _store(self, key, value, age=0.0, computed_at=None):
+        """
+        Insert a computed value, evicting least recently used keys over the bounds.
+        A value whose computation started before the last mark_stale may have read
+        the data as it was before the change, so it is stored already due for refresh.
+        """
+        weight = self.weigher(value) if self.maxweight is not None else 0
+        with self._lock:
+            previous = self._entries.get(key)
+            self._discard(key)
+            entry = self._entries[key] = _Entry(value, weight, self.ttl, self.refresh_ahead, self.stale_ttl, age)
+            # Checked under the lock: a mark_stale setting _stale_before after this
+            # check marks the entry itself
+            if computed_at is not None and computed_at < self._stale_before:
+                entry.refresh_at = min(entry.refresh_at, time.monotonic())
+            self._weight += weight
+            # The newest entry is kept even if it alone exceeds maxweight
+            while len(self._entries) > self.maxsize or (
+                    self.maxweight is not None and self._weight > self.maxweight and len(self._entries) > 1):
+                self._discard(next(iter(self._entries)))
+        replaced = getattr(previous.value, "cache_token", None) if previous is not None else None
+        if replaced is not None and replaced != getattr(value, "cache_token", None):
+            # Results computed from a replaced frame are not requested anymore
+            retire_all(replaced)
+
+    def _discard(self, key):
+        """Remove a key if present; the lock must be held"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._weight -= entry.weight
+
+    def invalidate(self, *args, **kwargs):
+        """Drop the cached value for the given arguments"""
+        with self._lock:
+            self._discard(self.make_key(args, kwargs))
+
+    def retire(self, token):
+        """Drop the cached values whose key holds the object of a cache token"""
+        token = _Token(token)
+        with self._lock:
+            # Tokens are arguments, or values of (name, value) keyword pairs
+            for key in [key for key in self._entries
+                        if token in key or any(type(item) is tuple and token in item for item in key)]:
+                self._discard(key)
+
+    def mark_stale(self):
+        """
+        Make every cached value due for refresh. Values keep being served until
+        the background refresh triggered by their next call replaces them. Values of
+        computations in flight are stored due for refresh too, and shared values
+        whose computation started before this call are recomputed rather than reused.
+        """
+        now = time.monotonic()
+        self._stale_before = time.time()
+        with self._lock:
+            for entry in self._entries.values():
+                entry.refresh_at = min(entry.refresh_at, now)
+
+    def cache_clear(self):
+        """Drop every cached value"""
+        with self._lock:
+            self._entries.clear()
+            self._weight = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def clear_all():
+    """Drop the cached values of every cache, e.g. to measure cold requests"""
+    for cache in list(_instances):
+        cache.cache_clear()
+
+
+def retire_all(token):
+    """Drop the cached values of every cache whose key holds the object of a cache token"""
+    for cache in list(_instances):
+        cache.retire(token)
+
+
+def cached(ttl, refresh_ahead=0.1, stale_ttl=None, maxsize=128, context=None, maxweight=None, weigher=None,
+           shared=None):
+    """
+    Decorator caching function results in a TimedCache.
+
+    Args:
+        ttl (float): Seconds a computed value stays fresh
+        refresh_ahead (float): Fraction of ttl before expiry when a background refresh starts
+        stale_ttl (float): Seconds after expiry an old value may still be served (defaults to the ttl,
+            at most MAX_STALE_TTL)
+        maxsize (int): Maximum number of cached keys
+        context (callable): Context manager factory entered around background refreshes
+        maxweight (float): Maximum total weight of the cached values, or None for no bound
+        weigher (callable): Function giving the weight of a value
+        shared (shared_store.SharedStore): Store sharing the values across processes, or None
+
+    Returns:
+        function: Decorator producing a TimedCache around the function
+    """
+
+    def decorator(func):
+        return TimedCache(func, ttl, refresh_ahead, stale_ttl, maxsize, context, maxweight, weigher, shared)
+
+    return decorator
@@ -0,0 +1,250 @@
+"""
+Embedded Columnar Analytics Backend
+
+Runs the analytical reads of the API with DuckDB over Parquet files instead of
+Postgres, when ANALYTICS_BACKEND=duckdb. The source tables of models.py are read
+from PARQUET_DIR/<table>.parquet, either exported from Postgres (which stays the
+source of truth) or written by `python generate.py parquet`. The rollup tables are
+views computing the rollups.py aggregates on the fly, so the user features are
+grouped over solutions by DuckDB's vectorized engine whenever a frame is loaded.
+No database service is needed, e.g. for development, CI or offline analysis.
+
+duckdb (and pyarrow for the export) are optional dependencies, only imported when used
+(pip install -r requirements-duckdb.txt); create_app checks for duckdb at startup.
+
+Usage (from the backend folder):
+    python columnar.py export --out parquet     # write the Postgres tables as Parquet files
+    python columnar.py query "SELECT count(*) FROM user_features"
+"""
+
+import argparse
+import importlib.util
+import pathlib
+import re
+import threading
+import time
+
+from config import app, db, parquet_dir
+import metrics
+from models import BlogTag, Blog, Contest, Participation, Problem, ProblemTag, Solution, User
+import rollups
+
+# Source tables, exported to and read from Parquet files
+SOURCE_TABLES = [model.__table__ for model in (User, Contest, Problem, Blog, Participation, Solution,
+                                               ProblemTag, BlogTag)]
+
+# Month a contest started, e.g. '2024-03' (UTC), for a contests table aliased c
+CONTEST_MONTH = """strftime(make_timestamp(c."startTimeSeconds"::BIGINT * 1000000), '%Y-%m')"""
+
+# DuckDB dialect of the rollups.ROLLUPS queries, as views over the source tables
+ROLLUP_VIEWS = {
+    "blog_topic_rollup": """
+        SELECT bt.tag,
+               AVG(b.rating) AS avg_rating,
+               AVG(b."numberOfComments") AS avg_number_of_comments,
+               COUNT(*) AS number_of_blogs
+        FROM blogs AS b
+        JOIN blog_tags AS bt ON b.id = bt.blog_id
+        GROUP BY bt.tag
+        """,
+    "user_features": """
+        WITH latest_participation AS (
+            SELECT DISTINCT ON (p.user_handle)
+                   p.user_handle, p.new_rating, p.rating_change, c."startTimeSeconds"
+            FROM participations AS p
+            JOIN contests AS c ON p.contest_id = c.id
+            WHERE c."startTimeSeconds" IS NOT NULL
+            ORDER BY p.user_handle, c."startTimeSeconds" DESC, c.id DESC
+        ),
+        solved AS (
+            SELECT s.user_handle,
+                   count(*) AS number_of_solutions,
+                   AVG(pb.rating) AS avg_solutions_rating,
+                   AVG(pb.success_trials::DOUBLE /
+                       NULLIF(pb.success_trials + pb.unsuccess_trials, 0))
+                       AS avg_solutions_solvability
+            FROM solutions AS s
+            JOIN problems AS pb ON s.problem_contest_id = pb.contest_id
+                                 AND s.problem_index = pb.index
+            GROUP BY s.user_handle
+        )
+        SELECT lp.user_handle,
+               lp.new_rating AS rating,
+               -- Whole years, like the integer division of Postgres
+               (lp."startTimeSeconds" - u."registrationTimeSeconds") // (3600 * 24 * 365) AS experience,
+               COALESCE(sv.number_of_solutions, 0) AS number_of_solutions,
+               sv.avg_solutions_rating,
+               sv.avg_solutions_solvability
+        FROM latest_participation AS lp
+        JOIN users AS u ON u.handle = lp.user_handle
+        LEFT JOIN solved AS sv ON sv.user_handle = lp.user_handle
+        WHERE lp.rating_change <= 250
+        """,
+    "topic_month_rollup": f"""
+        SELECT {CONTEST_MONTH} AS month,
+               pt.tag,
+               COUNT(*) AS number_of_problems,
+               SUM(pb.success_trials) AS success_trials,
+               SUM(pb.unsuccess_trials) AS unsuccess_trials
+        FROM problems AS pb
+        JOIN contests AS c ON pb.contest_id = c.id
+        JOIN problem_tags AS pt ON pt.problem_contest_id = pb.contest_id
+                                AND pt.problem_index = pb.index
+        WHERE c."startTimeSeconds" IS NOT NULL
+        GROUP BY 1, pt.tag
+        """,
+    "user_rating_month": f"""
+        SELECT p.user_handle,
+               {CONTEST_MONTH} AS month,
+               (array_agg(p.new_rating ORDER BY c."startTimeSeconds" DESC, c.id DESC))[1] AS rating,
+               SUM(p.rating_change) AS rating_change,
+               COUNT(*) AS number_of_contests
+        FROM participations AS p
+        JOIN contests AS c ON p.contest_id = c.id
+        WHERE c."startTimeSeconds" IS NOT NULL
+        GROUP BY p.user_handle, 2
+        """,
+    # After user_rating_month, which it reads
+    "rating_band_month_rollup": f"""
+        SELECT urm.month,
+               {rollups.rating_band("urm.rating", 0)} AS min_rating,
+               {rollups.rating_band("urm.rating", 1)} AS band,
+               COUNT(*) AS number_of_users
+        FROM user_rating_month AS urm
+        GROUP BY 1, 2, 3
+        """,
+}
+
+# Rows fetched from Postgres per Parquet row group during an export
+EXPORT_BATCH_ROWS = 200_000
+
+_connection = None
+_connection_lock = threading.Lock()
+
+
+def require():
+    """Fail at startup, rather than on the first request, when duckdb is not installed"""
+    if importlib.util.find_spec("duckdb") is None:
+        raise RuntimeError(
+            "ANALYTICS_BACKEND=duckdb needs the duckdb package: pip install -r requirements-duckdb.txt "
+            "(or build the Docker image with --build-arg INSTALL_DUCKDB=1)"
+        )
+
+
+def connection():
+    """
+    Open the process-wide DuckDB database on first use, with a view per Parquet file
+    and per rollup.
+
+    Returns:
+        duckdb.DuckDBPyConnection: A cursor of the database for the calling thread
+    """
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            # Optional dependency, only needed for this backend
+            import duckdb
+
+            database = duckdb.connect(":memory:")
+            for table in SOURCE_TABLES:
+                path = parquet_dir / f"{table.name}.parquet"
+                if path.exists():
+                    database.execute(f"CREATE VIEW {table.name} AS SELECT * FROM read_parquet('{path}')")
+            for name, sql in ROLLUP_VIEWS.items():
+                database.execute(f"CREATE VIEW {name} AS {sql}")
+            _connection = database
+    # Cursors are separate connections to the same database, one per thread
+    return _connection.cursor()
+
+
+def read(sql, params=None):
+    """
+    Run a read query on DuckDB.
+
+    Args:
+        sql (str): SQL text, with :name parameters like the Postgres queries
+        params (dict): Query parameters
+
+    Returns:
+        list[tuple]: Result rows
+    """
+    cursor = connection()
+    started = time.perf_counter()
+    try:
+        rows = cursor.execute(re.sub(r"(?<!:):(\w+)", r"$\1", sql), params or None).fetchall()
+    finally:
+        cursor.close()
+    metrics.SQL_SECONDS.observe(time.perf_counter() - started, metrics.scope.get())
+    metrics.SQL_ROWS.observe(len(rows), metrics.scope.get())
+    return rows
+
+
+def arrow_type(column):
+    """
+    Args:
+        column (sqlalchemy.Column): Column of a models.py table
+
+    Returns:
+        pyarrow.DataType: Parquet type holding its values
+    """
+    import pyarrow as pa
+
+    if isinstance(column.type, db.Integer):  # BigInteger included
+        return pa.int64()
+    if isinstance(column.type, db.Float):
+        return pa.float64()
+    return pa.string()
+
+
+def export(out_dir):
+    """
+    Write every source table to out_dir/<table>.parquet, streaming the rows from
+    the primary database. Must run inside an application context.
+
+    Args:
+        out_dir (pathlib.Path): Folder receiving the Parquet files
+
+    Returns:
+        dict: Table name -> number of exported rows
+    """
+    # Optional dependency, only needed for the export
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    counts = {}
+    for table in SOURCE_TABLES:
+        schema = pa.schema([(column.name, arrow_type(column)) for column in table.columns])
+        temporary = out_dir / f"{table.name}.parquet.tmp"
+        counts[table.name] = 0
+        with pq.ParquetWriter(temporary, schema) as writer:
+            result = db.session.execute(table.select(), execution_options={"yield_per": EXPORT_BATCH_ROWS})
+            for rows in result.partitions():
+                columns = list(zip(*rows))
+                writer.write_table(pa.table(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+                counts[table.name] += len(rows)
+        # Readers never see a partially written file
+        temporary.replace(out_dir / f"{table.name}.parquet")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedded columnar analytics backend")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write the Postgres tables as Parquet files")
+    export_parser.add_argument("--out", type=pathlib.Path, default=parquet_dir,
+                               help="Output folder (defaults to PARQUET_DIR)")
+    query_parser = subparsers.add_parser("query", help="Run a query with DuckDB over PARQUET_DIR")
+    query_parser.add_argument("sql")
+    args = parser.parse_args()
+
+    started = time.time()
+    if args.command == "export":
+        with app.app_context():
+            for name, count in export(args.out).items():
+                print(f"{name}: {count} rows")
+    else:
+        for row in read(args.sql):
+            print(*row, sep="\t")
+    print(f"Done in {time.time() - started:.1f}s")
@@ -0,0 +1,308 @@
+"""
+Response Formats
+
+Endpoints return Payload objects whose tabular parts are Table instances holding one
+NumPy array per field, so no per-row objects are built unless a client asks for them.
+The negotiated decorator picks the media type from the Accept header, and a payload is
+encoded at most once per media type (cached payloads keep their encodings):
+    - application/json: rows as objects, the original format of the API (default)
+    - application/vnd.columns+json: one array per field
+    - application/msgpack: MessagePack where numeric arrays are maps of
+      {"dtype", "shape", "data"}, data holding the raw little-endian values that
+      clients can view as typed arrays (e.g. Float64Array) without parsing
+
+Every encoding is compressed at most once per content coding (br, gzip) and addressed
+by a hash of its bytes. Payloads of a cache shared across processes keep their
+encodings and compressed variants in the shared store too (see Payload.share), so
+the worker processes map the same bytes rather than each holding its own copy. Responses carry an ETag and Last-Modified, and conditional
+requests matching them are answered with 304 Not Modified, so a cache hit costs a
+few dictionary lookups and a write of prepared bytes.
+
+Several payloads can also be streamed in one response as newline-delimited JSON
+(application/x-ndjson, see streamed), each line sent as soon as it is ready.
+"""
+
+from email.utils import formatdate
+import functools
+import gzip
+import hashlib
+import json
+import time
+import zlib
+
+import brotli
+from flask import Response, request
+import msgpack
+import numpy as np
+
+import metrics
+
+JSON = "application/json"
+COLUMNS_JSON = "application/vnd.columns+json"
+MSGPACK = "application/msgpack"
+NDJSON = "application/x-ndjson"
+
+# Content coding -> function compressing bytes, in order of preference. Bodies are
+# compressed once and served many times, but the first request of a multi-megabyte
+# body waits for it: higher levels cost seconds for a few percent.
+COMPRESSORS = {
+    "br": lambda body: brotli.compress(body, quality=4),
+    "gzip": lambda body: gzip.compress(body, compresslevel=6, mtime=0),
+}
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESSED_SIZE = 1024
+
+
+def _brotli_stream():
+    compressor = brotli.Compressor(quality=4)
+    return compressor.process, compressor.flush, compressor.finish
+
+
+def _gzip_stream():
+    # wbits 31: deflate in a gzip container
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+# Content coding -> factory of (compress, flush, finish) functions of an incremental
+# compressor, for streamed bodies, in order of preference
+STREAM_COMPRESSORS = {
+    "br": _brotli_stream,
+    "gzip": _gzip_stream,
+}
+
+
+class Table:
+    """
+    Rows stored as named column arrays of equal length.
+
+    Args:
+        **columns: Field name -> np.ndarray of the field in every row
+    """
+
+    def __init__(self, **columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def rows(self):
+        """
+        Returns:
+            list[dict]: One dictionary per row
+        """
+        names = list(self.columns)
+        return [dict(zip(names, values)) for values in zip(*(column.tolist() for column in self.columns.values()))]
+
+
+def _json_default(value, rows):
+    """Convert values json cannot serialize, with tables as rows or as columns"""
+    if isinstance(value, Table):
+        return value.rows() if rows else {name: column.tolist() for name, column in value.columns.items()}
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _msgpack_default(value):
+    """Convert values msgpack cannot serialize, keeping numeric arrays binary"""
+    if isinstance(value, Table):
+        return value.columns
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind not in "biuf":
+            return value.tolist()
+        value = value.astype(value.dtype.newbyteorder("<"), copy=False)
+        return {"dtype": value.dtype.name, "shape": list(value.shape), "data": np.ascontiguousarray(value).tobytes()}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not MessagePack serializable")
+
+
+# Media type -> function encoding a value to bytes
+ENCODERS = {
+    JSON: lambda value: json.dumps(value, default=functools.partial(_json_default, rows=True)).encode(),
+    COLUMNS_JSON: lambda value: json.dumps(value, default=functools.partial(_json_default, rows=False)).encode(),
+    MSGPACK: lambda value: msgpack.packb(value, default=_msgpack_default),
+}
+
+
+def _timed(label, function, value):
+    """Encode or compress a value, timing it under the given format label"""
+    with metrics.ENCODE_SECONDS.time(metrics.scope.get(), label):
+        return function(value)
+
+
+class Encoding:
+    """
+    Payload encoded in one media type, remembering its compressed variants.
+
+    Args:
+        body (bytes | memoryview): Encoded payload
+        last_modified (float): Unix time the payload was computed
+        derive (callable): Function (suffix, make) returning bytes shared with the
+            other processes (see shared_store.SharedStore.derive), or None
+    """
+
+    def __init__(self, body, last_modified, derive=None):
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.last_modified = last_modified
+        self._derive = derive
+        self._compressed = {}
+
+    def compressed(self, coding):
+        """
+        Args:
+            coding (str): One of COMPRESSORS
+
+        Returns:
+            bytes | memoryview: The body compressed with the given content coding
+        """
+        body = self._compressed.get(coding)
+        if body is None:
+            make = functools.partial(_timed, coding, COMPRESSORS[coding], self.body)
+            body = self._compressed.setdefault(coding, make() if self._derive is None else self._derive(coding, make))
+        return body
+
+
+class Payload:
+    """
+    Endpoint result remembering its encodings.
+
+    Args:
+        value: JSON-like value whose parts may be Table instances or NumPy arrays
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.last_modified = time.time()
+        self._encoded = {}
+        self._shared = None
+
+    def __len__(self):
+        """Number of rows, used to weigh cached payloads"""
+        return len(self.value)
+
+    def __getstate__(self):
+        # Encodings are shared separately, under the key of the payload
+        return {"value": self.value, "last_modified": self.last_modified}
+
+    def __setstate__(self, state):
+        self.__init__(state["value"])
+        self.last_modified = state["last_modified"]
+
+    def share(self, store, name, key_digest, max_age):
+        """
+        Keep the encodings of a payload mapped from a shared store in that store,
+        named after the payload's key, so that every process maps the same bytes.
+
+        Args:
+            store (shared_store.SharedStore): Store holding the payload
+            name (str): Name of the cache
+            key_digest (str): Digest of the key of the payload
+            max_age (float): Seconds after which the files of the cache are useless
+        """
+        self._shared = (store, name, key_digest, max_age)
+
+    def _derive(self, suffix, make):
+        """Bytes derived from the payload, shared if the payload is"""
+        if self._shared is None:
+            return make()
+        store, name, key_digest, max_age = self._shared
+        # The computation time tells the payload apart from older values of its key
+        return store.derive(name, key_digest, f"{self.last_modified!r}:{suffix}", make, max_age)
+
+    def encode(self, media_type):
+        """
+        Args:
+            media_type (str): One of ENCODERS
+
+        Returns:
+            Encoding: The value in the given format
+        """
+        encoding = self._encoded.get(media_type)
+        if encoding is None:
+            # Concurrent first requests may both encode; either result is kept
+            body = self._derive(media_type, functools.partial(_timed, media_type, ENCODERS[media_type], self.value))
+            derive = None
+            if self._shared is not None:
+                derive = lambda coding, make: self._derive(f"{media_type}:{coding}", make)
+            encoding = self._encoded.setdefault(media_type, Encoding(body, self.last_modified, derive))
+        return encoding
+
+
+def not_modified(encoding):
+    """Tell whether the conditional headers of the request match an encoding"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(encoding.etag)
+    if request.if_modified_since:
+        # HTTP dates have a one second resolution
+        return int(encoding.last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+
+def negotiated(func):
+    """
+    Decorator turning a function returning a Payload into an endpoint answering in
+    the format preferred by the Accept header and the compression preferred by the
+    Accept-Encoding header, or with 304 Not Modified to a matching conditional request.
+
+    Args:
+        func (callable): Function returning a Payload
+
+    Returns:
+        function: Endpoint returning a Flask response
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # JSON comes first, so clients accepting anything get the original format
+        media_type = request.accept_mimetypes.best_match(list(ENCODERS), default=JSON)
+        encoding = func(*args, **kwargs).encode(media_type)
+        # Compressed variants carry the same meaning, hence a weak ETag shared by all of them
+        headers = {
+            "ETag": f'W/"{encoding.etag}"',
+            "Last-Modified": formatdate(encoding.last_modified, usegmt=True),
+            "Cache-Control": "no-cache",
+            "Vary": "Accept, Accept-Encoding",
+        }
+        if not_modified(encoding):
+            return Response(status=304, headers=headers)
+
+        body = encoding.body
+        coding = request.accept_encodings.best_match(list(COMPRESSORS)) if len(body) >= MIN_COMPRESSED_SIZE else None
+        if coding is not None:
+            body = encoding.compressed(coding)
+            headers["Content-Encoding"] = coding
+        # Shared bodies are views of a mapping, copied for the length of the response
+        return Response(bytes(body), mimetype=media_type, headers=headers)
+
+    return wrapper
+
+
+def streamed(lines):
+    """
+    Stream lines as a newline-delimited JSON response, compressed in the coding
+    preferred by the Accept-Encoding header. The compressor is flushed after every
+    line, so each line reaches the client as soon as it is produced.
+
+    Args:
+        lines (iterable): Encoded JSON documents (bytes), each ending with a newline
+
+    Returns:
+        Response: Streamed Flask response
+    """
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    coding = request.accept_encodings.best_match(list(STREAM_COMPRESSORS))
+    if coding is None:
+        return Response(lines, mimetype=NDJSON, headers=headers)
+
+    def compressed():
+        compress, flush, finish = STREAM_COMPRESSORS[coding]()
+        for line in lines:
+            yield compress(line) + flush()
+        yield finish()
+
+    headers["Content-Encoding"] = coding
+    return Response(compressed(), mimetype=NDJSON, headers=headers)
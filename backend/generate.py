@@ -0,0 +1,318 @@
+"""
+Synthetic Dataset Generator
+
+Produces a Codeforces-like dataset matching models.py at a configurable scale factor,
+for benchmarking without the LFS dumps. Scale 1 has about 20k users, 300k
+participations and 1M solutions over a fixed history of 2061 contests; users,
+participations, solutions and blogs grow linearly with the scale (100 gives about
+100M solutions). The distributions follow the real data:
+    - user skill is roughly normal around 1400 with a long right tail, and ratings
+      converge to it over a user's contests
+    - activity (contests entered, problems solved) is heavy tailed, and more active
+      users tend to be stronger
+    - problem ratings grow with the problem index within a contest, and users mostly
+      solve problems around their own rating
+    - problem tags and blog tags follow a Zipf-like popularity
+Rows are generated in chunks with NumPy and streamed either into PostgreSQL COPY
+through loader.py (which replaces the loaded tables, restores keys and indexes and
+rebuilds the rollups) or into Parquet files, one per table (needs pyarrow).
+
+Usage (from the backend folder):
+    python generate.py postgres --scale 10             # replace the database contents
+    python generate.py parquet --scale 100 --out PATH  # write PATH/<table>.parquet
+"""
+
+import argparse
+import pathlib
+import time
+
+import numpy as np
+
+from config import app, db
+import loader
+import rollups
+from routes import supertopics
+
+# Size of the dataset at scale 1
+CONTESTS = 2061
+USERS = 20_000
+BLOGS = 5_000
+PARTICIPATIONS_PER_USER = 15
+SOLUTIONS_PER_USER = 50
+
+# Time span of the generated history (Unix seconds, 2010-01-01 to 2025-01-01)
+HISTORY_START, HISTORY_END = 1_262_304_000, 1_735_689_600
+
+# Users generated at once
+CHUNK_USERS = 20_000
+
+# Problem tags by decreasing popularity
+TAGS = [
+    "implementation", "math", "greedy", "dp", "data structures", "brute force",
+    "constructive algorithms", "graphs", "sortings", "binary search", "dfs and similar",
+    "trees", "strings", "number theory", "combinatorics", "two pointers", "bitmasks",
+    "geometry", "dsu", "shortest paths", "probabilities", "divide and conquer", "hashing",
+    "games", "interactive", "flows", "matrices", "string suffix structures",
+    "graph matchings", "fft", "ternary search", "expression parsing", "meet-in-the-middle",
+    "2-sat", "chinese remainder theorem", "schedules", "*special",
+]
+
+# Blog tags by decreasing popularity
+BLOG_TAGS = list(supertopics)
+
+# Columns of every generated table (loader.COLUMNS plus contests)
+COLUMNS = dict(loader.COLUMNS, contests=["id", "startTimeSeconds"])
+
+
+def zipf_weights(count, exponent=1.1):
+    """Probabilities of `count` items whose popularity decays with their rank"""
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def contests(rng):
+    """Contest ids in chronological order with their start times"""
+    start_times = np.sort(rng.integers(HISTORY_START, HISTORY_END, CONTESTS))
+    return np.arange(1, CONTESTS + 1), start_times
+
+
+def problems(rng, contest_ids, scale):
+    """
+    Problems A, B, C, ... of every contest, harder with every index.
+
+    Returns:
+        dict: Column name -> array, for the problems table
+    """
+    per_contest = rng.integers(4, 9, len(contest_ids))
+    contest = np.repeat(contest_ids, per_contest)
+    position = np.arange(len(contest)) - np.repeat(np.cumsum(per_contest) - per_contest, per_contest)
+    rating = np.clip(np.round((800 + 350 * position + rng.normal(0, 250, len(contest))) / 100) * 100, 800, 3500)
+
+    # Fewer people try and solve harder problems
+    success = rng.poisson(2000 * scale * np.exp(-(rating - 800) / 500))
+    failures = rng.poisson(success * (0.5 + (rating - 800) / 1000) + 1)
+    return {
+        "contest_id": contest,
+        "index": np.array(list("ABCDEFGH"))[position],
+        "rating": rating.astype(np.int64),
+        "success_trials": success,
+        "unsuccess_trials": failures,
+    }
+
+
+def problem_tags(rng, problem_table):
+    """One to six tags per problem, drawn by popularity"""
+    per_problem = np.clip(rng.poisson(2.2, len(problem_table["contest_id"])), 1, 6)
+    problem = np.repeat(np.arange(len(per_problem)), per_problem)
+    tag = rng.choice(len(TAGS), size=len(problem), p=zipf_weights(len(TAGS)))
+    codes = np.unique(problem * len(TAGS) + tag)
+    problem, tag = np.divmod(codes, len(TAGS))
+    return {
+        "problem_contest_id": problem_table["contest_id"][problem],
+        "problem_index": problem_table["index"][problem],
+        "tag": np.array(TAGS)[tag],
+    }
+
+
+def user_chunk(rng, first, count, contest_starts, problem_table, problem_starts):
+    """
+    Users with their participations and solutions.
+
+    Args:
+        rng (np.random.Generator): Random source
+        first (int): Number of the first user of the chunk
+        count (int): Number of users
+        contest_starts (np.ndarray): Start time of every contest (contest id - 1)
+        problem_table (dict): Columns of the problems table
+        problem_starts (np.ndarray): Start time of the contest of every problem
+
+    Returns:
+        dict: Table name -> columns for users, participations and solutions
+    """
+    handles = np.array([f"user{number}" for number in range(first, first + count)], dtype=object)
+    activity = rng.lognormal(0.0, 1.0, count) / np.exp(0.5)
+    # Most users sit around 1400, a few percent far above
+    skill = np.clip(rng.normal(1250, 330, count) + 150 * np.log1p(activity)
+                    + rng.exponential(250, count) * (rng.random(count) < 0.05), 0, 3800)
+    registration = rng.integers(HISTORY_START - 86400 * 365, HISTORY_END - 86400 * 30, count)
+
+    # Contests entered after registering, each chosen at random among the later ones
+    first_contest = np.searchsorted(contest_starts, registration)
+    available = len(contest_starts) - first_contest
+    entered = np.minimum(rng.poisson(PARTICIPATIONS_PER_USER * activity) + 1, available)
+    user = np.repeat(np.arange(count), entered)
+    contest = np.repeat(first_contest, entered) + (rng.random(len(user)) * np.repeat(available, entered)).astype(np.int64)
+    user, contest = np.divmod(np.unique(user * len(contest_starts) + contest), len(contest_starts))
+
+    # Ratings converge from 1400 to the user's skill over their contests (in time order)
+    entered = np.bincount(user, minlength=count)
+    step = np.arange(len(user)) - np.repeat(np.cumsum(entered) - entered, entered)
+    rating = np.round(skill[user] - (skill[user] - 1400) * np.exp(-(step + 1) / 6)
+                      + rng.normal(0, 40, len(user))).astype(np.int64)
+    previous = np.where(step == 0, 1400, np.roll(rating, 1))
+    rank = np.maximum(1, (20000 / (1 + np.exp((rating - 1500) / 250)) * rng.uniform(0.7, 1.3, len(user)))).astype(np.int64)
+
+    # Solved problems are rated around the user's skill and solved after the contest started
+    ratings_order = np.argsort(problem_table["rating"], kind="stable")
+    sorted_ratings = problem_table["rating"][ratings_order]
+    solved = np.minimum(rng.poisson(SOLUTIONS_PER_USER * activity), len(sorted_ratings))
+    solver = np.repeat(np.arange(count), solved)
+    target = np.round((skill[solver] - 100 + rng.normal(0, 300, len(solver))) / 100) * 100
+    # Pick among the problems of the target rating, or the next rated one when there are none
+    low = np.minimum(np.searchsorted(sorted_ratings, target, side="left"), len(sorted_ratings) - 1)
+    high = np.maximum(np.searchsorted(sorted_ratings, target, side="right"), low + 1)
+    problem = ratings_order[low + (rng.random(len(solver)) * (high - low)).astype(np.int64)]
+    solver, problem = np.divmod(np.unique(solver * len(ratings_order) + problem), len(ratings_order))
+    earliest = np.maximum(registration[solver], problem_starts[problem])
+    solved_at = earliest + (rng.random(len(solver)) * (HISTORY_END - earliest)).astype(np.int64)
+
+    return {
+        "users": {"handle": handles, "registrationTimeSeconds": registration},
+        "participations": {
+            "user_handle": handles[user],
+            "contest_id": contest + 1,
+            "rank": rank,
+            "new_rating": rating,
+            "rating_change": rating - previous,
+        },
+        "solutions": {
+            "user_handle": handles[solver],
+            "problem_contest_id": problem_table["contest_id"][problem],
+            "problem_index": problem_table["index"][problem],
+            "timeSeconds": solved_at,
+        },
+    }
+
+
+def blogs(rng, scale):
+    """Blogs with a skewed rating and comment count, and one to three tags each"""
+    count = BLOGS * scale
+    ids = np.arange(1, count + 1)
+    per_blog = rng.integers(1, 4, count)
+    blog = np.repeat(ids, per_blog)
+    tag = rng.choice(len(BLOG_TAGS), size=len(blog), p=zipf_weights(len(BLOG_TAGS)))
+    blog, tag = np.divmod(np.unique(blog * len(BLOG_TAGS) + tag), len(BLOG_TAGS))
+    return {
+        "blogs": {
+            "id": ids,
+            "title": np.array([f"Blog post {number}" for number in ids], dtype=object),
+            "rating": np.round(rng.normal(5, 20, count) + rng.exponential(10, count)).astype(np.int64),
+            "numberOfComments": np.floor(rng.lognormal(2.0, 1.2, count)).astype(np.int64),
+        },
+        "blog_tags": {"blog_id": blog, "tag": np.array(BLOG_TAGS, dtype=object)[tag]},
+    }
+
+
+def generate(scale, seed=0):
+    """
+    Generate the dataset chunk by chunk.
+
+    Args:
+        scale (int): Scale factor
+        seed (int): Seed of the random generator; the same seed gives the same data
+
+    Yields:
+        tuple: (table name, dict of column name -> array) in foreign key order
+    """
+    rng = np.random.default_rng(seed)
+    contest_ids, contest_starts = contests(rng)
+    problem_table = problems(rng, contest_ids, scale)
+    problem_starts = contest_starts[problem_table["contest_id"] - 1]
+
+    yield "contests", {"id": contest_ids, "startTimeSeconds": contest_starts}
+    yield "problems", problem_table
+    yield "problem_tags", problem_tags(rng, problem_table)
+    for first in range(0, USERS * scale, CHUNK_USERS):
+        count = min(CHUNK_USERS, USERS * scale - first)
+        yield from user_chunk(rng, first, count, contest_starts, problem_table, problem_starts).items()
+    yield from blogs(rng, scale).items()
+
+
+def rows(columns):
+    """Turn a dict of column arrays into row tuples"""
+    return zip(*(column.tolist() for column in columns.values()))
+
+
+def to_postgres(scale, seed=0):
+    """
+    Replace the contents of the loaded tables with generated data, then restore keys
+    and indexes and rebuild the rollups as loader.py does.
+
+    Returns:
+        dict: Table name -> number of generated rows
+    """
+    # Forget any interrupted load, its checkpoints refer to other data
+    with db.engine.begin() as connection:
+        connection.execute(db.text(f"DROP TABLE IF EXISTS load_checkpoints, {loader.CONTEST_TIMES}"))
+    loader.prepare(replace=True)
+
+    counts = {}
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for table, columns in generate(scale, seed):
+            if table == "contests":
+                # Contests are derived from the staging table by loader.finish()
+                table = loader.CONTEST_TIMES
+                columns = {"contest_id": columns["id"], "start_time": columns["startTimeSeconds"],
+                           "source": np.full(len(columns["id"]), loader.FROM_PARTICIPATIONS)}
+            loader.copy_rows(cursor, table, rows(columns))
+            connection.commit()
+            counts[table] = counts.get(table, 0) + len(next(iter(columns.values())))
+    finally:
+        connection.close()
+
+    loader.finish()
+    rollups.refresh(full=True)
+    return counts
+
+
+def to_parquet(scale, out_dir, seed=0):
+    """
+    Write the generated data to one Parquet file per table.
+
+    Args:
+        scale (int): Scale factor
+        out_dir (pathlib.Path): Folder receiving <table>.parquet
+        seed (int): Seed of the random generator
+
+    Returns:
+        dict: Table name -> number of generated rows
+    """
+    # Optional dependency, only needed for this output
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    writers, counts = {}, {}
+    try:
+        for table, columns in generate(scale, seed):
+            batch = pa.table({name: columns[name] for name in COLUMNS[table]})
+            if table not in writers:
+                writers[table] = pq.ParquetWriter(out_dir / f"{table}.parquet", batch.schema)
+            writers[table].write_table(batch)
+            counts[table] = counts.get(table, 0) + batch.num_rows
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic Codeforces dataset")
+    parser.add_argument("target", choices=["postgres", "parquet"], help="Where the rows are written")
+    parser.add_argument("--scale", type=int, default=1, help="Scale factor (1 is about 1M solutions)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--out", type=pathlib.Path, default=pathlib.Path("synthetic"),
+                        help="Output folder of the parquet target")
+    args = parser.parse_args()
+
+    started = time.time()
+    if args.target == "postgres":
+        with app.app_context():
+            counts = to_postgres(args.scale, args.seed)
+    else:
+        counts = to_parquet(args.scale, args.out, args.seed)
+    for table, count in counts.items():
+        print(f"{table}: {count} rows")
+    print(f"Generated in {time.time() - started:.1f}s")
@@ -0,0 +1,24 @@
+"""
+Gunicorn Configuration
+
+Serves the Connexion application on several uvicorn workers. Every worker is a
+separate process with its own database pool; cached datasets are computed once and
+shared by the workers through SHARED_CACHE_DIR (see shared_store.py).
+
+Usage (from the backend folder):
+    gunicorn -c gunicorn.conf.py "app:create_app()"
+"""
+
+import multiprocessing
+import os
+
+# Read by the workers, which inherit the environment of the master
+os.environ.setdefault("SHARED_CACHE_DIR", "/dev/shm/codeforces-insights")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count(), 4)))
+worker_class = "uvicorn.workers.UvicornWorker"
+# The first request of a worker may load a full dataset
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+keepalive = 5
+accesslog = "-"
@@ -0,0 +1,291 @@
+"""
+Incremental Delta Ingest
+
+Takes new contests, participations and solutions into an already loaded database
+without reloading it. Delta files use the dump formats understood by loader.py, plus
+an optional contests.json with "id" and "startTimeSeconds" fields. Only the new rows,
+told apart by the stored watermarks, are kept:
+    - contests starting after the contests watermark, with their problems, problem
+      tags and participations
+    - solutions submitted since the second of the solutions watermark, other than the
+      ones already stored for that second (a later delta may complete it)
+Rows are upserted in batches inside one transaction together with the new watermarks.
+
+Afterwards the rollups are refreshed incrementally and only the cached datasets
+affected by the changed tags, ratings and users, or reading a rewritten rollup, get
+their cache_versions bumped, which makes the API workers recompute just those (see
+routes.sync_cache_versions).
+
+Usage (from the backend folder):
+    python ingest.py --data-dir PATH
+"""
+
+import argparse
+import pathlib
+import time
+
+from psycopg2.extras import execute_values
+
+from config import app, db
+from models import Base, CacheVersion, IngestWatermark
+import loader
+import partitions
+import rollups
+
+# Columns written for every upserted table
+COLUMNS = dict(loader.COLUMNS, contests=["id", "startTimeSeconds"])
+
+# Tables in foreign key order, with the delta file feeding each of them
+TABLE_FILES = [
+    ("users", "users2061.json"),
+    ("contests", "contests.json"),
+    ("problems", "problems.json"),
+    ("problem_tags", "problem_tags.json"),
+    ("participations", "participations2061.json"),
+    ("solutions", "solutions.json"),
+]
+
+# Tables whose existing rows are kept as they are on conflict
+KEEP_EXISTING = {"users", "problem_tags"}
+
+# Position of the contest id in the rows of tables filtered by new contests
+CONTEST_COLUMN = {"problems": 0, "problem_tags": 0, "participations": 1}
+
+# Cached routes.py datasets depending on each kind of change: the frames read the
+# source tables (problem ratings and tags, the users of new participations and solutions)
+AFFECTED_DATASETS = {
+    "tags": ["topic_frame"],
+    "ratings": ["topic_frame"],
+    "users": ["user_frame"],
+}
+
+# Cached routes.py datasets reading each rollup table, affected when the refresh
+# following the ingest wrote rows to it
+ROLLUP_DATASETS = {
+    "user_features": ["user_frame"],
+    "topic_month_rollup": ["_topics_by_month"],
+    "user_rating_month": ["_rating_trajectory"],
+    "rating_band_month_rollup": ["_rating_bands_by_month"],
+    "blog_topic_rollup": ["get_blog_topics_data"],
+}
+
+
+def contest_rows(record):
+    yield "contests", (loader.pick(record, "id", "contestId"), loader.pick(record, "startTimeSeconds"))
+
+
+# Record converters by delta file
+CONVERTERS = {dump.file: dump.rows for dump in loader.DUMPS}
+CONVERTERS["contests.json"] = contest_rows
+
+
+def read_watermarks():
+    """
+    Load the ingest watermarks, starting from the newest data in the database
+    when nothing has been ingested yet.
+
+    Returns:
+        dict: Watermark name -> newest timestamp already ingested
+    """
+    stored = dict(db.session.execute(db.text("SELECT name, value FROM ingest_watermarks")).all())
+    return {
+        "contests_start_time": stored.get("contests_start_time", db.session.execute(db.text(
+            'SELECT COALESCE(MAX("startTimeSeconds"), 0) FROM contests'
+        )).scalar()),
+        "solutions_time": stored.get("solutions_time", db.session.execute(db.text(
+            'SELECT COALESCE(MAX("timeSeconds"), 0) FROM solutions'
+        )).scalar()),
+    }
+
+
+def find_new_contests(data_dir, watermark):
+    """
+    Collect the contests starting after the watermark, from contests.json or, for
+    contests missing there, from the earliest time in their participation records.
+
+    Args:
+        data_dir (pathlib.Path): Folder containing the delta files
+        watermark (int): Contests watermark
+
+    Returns:
+        dict: Contest id -> start time
+    """
+    start_times = {}
+    path = data_dir / "contests.json"
+    if path.exists():
+        for record in loader.JsonRecordReader(path):
+            for _, (contest_id, start_time) in contest_rows(record):
+                start_times[contest_id] = start_time
+    listed = set(start_times)
+
+    path = data_dir / "participations2061.json"
+    if path.exists():
+        for record in loader.JsonRecordReader(path):
+            for table, row in loader.participation_rows(record):
+                if table != loader.CONTEST_TIMES or row[0] in listed:
+                    continue
+                contest_id, start_time, _ = row
+                if contest_id not in start_times or start_time < start_times[contest_id]:
+                    start_times[contest_id] = start_time
+    return {contest_id: start_time for contest_id, start_time in start_times.items()
+            if start_time > watermark}
+
+
+def upsert_sql(table_name):
+    """Build an INSERT ... ON CONFLICT statement for execute_values"""
+    table = Base.metadata.tables[table_name]
+    columns = COLUMNS[table_name]
+    keys = [column.name for column in table.primary_key.columns]
+    updates = [column for column in columns if column not in keys]
+    sql = (f"INSERT INTO {loader.quote(table_name)} ({', '.join(map(loader.quote, columns))}) "
+           f"VALUES %s ON CONFLICT ({', '.join(map(loader.quote, keys))}) ")
+    if table_name in KEEP_EXISTING or not updates:
+        return sql + "DO NOTHING"
+    return sql + "DO UPDATE SET " + ", ".join(
+        f"{loader.quote(column)} = EXCLUDED.{loader.quote(column)}" for column in updates
+    )
+
+
+def delete_replaced_sql(table_name):
+    """
+    Build a DELETE statement for execute_values removing the rows that delta rows of a
+    partitioned table replace: ON CONFLICT only sees its primary key, which also holds
+    the partition key (see partitions.UNIQUE_KEYS)
+    """
+    key = partitions.UNIQUE_KEYS[table_name]
+    matches = " AND ".join(f"t.{loader.quote(column)} = v.{loader.quote(column)}" for column in key)
+    return (f"DELETE FROM {loader.quote(table_name)} AS t "
+            f"USING (VALUES %s) AS v ({', '.join(map(loader.quote, key))}) WHERE {matches}")
+
+
+def solutions_at(time_seconds):
+    """Solutions stored for one second, as (user_handle, problem_contest_id, problem_index, timeSeconds) rows"""
+    return set(db.session.execute(db.text(
+        'SELECT user_handle, problem_contest_id, problem_index, "timeSeconds" FROM solutions '
+        'WHERE "timeSeconds" = :time_seconds'
+    ), {"time_seconds": time_seconds}).tuples())
+
+
+def accepts(table, row, new_contests, watermarks, known_solutions):
+    """
+    Tell whether a converted row belongs to the delta. Solutions of the watermark's
+    second are taken unless already stored (known_solutions), since the previous delta
+    may have held only part of that second.
+    """
+    if table in CONTEST_COLUMN:
+        return row[CONTEST_COLUMN[table]] in new_contests
+    if table == "solutions":
+        watermark = watermarks["solutions_time"]
+        return row[3] > watermark or (row[3] == watermark and tuple(row) not in known_solutions)
+    return True
+
+
+def ingest(data_dir, batch_size=5000):
+    """
+    Upsert the rows of the delta files newer than the stored watermarks, refresh the
+    rollups and bump the versions of the affected cached datasets.
+
+    Args:
+        data_dir (pathlib.Path): Folder containing the delta files
+        batch_size (int): Number of rows per INSERT statement
+
+    Returns:
+        dict: Changed tags, ratings and users, each a set
+    """
+    Base.metadata.create_all(db.engine, tables=[IngestWatermark.__table__, CacheVersion.__table__])
+    watermarks = read_watermarks()
+    new_contests = find_new_contests(data_dir, watermarks["contests_start_time"])
+    known_solutions = solutions_at(watermarks["solutions_time"])
+    changes = {"tags": set(), "ratings": set(), "users": set()}
+    new_watermarks = dict(watermarks)
+
+    # Partitions for the new contests (and the coming year of solutions) before writing
+    partitions.ensure(db.session.connection(), newest_contest=max(new_contests, default=None))
+    connection = db.session.connection().connection
+    cursor = connection.cursor()
+
+    def flush(table, rows):
+        # rows maps keys (the leading columns) to rows: a statement may not update the
+        # same row twice
+        if table in partitions.UNIQUE_KEYS:
+            execute_values(cursor, delete_replaced_sql(table), list(rows), page_size=batch_size)
+        execute_values(cursor, upsert_sql(table), list(rows.values()), page_size=batch_size)
+        rows.clear()
+
+    for table, file in TABLE_FILES:
+        if table == "contests":
+            # Contests are known upfront, either from contests.json or derived
+            rows = {(contest_id,): (contest_id, start_time) for contest_id, start_time in new_contests.items()}
+            if rows:
+                flush(table, rows)
+            continue
+        path = data_dir / file
+        if not path.exists():
+            continue
+
+        key_length = len(partitions.UNIQUE_KEYS.get(table, Base.metadata.tables[table].primary_key.columns))
+        pending = {}
+        for record in loader.JsonRecordReader(path):
+            for row_table, row in CONVERTERS[file](record):
+                if row_table != table or not accepts(table, row, new_contests, watermarks, known_solutions):
+                    continue
+                pending[row[:key_length]] = row
+                if table == "problem_tags":
+                    changes["tags"].add(row[2])
+                elif table == "problems":
+                    changes["ratings"].add(row[2])
+                elif table == "participations":
+                    changes["users"].add(row[0])
+                    changes["ratings"].add(row[3])
+                elif table == "solutions":
+                    changes["users"].add(row[0])
+                    new_watermarks["solutions_time"] = max(new_watermarks["solutions_time"], row[3])
+            if len(pending) >= batch_size:
+                flush(table, pending)
+        if pending:
+            flush(table, pending)
+        print(f"{file}: ingested")
+
+    if new_contests:
+        new_watermarks["contests_start_time"] = max(new_contests.values())
+    for name, value in new_watermarks.items():
+        db.session.execute(db.text(
+            """
+            INSERT INTO ingest_watermarks (name, value) VALUES (:name, :value)
+            ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+            """
+        ), {"name": name, "value": value})
+    db.session.commit()
+
+    written = rollups.refresh()
+
+    affected = set()
+    for kind, datasets in AFFECTED_DATASETS.items():
+        if changes[kind]:
+            affected.update(datasets)
+    for table, datasets in ROLLUP_DATASETS.items():
+        if written.get(table):
+            affected.update(datasets)
+    for dataset in sorted(affected):
+        db.session.execute(db.text(
+            """
+            INSERT INTO cache_versions (dataset, version) VALUES (:dataset, 1)
+            ON CONFLICT (dataset) DO UPDATE SET version = cache_versions.version + 1
+            """
+        ), {"dataset": dataset})
+    db.session.commit()
+    return changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest new contests, participations and solutions")
+    parser.add_argument("--data-dir", type=pathlib.Path, required=True, help="Folder containing the delta files")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rows per INSERT statement")
+    args = parser.parse_args()
+
+    with app.app_context():
+        started = time.time()
+        changes = ingest(args.data_dir, args.batch_size)
+        for kind, values in changes.items():
+            print(f"Changed {kind}: {len(values)}")
+        print(f"Ingested in {time.time() - started:.1f}s")
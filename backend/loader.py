@@ -0,0 +1,470 @@
+"""
+Bulk Loader for the Exploratory Data Analysis Dumps
+
+Streams the JSON dumps from exploratory_data_analysis/ into the models.py schema
+using PostgreSQL COPY. Records are parsed incrementally, so memory use does not
+depend on the dump size, and rows are sent in batches. Foreign keys, primary keys and
+secondary indexes of the loaded tables are dropped for the duration of the load and
+recreated once at the end, which is far cheaper than maintaining them row by row.
+
+Every batch commits together with a checkpoint holding the byte offset reached in its
+dump, so an interrupted load resumes where the last committed batch ended. The
+batches do not notify the API workers of the changed tables (see notifications.py):
+the loaded tables are notified once, when their keys are restored.
+
+Records may use either the schema column names (e.g. "problem_contest_id") or the
+Codeforces API field names (e.g. "contestId"). The contests table has no dump of its
+own: contest rows are derived from the participations, solutions and problems that
+reference them. Contests referenced only by problems get no start time (NULL).
+
+Usage (from the backend folder):
+    python loader.py                       # load or resume loading all dumps
+    python loader.py --replace             # empty the tables before a fresh load
+    python loader.py --data-dir PATH --batch-size 50000
+"""
+
+from collections import defaultdict, namedtuple
+import argparse
+import codecs
+import csv
+import io
+import json
+import pathlib
+import time
+
+from sqlalchemy.schema import AddConstraint, CreateIndex
+
+from config import app, basedir, db
+from models import Base
+import notifications
+import partitions
+import rollups
+
+# Tables filled by the loader, in dependency order
+LOADED_TABLES = ["users", "contests", "problems", "problem_tags", "participations",
+                 "solutions", "blogs", "blog_tags"]
+
+# Staging table collecting candidate contest start times while the dumps stream in
+CONTEST_TIMES = "load_contest_times"
+
+# Columns written by COPY for every target table
+COLUMNS = {
+    "users": ["handle", "registrationTimeSeconds"],
+    "problems": ["contest_id", "index", "rating", "success_trials", "unsuccess_trials"],
+    "problem_tags": ["problem_contest_id", "problem_index", "tag"],
+    "participations": ["user_handle", "contest_id", "rank", "new_rating", "rating_change"],
+    "solutions": ["user_handle", "problem_contest_id", "problem_index", "timeSeconds"],
+    "blogs": ["id", "title", "rating", "numberOfComments"],
+    "blog_tags": ["blog_id", "tag"],
+    CONTEST_TIMES: ["contest_id", "start_time", "source"],
+}
+
+# Priority of the contest start time sources, lowest wins
+FROM_PARTICIPATIONS, FROM_SOLUTIONS, FROM_PROBLEMS = 0, 1, 2
+
+# Characters allowed between records: whitespace, commas and array brackets
+SEPARATORS = frozenset(" \t\r\n,[]")
+
+_MISSING = object()
+
+
+def pick(record, *names, default=_MISSING):
+    """
+    Read the first present field out of several accepted names.
+
+    Args:
+        record (dict): Parsed JSON record
+        *names (str): Accepted field names, in order of preference
+        default: Value returned when no name is present; a KeyError is raised if omitted
+
+    Returns:
+        Field value
+    """
+    for name in names:
+        if name in record:
+            return record[name]
+    if default is _MISSING:
+        raise KeyError(f"none of {names} in record {record!r}")
+    return default
+
+
+class JsonRecordReader:
+    """
+    Incremental reader of JSON object records stored either as one JSON array or as
+    a stream of concatenated / newline-delimited objects.
+
+    Args:
+        path (pathlib.Path): Dump file
+        offset (int): Byte offset to start from, as returned by a previous reader's `offset`
+        chunk_size (int): Number of bytes read from the file at once
+    """
+
+    def __init__(self, path, offset=0, chunk_size=1 << 20):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._consumed = offset  # bytes of the file before the start of the buffer
+        self._buffer = ""
+        self._position = 0  # buffer index right after the last yielded record
+
+    @property
+    def offset(self):
+        """Byte offset right after the last yielded record"""
+        return self._consumed + len(self._buffer[:self._position].encode("utf-8"))
+
+    def __iter__(self):
+        decoder = json.JSONDecoder()
+        utf8 = codecs.getincrementaldecoder("utf-8")()
+        with open(self.path, "rb") as file:
+            file.seek(self._consumed)
+            eof = False
+            while True:
+                buffer, position = self._buffer, self._position
+                while position < len(buffer) and buffer[position] in SEPARATORS:
+                    position += 1
+                self._position = position
+
+                if position == len(buffer):
+                    if eof:
+                        return
+                    eof = self._fill(file, utf8)
+                    continue
+
+                try:
+                    record, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # The record continues past the end of the buffer
+                    if eof:
+                        raise
+                    eof = self._fill(file, utf8)
+                    continue
+
+                self._position = end
+                yield record
+
+    def _fill(self, file, utf8):
+        """Drop consumed text from the buffer and append the next chunk; True at end of file"""
+        consumed = self._buffer[:self._position]
+        self._consumed += len(consumed.encode("utf-8"))
+        chunk = file.read(self.chunk_size)
+        self._buffer = self._buffer[self._position:] + utf8.decode(chunk, final=not chunk)
+        self._position = 0
+        return not chunk
+
+
+# Record converters: each yields (table, row) pairs for one parsed record
+
+def user_rows(record):
+    yield "users", (pick(record, "handle"), pick(record, "registrationTimeSeconds"))
+
+
+def problem_rows(record):
+    contest_id = pick(record, "contest_id", "contestId")
+    yield "problems", (contest_id, pick(record, "index", "problem_index"), pick(record, "rating"),
+                       pick(record, "success_trials"), pick(record, "unsuccess_trials"))
+    yield CONTEST_TIMES, (contest_id, None, FROM_PROBLEMS)
+
+
+def problem_tag_rows(record):
+    yield "problem_tags", (pick(record, "problem_contest_id", "contest_id", "contestId"),
+                           pick(record, "problem_index", "index"), pick(record, "tag"))
+
+
+def participation_rows(record):
+    contest_id = pick(record, "contest_id", "contestId")
+    new_rating = pick(record, "new_rating", "newRating")
+    rating_change = pick(record, "rating_change", default=None)
+    if rating_change is None:
+        rating_change = new_rating - pick(record, "old_rating", "oldRating")
+    yield "participations", (pick(record, "user_handle", "handle"), contest_id,
+                             pick(record, "rank"), new_rating, rating_change)
+    start_time = pick(record, "startTimeSeconds", "ratingUpdateTimeSeconds", default=None)
+    if start_time is not None:
+        yield CONTEST_TIMES, (contest_id, start_time, FROM_PARTICIPATIONS)
+
+
+def solution_rows(record):
+    contest_id = pick(record, "problem_contest_id", "contest_id", "contestId")
+    time_seconds = pick(record, "timeSeconds", "creationTimeSeconds")
+    yield "solutions", (pick(record, "user_handle", "handle"), contest_id,
+                        pick(record, "problem_index", "index"), time_seconds)
+    yield CONTEST_TIMES, (contest_id, time_seconds, FROM_SOLUTIONS)
+
+
+def blog_rows(record):
+    blog_id = pick(record, "id")
+    yield "blogs", (blog_id, pick(record, "title")[:150], pick(record, "rating"),
+                    pick(record, "numberOfComments", "number_of_comments"))
+    for tag in pick(record, "tags", default=[]):
+        yield "blog_tags", (blog_id, tag)
+
+
+Dump = namedtuple("Dump", ["file", "rows"])
+
+# Dumps in load order
+DUMPS = [
+    Dump("users2061.json", user_rows),
+    Dump("problems.json", problem_rows),
+    Dump("problem_tags.json", problem_tag_rows),
+    Dump("participations2061.json", participation_rows),
+    Dump("solutions.json", solution_rows),
+    Dump("blogs.json", blog_rows),
+]
+
+
+def quote(name):
+    """Quote an identifier (camelCase columns must be quoted in PostgreSQL)"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def loaded_tables():
+    """SQLAlchemy Table objects filled by the loader, in dependency order"""
+    return [Base.metadata.tables[name] for name in LOADED_TABLES]
+
+
+def prepare(replace):
+    """
+    Create the schema and load state, then drop the constraints and indexes of the
+    loaded tables. Returns True when resuming an interrupted load.
+
+    Args:
+        replace (bool): Empty the loaded tables before a fresh load
+    """
+    tables = loaded_tables()
+    Base.metadata.create_all(db.engine, tables=tables)
+    with db.engine.begin() as connection:
+        connection.execute(db.text(
+            """
+            CREATE TABLE IF NOT EXISTS load_checkpoints (
+                file TEXT PRIMARY KEY,
+                byte_offset BIGINT NOT NULL,
+                records BIGINT NOT NULL,
+                done BOOLEAN NOT NULL
+            )
+            """
+        ))
+        connection.execute(db.text(
+            f"""
+            CREATE TABLE IF NOT EXISTS {CONTEST_TIMES} (
+                contest_id INTEGER NOT NULL,
+                start_time BIGINT,
+                source SMALLINT NOT NULL
+            )
+            """
+        ))
+        resuming = connection.execute(db.text("SELECT count(*) FROM load_checkpoints")).scalar() > 0
+        if replace and not resuming:
+            connection.execute(db.text(
+                f"TRUNCATE {', '.join(quote(table.name) for table in tables)} CASCADE"
+            ))
+        partitions.ensure(connection)
+    drop_constraints(tables)
+    return resuming
+
+
+def drop_constraints(tables):
+    """Drop foreign keys, then primary keys and secondary indexes of the given tables"""
+    names = [table.name for table in tables if table.name != "contests"]
+    with db.engine.begin() as connection:
+        for contype in ("f", "p"):
+            constraints = connection.execute(db.text(
+                """
+                SELECT rel.relname, con.conname
+                FROM pg_constraint AS con
+                JOIN pg_class AS rel ON con.conrelid = rel.oid
+                WHERE con.contype = :contype AND rel.relname = ANY(:names)
+                """
+            ), {"contype": contype, "names": names}).all()
+            for table, constraint in constraints:
+                connection.execute(db.text(
+                    f"ALTER TABLE {quote(table)} DROP CONSTRAINT IF EXISTS {quote(constraint)}"
+                ))
+        indexes = connection.execute(db.text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = ANY(:names)"
+        ), {"names": names}).scalars().all()
+        for index in indexes:
+            connection.execute(db.text(f"DROP INDEX IF EXISTS {quote(index)}"))
+
+
+def copy_rows(cursor, table, rows):
+    """Send rows to a table with a single COPY ... FROM STDIN"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    columns = ", ".join(quote(column) for column in COLUMNS[table])
+    cursor.copy_expert(f"COPY {quote(table)} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def load_dump(connection, dump, path, batch_size):
+    """
+    Stream one dump into the database, committing a checkpoint with every batch.
+
+    Args:
+        connection: Raw DB-API connection
+        dump (Dump): Dump description
+        path (pathlib.Path): Dump file
+        batch_size (int): Number of records per COPY batch
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT byte_offset, records, done FROM load_checkpoints WHERE file = %s", (dump.file,))
+    checkpoint = cursor.fetchone()
+    offset, records, done = checkpoint if checkpoint else (0, 0, False)
+    if done:
+        print(f"{dump.file}: already loaded ({records} records)")
+        return
+
+    reader = JsonRecordReader(path, offset)
+    batch = defaultdict(list)
+    # (contest_id, source) -> earliest start time in the batch; a handful of rows
+    # per batch instead of one staging row per solution
+    contest_times = {}
+
+    def flush(done):
+        for table, rows in batch.items():
+            copy_rows(cursor, table, rows)
+        copy_rows(cursor, CONTEST_TIMES, [(contest_id, start_time, source)
+                                          for (contest_id, source), start_time in contest_times.items()])
+        cursor.execute(
+            """
+            INSERT INTO load_checkpoints (file, byte_offset, records, done)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (file) DO UPDATE
+            SET byte_offset = EXCLUDED.byte_offset, records = EXCLUDED.records, done = EXCLUDED.done
+            """,
+            (dump.file, reader.offset, records, done)
+        )
+        connection.commit()
+        batch.clear()
+        contest_times.clear()
+        print(f"{dump.file}: {records} records")
+
+    pending = 0
+    for record in reader:
+        for table, row in dump.rows(record):
+            if table == CONTEST_TIMES:
+                contest_id, start_time, source = row
+                known = contest_times.get((contest_id, source))
+                if known is None or (start_time is not None and start_time < known):
+                    contest_times[(contest_id, source)] = start_time
+            else:
+                batch[table].append(row)
+        records += 1
+        pending += 1
+        if pending == batch_size:
+            flush(done=False)
+            pending = 0
+    flush(done=True)
+
+
+def finish():
+    """
+    Derive contests, remove rows that would violate the recreated keys and restore
+    primary keys, foreign keys and indexes of the loaded tables.
+    """
+    tables = loaded_tables()
+    # A crash during a previous finish may have left part of the constraints in place
+    drop_constraints(tables)
+    with db.engine.begin() as connection:
+        connection.execute(db.text(
+            f"""
+            INSERT INTO contests (id, "startTimeSeconds")
+            SELECT DISTINCT ON (contest_id) contest_id, start_time
+            FROM {CONTEST_TIMES}
+            ORDER BY contest_id, source, start_time
+            ON CONFLICT (id) DO NOTHING
+            """
+        ))
+        # Move the rows of contests and years beyond the existing partitions out of
+        # the default partitions
+        partitions.ensure(connection)
+
+        for table in tables:
+            if table.name == "contests":
+                continue
+            # Keep the first physical copy of every key, or the earliest one of keys
+            # spanning partitions (ctids only compare within a partition)
+            key = partitions.UNIQUE_KEYS.get(table.name, [column.name for column in table.primary_key.columns])
+            same_key = " AND ".join(f"a.{quote(column)} = b.{quote(column)}" for column in key)
+            later = "a.ctid > b.ctid"
+            if table.name in partitions.UNIQUE_KEYS:
+                column = partitions.PARTITIONED[table.name][0]
+                later = f"(a.{column}, a.ctid) > (b.{column}, b.ctid)"
+            removed = connection.execute(db.text(
+                f"DELETE FROM {quote(table.name)} AS a USING {quote(table.name)} AS b "
+                f"WHERE {later} AND {same_key}"
+            )).rowcount
+            if removed:
+                print(f"{table.name}: removed {removed} duplicate rows")
+            connection.execute(AddConstraint(table.primary_key))
+
+        for table in tables:
+            for foreign_key in table.foreign_key_constraints:
+                matches = " AND ".join(
+                    f"p.{quote(element.column.name)} = c.{quote(element.parent.name)}"
+                    for element in foreign_key.elements
+                )
+                removed = connection.execute(db.text(
+                    f"DELETE FROM {quote(table.name)} AS c WHERE NOT EXISTS "
+                    f"(SELECT 1 FROM {quote(foreign_key.referred_table.name)} AS p WHERE {matches})"
+                )).rowcount
+                if removed:
+                    print(f"{table.name}: removed {removed} rows referencing missing "
+                          f"{foreign_key.referred_table.name}")
+                connection.execute(AddConstraint(foreign_key))
+
+        for table in tables:
+            for index in table.indexes:
+                connection.execute(CreateIndex(index))
+
+        for table in tables:
+            connection.execute(db.text(f"ANALYZE {quote(table.name)}"))
+        connection.execute(db.text(f"DROP TABLE {CONTEST_TIMES}, load_checkpoints"))
+        notifications.notify(connection, [table.name for table in tables])
+
+
+def load(data_dir, batch_size, replace=False):
+    """
+    Load every dump found in data_dir, resuming from the checkpoints of an
+    interrupted run, and rebuild the aggregate rollups afterwards.
+
+    Args:
+        data_dir (pathlib.Path): Folder containing the JSON dumps
+        batch_size (int): Number of records per COPY batch
+        replace (bool): Empty the loaded tables before a fresh load
+    """
+    if prepare(replace):
+        print("Resuming interrupted load")
+
+    connection = db.engine.raw_connection()
+    # Taken out of the pool, as it keeps its notifications paused until closed
+    connection.detach()
+    try:
+        # One notification per table from finish() rather than one per batch
+        connection.cursor().execute(notifications.PAUSE_SQL)
+        connection.commit()
+        for dump in DUMPS:
+            path = data_dir / dump.file
+            if not path.exists():
+                print(f"{dump.file}: not found, skipped")
+                continue
+            load_dump(connection, dump, path, batch_size)
+    finally:
+        connection.close()
+
+    print("Restoring keys and indexes")
+    finish()
+    rollups.refresh(full=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk load the JSON dumps into the database")
+    parser.add_argument("--data-dir", type=pathlib.Path,
+                        default=basedir.parent / "exploratory_data_analysis",
+                        help="Folder containing the JSON dumps")
+    parser.add_argument("--batch-size", type=int, default=50_000, help="Records per COPY batch")
+    parser.add_argument("--replace", action="store_true", help="Empty the tables before a fresh load")
+    args = parser.parse_args()
+
+    with app.app_context():
+        started = time.time()
+        load(args.data_dir, args.batch_size, replace=args.replace)
+        print(f"Loaded in {time.time() - started:.1f}s")
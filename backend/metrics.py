@@ -0,0 +1,243 @@
+"""
+Instrumentation
+
+Records where the time of the API goes and exposes it at /metrics in the Prometheus
+text format:
+    - request latency per endpoint and status
+    - SQL statement time and returned rows (SQLAlchemy engine events), slow statements
+      optionally logged above SLOW_QUERY_MS
+    - cache hits, misses, fills and background refreshes of every TimedCache, and the
+      duration of each fill, which is its SQL time plus the NumPy post-processing
+    - table change notifications received (see notifications.py)
+    - encoding and compression time and size of the response bodies
+
+Measurements are attributed to a scope: the endpoint while a request is handled, or
+the cache whose value is being computed (also in the query threads and background
+refreshes working for it), so the SQL time of a fill can be told apart from the rest.
+Every worker process keeps and serves its own metrics; Prometheus adds them up.
+"""
+
+from contextvars import ContextVar
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import slow_query_ms
+
+logger = logging.getLogger(__name__)
+
+# Endpoint or cache the current work is done for
+scope = ContextVar("scope", default="none")
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(1024 * 4 ** power for power in range(8))  # 1 KiB to 16 MiB
+ROWS_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """
+    Monotonic count per combination of label values.
+
+    Args:
+        name (str): Metric name, ending in _total
+        documentation (str): HELP text
+        labels (tuple[str]): Label names
+    """
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        """
+        Returns:
+            list[str]: Lines of the metric in the Prometheus text format
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observed values per combination of label values.
+
+    Args:
+        name (str): Metric name
+        documentation (str): HELP text
+        labels (tuple[str]): Label names
+        buckets (tuple[float]): Increasing upper bounds of the buckets
+    """
+
+    def __init__(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # Label values -> [count per bucket (last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, _ = series = self._values.setdefault(label_values, [[0] * (len(self.buckets) + 1), 0.0])
+            counts[index] += 1
+            series[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        """Observe the seconds spent in the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self):
+        """
+        Returns:
+            list[str]: Lines of the metric in the Prometheus text format
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += count
+                    labels = _format_labels(self.labels, label_values, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time to handle a request",
+                            ("endpoint", "method", "status"))
+SQL_SECONDS = Histogram("sql_statement_duration_seconds", "Execution time of SQL statements", ("scope",))
+SQL_ROWS = Histogram("sql_statement_rows", "Rows returned or affected by SQL statements", ("scope",),
+                     ROWS_BUCKETS)
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by result (hit, stale, miss)",
+                         ("cache", "result"))
+CACHE_REFRESHES = Counter("cache_refreshes_total", "Background refreshes by outcome (ok, error)",
+                          ("cache", "outcome"))
+CACHE_FILL_SECONDS = Histogram("cache_fill_duration_seconds", "Time to compute a cached value", ("cache",))
+TABLE_CHANGES = Counter("table_change_notifications_total", "Table change notifications received (see notifications.py)",
+                        ("table",))
+ENCODE_SECONDS = Histogram("response_encode_duration_seconds", "Time to encode or compress a response body",
+                           ("scope", "format"))
+RESPONSE_BYTES = Histogram("response_body_bytes", "Size of the response bodies sent",
+                           ("endpoint", "media_type", "encoding"), BYTES_BUCKETS)
+
+METRICS = [REQUEST_SECONDS, SQL_SECONDS, SQL_ROWS, CACHE_REQUESTS, CACHE_REFRESHES, CACHE_FILL_SECONDS,
+           TABLE_CHANGES, ENCODE_SECONDS, RESPONSE_BYTES]
+
+
+@contextlib.contextmanager
+def scoped(name):
+    """Attribute the measurements of the with block to a scope"""
+    token = scope.set(name)
+    try:
+        yield
+    finally:
+        scope.reset(token)
+
+
+def _endpoint():
+    """Route of the current request, e.g. /api/topics_correlation"""
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["statement_started"].pop()
+    name = scope.get()
+    SQL_SECONDS.observe(elapsed, name)
+    # psycopg2 fetches whole results on execute, so rowcount is exact for reads too
+    if cursor.rowcount >= 0:
+        SQL_ROWS.observe(cursor.rowcount, name)
+    if slow_query_ms and elapsed * 1000 >= slow_query_ms:
+        logger.warning("Slow query (%.0f ms, %d rows, scope %s): %s", elapsed * 1000, cursor.rowcount, name,
+                       " ".join(statement.split())[:1000])
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # Failed statements never reach after_cursor_execute
+    if context.connection is not None and context.connection.info.get("statement_started"):
+        context.connection.info["statement_started"].pop()
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_scope = scope.set(_endpoint())
+
+
+def _finish_request(response):
+    REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_started, _endpoint(), request.method,
+                            response.status_code)
+    if not response.is_streamed:
+        RESPONSE_BYTES.observe(response.content_length or 0, _endpoint(), response.mimetype,
+                               response.headers.get("Content-Encoding", "identity"))
+    return response
+
+
+def _end_request(error):
+    token = g.pop("metrics_scope", None)
+    if token is not None:
+        scope.reset(token)
+
+
+def instrument(flask_app):
+    """
+    Measure every request of a Flask application.
+
+    Args:
+        flask_app (flask.Flask): Application to instrument
+    """
+    flask_app.before_request(_start_request)
+    flask_app.after_request(_finish_request)
+    flask_app.teardown_request(_end_request)
+
+
+def render():
+    """
+    Returns:
+        str: Every metric in the Prometheus text format
+    """
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+def endpoint():
+    """Metrics endpoint scraped by Prometheus"""
+    return Response(render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,147 @@
+"""
+Versioned Schema Migrations
+
+Applies the files of the migrations folder, named NNNN_description.sql or
+NNNN_description.py, in the order of their numbers. SQL files are run as they are;
+Python files define upgrade(connection), for changes depending on the state of the
+database, like partitioning existing tables (see partitions.py). Every migration runs
+in its own transaction together with its row in schema_migrations, so a failed
+migration leaves no trace and is retried by the next run, while applied ones are never
+run twice.
+
+Statements that cannot run in a transaction, like CREATE INDEX CONCURRENTLY, are run
+one by one on an autocommit connection instead: SQL files containing CONCURRENTLY and
+Python files setting TRANSACTIONAL = False. Their row in schema_migrations is only
+written once every statement succeeded, so they must be safe to run again (e.g.
+IF NOT EXISTS).
+
+Usage (from the backend folder):
+    python migrate.py            # apply the pending migrations
+    python migrate.py --status   # list applied and pending migrations
+"""
+
+from collections import namedtuple
+import argparse
+import importlib.util
+import re
+import time
+
+from config import app, basedir, db
+from models import Base, SchemaMigration
+
+MIGRATIONS_DIR = basedir / "migrations"
+
+Migration = namedtuple("Migration", ["version", "name", "path"])
+
+
+def available():
+    """
+    Returns:
+        list[Migration]: Migration files of the migrations folder, ordered by version
+    """
+    migrations = []
+    for path in MIGRATIONS_DIR.iterdir():
+        if path.suffix not in (".sql", ".py"):
+            continue
+        match = re.fullmatch(r"(\d+)_(\w+)\.(sql|py)", path.name)
+        if match is None:
+            raise ValueError(f"Migration file name must look like 0001_description.sql: {path.name}")
+        migrations.append(Migration(int(match.group(1)), match.group(2), path))
+    migrations.sort()
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError("Two migration files share a version number")
+    return migrations
+
+
+def load(migration):
+    """Import the module of a Python migration"""
+    spec = importlib.util.spec_from_file_location(f"migration_{migration.version:04d}", migration.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def transactional(migration):
+    """Tell whether a migration can run in a transaction"""
+    if migration.path.suffix == ".py":
+        return getattr(load(migration), "TRANSACTIONAL", True)
+    return re.search(r"\bCONCURRENTLY\b", migration.path.read_text(), re.IGNORECASE) is None
+
+
+def statements(text):
+    """Split a SQL file into its statements, dropping -- comments"""
+    code = "\n".join(line.split("--", 1)[0] for line in text.splitlines())
+    return [statement.strip() for statement in code.split(";") if statement.strip()]
+
+
+def run(connection, migration):
+    """Apply one migration file on a connection"""
+    if migration.path.suffix == ".py":
+        load(migration).upgrade(connection)
+    elif transactional(migration):
+        # Raw driver execution: files hold several statements and casts like ::int
+        connection.exec_driver_sql(migration.path.read_text())
+    else:
+        # Several statements sent at once would form an implicit transaction
+        for statement in statements(migration.path.read_text()):
+            connection.exec_driver_sql(statement)
+
+
+def record(connection, migration):
+    """Add a migration to schema_migrations"""
+    connection.execute(db.text(
+        "INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"
+    ), {"version": migration.version, "name": migration.name, "applied_at": int(time.time())})
+
+
+def applied():
+    """
+    Returns:
+        dict: Version -> Unix time of every applied migration
+    """
+    Base.metadata.create_all(db.engine, tables=[SchemaMigration.__table__])
+    rows = db.session.execute(db.text("SELECT version, applied_at FROM schema_migrations")).all()
+    return {version: applied_at for version, applied_at in rows}
+
+
+def migrate():
+    """
+    Apply every migration that has not been applied yet.
+
+    Returns:
+        list[Migration]: Migrations applied by this run
+    """
+    done = applied()
+    db.session.commit()
+    pending = [migration for migration in available() if migration.version not in done]
+    for migration in pending:
+        if transactional(migration):
+            with db.engine.begin() as connection:
+                run(connection, migration)
+                record(connection, migration)
+        else:
+            with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                run(connection, migration)
+            with db.engine.begin() as connection:
+                record(connection, migration)
+        print(f"Applied {migration.path.name}")
+    return pending
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations")
+    parser.add_argument("--status", action="store_true", help="List migrations instead of applying them")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.status:
+            done = applied()
+            for migration in available():
+                state = time.strftime("%Y-%m-%d %H:%M", time.gmtime(done[migration.version])) \
+                    if migration.version in done else "pending"
+                print(f"{migration.path.name}: {state}")
+        else:
+            started = time.time()
+            applied_now = migrate()
+            print(f"{len(applied_now)} migrations applied in {time.time() - started:.1f}s")
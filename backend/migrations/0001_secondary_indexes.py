@@ -0,0 +1,45 @@
+"""
+Secondary indexes for the joins and watermark scans of rollups.py and ingest.py.
+
+They are built with CREATE INDEX CONCURRENTLY, so the tables stay writable during the
+build, which rules out a transaction (see TRANSACTIONAL in migrate.py). The same
+indexes are declared in models.py, so tables created by loader.py already have them
+and IF NOT EXISTS keeps this migration a no-op there. Postgres cannot build the index
+of a partitioned table concurrently, so those are built the plain way. A concurrent
+build interrupted midway leaves an invalid index behind, which is dropped and built
+again by the next run.
+"""
+
+from config import db
+import partitions
+
+# The statements commit one by one, outside of a transaction
+TRANSACTIONAL = False
+
+# Index name -> table and columns
+INDEXES = {
+    # Tag -> problems, covering the problem key so tag lookups never visit the heap
+    "ix_problem_tags_tag": "problem_tags (tag) INCLUDE (problem_contest_id, problem_index)",
+    # Solutions of a problem (joins and cascades from problems)
+    "ix_solutions_problem": "solutions (problem_contest_id, problem_index)",
+    # Newest solutions first: MAX("timeSeconds") watermarks and the users touched since
+    # a watermark are answered by index-only scans
+    "ix_solutions_time": 'solutions ("timeSeconds") INCLUDE (user_handle)',
+    # Participants of a contest (users touched by new contests, cascades from contests)
+    "ix_participations_contest": "participations (contest_id) INCLUDE (user_handle)",
+}
+
+
+def upgrade(connection):
+    for name, definition in INDEXES.items():
+        valid = connection.execute(db.text(
+            "SELECT i.indisvalid FROM pg_index AS i JOIN pg_class AS c ON c.oid = i.indexrelid WHERE c.relname = :name"
+        ), {"name": name}).scalar()
+        if valid is False:
+            connection.exec_driver_sql(f"DROP INDEX CONCURRENTLY {name}")
+        table = definition.split()[0]
+        concurrently = "" if partitions.is_partitioned(connection, table) else "CONCURRENTLY "
+        connection.exec_driver_sql(f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {definition}")
+
+    for table in ("problem_tags", "solutions", "participations"):
+        connection.exec_driver_sql(f"ANALYZE {table}")
@@ -0,0 +1,34 @@
+"""
+Range-partition solutions by "timeSeconds" and participations by contest_id, with BRIN
+indexes on the partition keys (see partitions.py). The primary key of solutions takes
+"timeSeconds", as Postgres requires of keys of partitioned tables.
+
+Each table is rebuilt as declared in models.py, its rows copied into the partitions,
+and the old table dropped. Tables already partitioned, e.g. created by loader.py from
+the current models, are left as they are.
+"""
+
+from config import db
+from models import Participation, Solution
+import partitions
+
+
+def upgrade(connection):
+    for table in (Solution.__table__, Participation.__table__):
+        if partitions.is_partitioned(connection, table.name):
+            continue
+        old = f"{table.name}_unpartitioned"
+        connection.execute(db.text(f"ALTER TABLE {table.name} RENAME TO {old}"))
+        # Free the index and constraint names for the new table
+        indexes = connection.execute(db.text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :table"
+        ), {"table": old}).scalars().all()
+        for index in indexes:
+            connection.execute(db.text(f'ALTER INDEX "{index}" RENAME TO "{index[:50]}_unpartitioned"'))
+
+        table.create(connection)
+        partitions.ensure(connection)
+        columns = ", ".join(f'"{column.name}"' for column in table.columns)
+        connection.execute(db.text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old}"))
+        connection.execute(db.text(f"DROP TABLE {old}"))
+        connection.execute(db.text(f"ANALYZE {table.name}"))
@@ -0,0 +1,15 @@
+"""
+Make every table of models.py publish a notification after each statement writing to
+it, so the API workers refresh only the cached datasets reading from the changed
+tables (see notifications.py). Tables created from the current models get their
+trigger on creation, and tables that do not exist yet are skipped.
+"""
+
+from config import db
+from models import Base
+import notifications
+
+
+def upgrade(connection):
+    existing = set(db.inspect(connection).get_table_names())
+    notifications.install(connection, [table.name for table in Base.metadata.sorted_tables if table.name in existing])
@@ -0,0 +1,8 @@
+-- Drop the BRIN indexes on the partition keys added by migration 0002. The covering
+-- btrees ix_solutions_time and ix_participations_contest already answer the same
+-- range scans (with index-only scans), and partition pruning skips the rest, so the
+-- BRIN indexes were only maintained, never chosen. Dropping the index of a
+-- partitioned table drops those of its partitions.
+
+DROP INDEX IF EXISTS brin_solutions_time;
+DROP INDEX IF EXISTS brin_participations_contest;
@@ -0,0 +1,8 @@
+-- Contests known only from the problems dump have no start time. loader.py used to
+-- store 0 for them, which put their problems and participations in January 1970;
+-- they are NULL now, and the rollups and time filters leave them out. No contest
+-- started at the epoch, so 0 can only be such a placeholder. Rebuild the rollups
+-- afterwards (python rollups.py refresh --full) to drop the rows it produced.
+
+ALTER TABLE contests ALTER COLUMN "startTimeSeconds" DROP NOT NULL;
+UPDATE contests SET "startTimeSeconds" = NULL WHERE "startTimeSeconds" = 0;
@@ -0,0 +1,8 @@
+-- Recreate the BRIN indexes on the partition keys that migration 0004 dropped. The
+-- partitions are filled in time order, so a BRIN index is a few pages per partition
+-- and cheap to maintain, and it lets time windows and contest id ranges skip block
+-- ranges within the partitions they touch without the covering btrees. Creating the
+-- index of a partitioned table creates those of its partitions.
+
+CREATE INDEX IF NOT EXISTS brin_solutions_time ON solutions USING brin ("timeSeconds");
+CREATE INDEX IF NOT EXISTS brin_participations_contest ON participations USING brin (contest_id);
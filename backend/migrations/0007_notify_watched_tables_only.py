@@ -0,0 +1,17 @@
+"""
+Keep the change notifications of migration 0003 on the tables read by the cached
+datasets only (notifications.WATCHED_TABLES), so that writes to the other tables, like
+the batches of solutions and participations committed by loader.py, no longer make
+every API worker refresh its datasets. The trigger function is replaced by the one
+skipping sessions that paused their notifications.
+"""
+
+from config import db
+from models import Base
+import notifications
+
+
+def upgrade(connection):
+    existing = {table.name for table in Base.metadata.sorted_tables} & set(db.inspect(connection).get_table_names())
+    notifications.uninstall(connection, sorted(existing - set(notifications.WATCHED_TABLES)))
+    notifications.install(connection, [table for table in notifications.WATCHED_TABLES if table in existing])
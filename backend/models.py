@@ -1,6 +1,10 @@
+from typing import Optional
+
+from sqlalchemy import event
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.orm import DeclarativeBase
 from config import db
+import notifications
 
 
 # Base class for declarative model definitions
@@ -38,12 +42,13 @@ class Contest(Base):
 
     Attributes:
         id: Unique contest identifier (primary key)
-        startTimeSeconds: Unix timestamp of contest start time
+        startTimeSeconds: Unix timestamp of contest start time, None for contests
+            only known from the problems dump
     """
     __tablename__ = "contests"
 
     id: Mapped[int] = mapped_column(db.Integer(), primary_key=True)
-    startTimeSeconds: Mapped[int] = mapped_column(db.Integer(), nullable=False)
+    startTimeSeconds: Mapped[Optional[int]] = mapped_column(db.Integer(), nullable=True)
 
     def __repr__(self):
         return f"Contest(id={self.id!r}, startTimeSeconds={self.startTimeSeconds!r})"
@@ -143,6 +148,16 @@ class Participation(Base):
     new_rating: Mapped[int] = mapped_column(db.Integer(), nullable=False)
     rating_change: Mapped[int] = mapped_column(db.Integer(), nullable=False)
 
+    # Contest -> participants, covering the user handle (new contests touching users,
+    # cascades from contests); migrations/0001_secondary_indexes.py. Range-partitioned
+    # by contest id, which grows with contest time, with a BRIN index on it for range
+    # scans (see partitions.py)
+    __table_args__ = (
+        db.Index("ix_participations_contest", "contest_id", postgresql_include=["user_handle"]),
+        db.Index("brin_participations_contest", "contest_id", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (contest_id)"},
+    )
+
     def __repr__(self):
         return (f"Participation(user_handle={self.user_handle!r}, contest_id={self.contest_id!r}, "
                 f"rank={self.rank!r}, new_rating={self.new_rating!r}, rating_change={self.rating_change!r})")
@@ -164,7 +179,8 @@ class Solution(Base):
         user_handle: Foreign key to solving user (part of composite key)
         problem_contest_id: Foreign key to problem's contest (part of composite key)
         problem_index: Foreign key to problem index (part of composite key)
-        timeSeconds: Timestamp of solution submission
+        timeSeconds: Timestamp of solution submission (part of composite key, which
+            must hold the partition key)
     """
     __tablename__ = "solutions"
 
@@ -174,14 +190,21 @@ class Solution(Base):
     )
     problem_contest_id: Mapped[int] = mapped_column(db.Integer(), primary_key=True)
     problem_index: Mapped[str] = mapped_column(db.String(5), primary_key=True)
-    timeSeconds: Mapped[int] = mapped_column(db.Integer(), nullable=False)
+    timeSeconds: Mapped[int] = mapped_column(db.Integer(), primary_key=True)
 
-    # Composite foreign key to problems table
+    # Composite foreign key to problems table, and secondary indexes for solutions by
+    # problem and by submission time (watermarks, users touched since a watermark).
+    # Range-partitioned by submission time, with a BRIN index on it for time windows
+    # (see partitions.py)
     __table_args__ = (
         db.ForeignKeyConstraint(
             ["problem_contest_id", "problem_index"],
             ["problems.contest_id", "problems.index"]
         ),
+        db.Index("ix_solutions_problem", "problem_contest_id", "problem_index"),
+        db.Index("ix_solutions_time", "timeSeconds", postgresql_include=["user_handle"]),
+        db.Index("brin_solutions_time", "timeSeconds", postgresql_using="brin"),
+        {"postgresql_partition_by": 'RANGE ("timeSeconds")'},
     )
 
     def __repr__(self):
@@ -211,12 +234,13 @@ class ProblemTag(Base):
     problem_index: Mapped[str] = mapped_column(db.String(5), primary_key=True)
     tag: Mapped[str] = mapped_column(db.String(50), primary_key=True)
 
-    # Composite foreign key to problems table
+    # Composite foreign key to problems table, and tag -> problems covering index
     __table_args__ = (
         db.ForeignKeyConstraint(
             ["problem_contest_id", "problem_index"],
             ["problems.contest_id", "problems.index"]
         ),
+        db.Index("ix_problem_tags_tag", "tag", postgresql_include=["problem_contest_id", "problem_index"]),
     )
 
     def __repr__(self):
@@ -253,3 +277,272 @@ class BlogTag(Base):
             'blog_id': self.blog_id,
             'tag': self.tag
         }
+
+
+class BlogTopicRollup(Base):
+    """Precomputed engagement statistics for each blog tag.
+
+    Attributes:
+        tag: Blog tag (primary key)
+        avg_rating: Average rating of blogs with this tag
+        avg_number_of_comments: Average number of comments of blogs with this tag
+        number_of_blogs: Count of blogs with this tag
+    """
+    __tablename__ = "blog_topic_rollup"
+
+    tag: Mapped[str] = mapped_column(db.String(100), primary_key=True)
+    avg_rating: Mapped[float] = mapped_column(db.Float(), nullable=True)
+    avg_number_of_comments: Mapped[float] = mapped_column(db.Float(), nullable=True)
+    number_of_blogs: Mapped[int] = mapped_column(db.Integer(), nullable=False)
+
+    def __repr__(self):
+        return (f"BlogTopicRollup(tag={self.tag!r}, avg_rating={self.avg_rating!r}, "
+                f"avg_number_of_comments={self.avg_number_of_comments!r}, "
+                f"number_of_blogs={self.number_of_blogs!r})")
+
+    def to_dict(self):
+        return {
+            'tag': self.tag,
+            'avg_rating': self.avg_rating,
+            'avg_number_of_comments': self.avg_number_of_comments,
+            'number_of_blogs': self.number_of_blogs
+        }
+
+
+class UserFeatures(Base):
+    """Precomputed per-user features at the user's latest contest.
+
+    Only users whose latest contest changed their rating by at most 250 are kept.
+
+    Attributes:
+        user_handle: User identifier (primary key)
+        rating: Rating after the user's latest contest
+        experience: Whole years between registration and the latest contest
+        number_of_solutions: Count of the user's solutions
+        avg_solutions_rating: Average rating of solved problems (NULL without solutions)
+        avg_solutions_solvability: Average solvability of solved problems (NULL without solutions)
+    """
+    __tablename__ = "user_features"
+
+    user_handle: Mapped[str] = mapped_column(db.String(70), primary_key=True)
+    rating: Mapped[int] = mapped_column(db.Integer(), nullable=False)
+    experience: Mapped[float] = mapped_column(db.Float(), nullable=False)
+    number_of_solutions: Mapped[int] = mapped_column(db.Integer(), nullable=False)
+    avg_solutions_rating: Mapped[float] = mapped_column(db.Float(), nullable=True)
+    avg_solutions_solvability: Mapped[float] = mapped_column(db.Float(), nullable=True)
+
+    def __repr__(self):
+        return (f"UserFeatures(user_handle={self.user_handle!r}, rating={self.rating!r}, "
+                f"experience={self.experience!r}, number_of_solutions={self.number_of_solutions!r}, "
+                f"avg_solutions_rating={self.avg_solutions_rating!r}, "
+                f"avg_solutions_solvability={self.avg_solutions_solvability!r})")
+
+    def to_dict(self):
+        return {
+            'user_handle': self.user_handle,
+            'rating': self.rating,
+            'experience': self.experience,
+            'number_of_solutions': self.number_of_solutions,
+            'avg_solutions_rating': self.avg_solutions_rating,
+            'avg_solutions_solvability': self.avg_solutions_solvability
+        }
+
+
+class TopicMonthRollup(Base):
+    """Precomputed problem statistics for each tag and month of contest start.
+
+    Attributes:
+        month: Month the problems' contests started, e.g. '2024-03' (UTC, part of composite key)
+        tag: Problem tag (part of composite key)
+        number_of_problems: Count of problems with this tag
+        success_trials: Sum of the successful submissions of these problems
+        unsuccess_trials: Sum of the failed submissions of these problems
+    """
+    __tablename__ = "topic_month_rollup"
+
+    month: Mapped[str] = mapped_column(db.String(7), primary_key=True)
+    tag: Mapped[str] = mapped_column(db.String(50), primary_key=True)
+    number_of_problems: Mapped[int] = mapped_column(db.Integer(), nullable=False)
+    success_trials: Mapped[int] = mapped_column(db.BigInteger(), nullable=False)
+    unsuccess_trials: Mapped[int] = mapped_column(db.BigInteger(), nullable=False)
+
+    def __repr__(self):
+        return (f"TopicMonthRollup(month={self.month!r}, tag={self.tag!r}, "
+                f"number_of_problems={self.number_of_problems!r}, success_trials={self.success_trials!r}, "
+                f"unsuccess_trials={self.unsuccess_trials!r})")
+
+    def to_dict(self):
+        return {
+            'month': self.month,
+            'tag': self.tag,
+            'number_of_problems': self.number_of_problems,
+            'success_trials': self.success_trials,
+            'unsuccess_trials': self.unsuccess_trials
+        }
+
+
+class UserRatingMonth(Base):
+    """Precomputed rating of each user at the end of every month they took part in a contest.
+
+    Attributes:
+        user_handle: User identifier (part of composite key)
+        month: Month of the contests, e.g. '2024-03' (UTC, part of composite key)
+        rating: Rating after the user's last contest of the month
+        rating_change: Sum of the rating changes of the month
+        number_of_contests: Count of the user's contests in the month
+    """
+    __tablename__ = "user_rating_month"
+
+    user_handle: Mapped[str] = mapped_column(db.String(70), primary_key=True)
+    month: Mapped[str] = mapped_column(db.String(7), primary_key=True)
+    rating: Mapped[int] = mapped_column(db.Integer(), nullable=False)
+    rating_change: Mapped[int] = mapped_column(db.Integer(), nullable=False)
+    number_of_contests: Mapped[int] = mapped_column(db.Integer(), nullable=False)
+
+    # Month -> users, for the rating band rollup and incremental refreshes of a month
+    __table_args__ = (
+        db.Index("ix_user_rating_month_month", "month"),
+    )
+
+    def __repr__(self):
+        return (f"UserRatingMonth(user_handle={self.user_handle!r}, month={self.month!r}, "
+                f"rating={self.rating!r}, rating_change={self.rating_change!r}, "
+                f"number_of_contests={self.number_of_contests!r})")
+
+    def to_dict(self):
+        return {
+            'user_handle': self.user_handle,
+            'month': self.month,
+            'rating': self.rating,
+            'rating_change': self.rating_change,
+            'number_of_contests': self.number_of_contests
+        }
+
+
+class RatingBandMonthRollup(Base):
+    """Precomputed number of active users in each rating band and month.
+
+    Users count once per month they took part in a contest, in the band of their
+    rating at the end of the month.
+
+    Attributes:
+        month: Month, e.g. '2024-03' (UTC, part of composite key)
+        min_rating: Lowest rating of the band (part of composite key)
+        band: Codeforces rank name of the band, e.g. 'expert'
+        number_of_users: Count of the band's active users
+    """
+    __tablename__ = "rating_band_month_rollup"
+
+    month: Mapped[str] = mapped_column(db.String(7), primary_key=True)
+    min_rating: Mapped[int] = mapped_column(db.Integer(), primary_key=True)
+    band: Mapped[str] = mapped_column(db.String(30), nullable=False)
+    number_of_users: Mapped[int] = mapped_column(db.Integer(), nullable=False)
+
+    def __repr__(self):
+        return (f"RatingBandMonthRollup(month={self.month!r}, min_rating={self.min_rating!r}, "
+                f"band={self.band!r}, number_of_users={self.number_of_users!r})")
+
+    def to_dict(self):
+        return {
+            'month': self.month,
+            'min_rating': self.min_rating,
+            'band': self.band,
+            'number_of_users': self.number_of_users
+        }
+
+
+class RollupState(Base):
+    """Watermarks recording how far the rollup tables have been refreshed.
+
+    Attributes:
+        name: Watermark name (primary key)
+        value: Highest source value already folded into the rollups
+    """
+    __tablename__ = "rollup_state"
+
+    name: Mapped[str] = mapped_column(db.String(50), primary_key=True)
+    value: Mapped[int] = mapped_column(db.BigInteger(), nullable=False)
+
+    def __repr__(self):
+        return f"RollupState(name={self.name!r}, value={self.value!r})"
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'value': self.value
+        }
+
+
+class IngestWatermark(Base):
+    """Watermarks recording the newest source rows taken in by the delta ingest.
+
+    Attributes:
+        name: Watermark name (primary key)
+        value: Newest timestamp already ingested
+    """
+    __tablename__ = "ingest_watermarks"
+
+    name: Mapped[str] = mapped_column(db.String(50), primary_key=True)
+    value: Mapped[int] = mapped_column(db.BigInteger(), nullable=False)
+
+    def __repr__(self):
+        return f"IngestWatermark(name={self.name!r}, value={self.value!r})"
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'value': self.value
+        }
+
+
+class CacheVersion(Base):
+    """Version counters telling API workers which cached datasets are out of date.
+
+    Attributes:
+        dataset: Name of the cached routes.py function (primary key)
+        version: Counter bumped whenever the dataset's source data changes
+    """
+    __tablename__ = "cache_versions"
+
+    dataset: Mapped[str] = mapped_column(db.String(100), primary_key=True)
+    version: Mapped[int] = mapped_column(db.BigInteger(), nullable=False)
+
+    def __repr__(self):
+        return f"CacheVersion(dataset={self.dataset!r}, version={self.version!r})"
+
+    def to_dict(self):
+        return {
+            'dataset': self.dataset,
+            'version': self.version
+        }
+
+
+class SchemaMigration(Base):
+    """Migrations from the migrations folder already applied by migrate.py.
+
+    Attributes:
+        version: Number prefixing the migration file name (primary key)
+        name: Rest of the file name, describing the migration
+        applied_at: Unix time the migration was applied
+    """
+    __tablename__ = "schema_migrations"
+
+    version: Mapped[int] = mapped_column(db.Integer(), primary_key=True)
+    name: Mapped[str] = mapped_column(db.String(200), nullable=False)
+    applied_at: Mapped[int] = mapped_column(db.BigInteger(), nullable=False)
+
+    def __repr__(self):
+        return f"SchemaMigration(version={self.version!r}, name={self.name!r}, applied_at={self.applied_at!r})"
+
+    def to_dict(self):
+        return {
+            'version': self.version,
+            'name': self.name,
+            'applied_at': self.applied_at
+        }
+
+
+# The tables read by the cached datasets notify the API workers of their changes
+# (see notifications.py)
+for table in Base.metadata.sorted_tables:
+    event.listen(table, "after_create", notifications.create_trigger)
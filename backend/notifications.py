@@ -0,0 +1,175 @@
+"""
+Table Change Notifications
+
+The tables read by the cached datasets (WATCHED_TABLES) publish their name on the
+table_changes channel after each statement writing to them: a statement-level trigger
+calls pg_notify, which Postgres delivers when the transaction commits, once per table
+and transaction however many statements wrote to it. The triggers are created
+together with the tables (see models.py) and added to existing databases by
+migrations/0003_table_change_notifications.py and
+migrations/0007_notify_watched_tables_only.py.
+
+Bulk loads committing batch after batch pause the triggers of their session and
+notify every loaded table once at the end (see loader.py), so that the workers do not
+recompute their datasets after every batch.
+
+Each API worker runs a Listener thread on its own connection to the primary database
+(notifications do not reach read replicas), which hands the changed tables to
+routes.py so that only the cached datasets reading from them are refreshed.
+
+Usage (from the backend folder):
+    python notifications.py listen     # print the changed tables as notifications arrive
+"""
+
+import argparse
+import logging
+import select
+import threading
+import time
+
+from config import app, db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "table_changes"
+
+# Tables read by the cached datasets of routes.py (see routes.depends_on); the others,
+# like the large solutions and participations tables, do not notify
+WATCHED_TABLES = ("contests", "problems", "problem_tags", "user_features", "blog_topic_rollup",
+                  "topic_month_rollup", "user_rating_month", "rating_band_month_rollup")
+
+# Setting pausing the notifications of the statements of its session
+PAUSE_SQL = "SET notifications.paused = 'on'"
+
+# Seconds without notifications after which the connection is checked, and seconds
+# between attempts to reconnect
+KEEPALIVE_SECONDS = 60
+RETRY_SECONDS = 5
+
+FUNCTION_SQL = f"""
+    CREATE OR REPLACE FUNCTION notify_table_change() RETURNS trigger AS $$
+    BEGIN
+        IF current_setting('notifications.paused', true) IS DISTINCT FROM 'on' THEN
+            PERFORM pg_notify('{CHANNEL}', TG_TABLE_NAME);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """
+
+TRIGGER_SQL = """
+    DROP TRIGGER IF EXISTS {table}_notify_change ON {table};
+    CREATE TRIGGER {table}_notify_change
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change();
+    """
+
+DROP_TRIGGER_SQL = "DROP TRIGGER IF EXISTS {table}_notify_change ON {table}"
+
+
+def install(connection, tables):
+    """
+    Make tables notify their changes; running it again replaces the triggers.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the primary database
+        tables (list[str]): Names of the tables
+    """
+    connection.exec_driver_sql(FUNCTION_SQL)
+    for table in tables:
+        connection.exec_driver_sql(TRIGGER_SQL.format(table=table))
+
+
+def uninstall(connection, tables):
+    """
+    Stop tables from notifying their changes.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the primary database
+        tables (list[str]): Names of the tables
+    """
+    for table in tables:
+        connection.exec_driver_sql(DROP_TRIGGER_SQL.format(table=table))
+
+
+def notify(connection, tables):
+    """
+    Publish changes of tables, e.g. after writing to them with paused notifications.
+    Delivered when the transaction of the connection commits.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the primary database
+        tables (list[str]): Names of the changed tables; the unwatched ones are skipped
+    """
+    for table in tables:
+        if table in WATCHED_TABLES:
+            connection.execute(db.text("SELECT pg_notify(:channel, :table)"), {"channel": CHANNEL, "table": table})
+
+
+def create_trigger(table, connection, **kw):
+    """after_create event handler adding the trigger to the watched tables created from models.py"""
+    if connection.dialect.name == "postgresql" and table.name in WATCHED_TABLES:
+        install(connection, [table.name])
+
+
+class Listener(threading.Thread):
+    """
+    Daemon thread receiving the table change notifications.
+
+    Args:
+        on_change (callable): Called with the set of names of the changed tables, or
+            with None after a lost connection was reestablished, since any table may
+            have changed meanwhile
+    """
+
+    def __init__(self, on_change):
+        super().__init__(name="table-change-listener", daemon=True)
+        self.on_change = on_change
+
+    def run(self):
+        with app.app_context():
+            engine = db.engine
+        reconnected = False
+        while True:
+            connection = None
+            try:
+                # A connection of its own, taken out of the pool, as it stays in LISTEN
+                pooled = engine.raw_connection()
+                connection = pooled.driver_connection
+                pooled.detach()
+                connection.autocommit = True
+                self._listen(connection, reconnected)
+            except Exception as error:
+                logger.warning("Lost the %s notifications: %r; reconnecting in %ss",
+                               CHANNEL, error, RETRY_SECONDS)
+            finally:
+                if connection is not None:
+                    connection.close()
+            reconnected = True
+            time.sleep(RETRY_SECONDS)
+
+    def _listen(self, connection, reconnected):
+        """Pass on the notifications of a connection until it fails"""
+        cursor = connection.cursor()
+        cursor.execute(f"LISTEN {CHANNEL}")
+        if reconnected:
+            self.on_change(None)
+        while True:
+            if not select.select([connection], [], [], KEEPALIVE_SECONDS)[0]:
+                # Nothing for a while: make sure the connection is still alive
+                cursor.execute("SELECT 1")
+            connection.poll()
+            tables = {notification.payload for notification in connection.notifies}
+            connection.notifies.clear()
+            for table in tables:
+                metrics.TABLE_CHANGES.inc(table)
+            if tables:
+                self.on_change(tables)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the table change notifications")
+    parser.add_argument("command", choices=["listen"])
+    parser.parse_args()
+    Listener(lambda tables: print(", ".join(sorted(tables)) if tables else "reconnected")).run()
@@ -0,0 +1,216 @@
+"""
+Table Partitioning
+
+The two tables that grow with time are range-partitioned (see models.py):
+    - solutions by "timeSeconds", one partition per calendar year (solutions_y2015)
+    - participations by contest_id, one partition per CONTEST_RANGE contests
+      (participations_c000500), contest ids growing with contest time
+Each also has a default partition catching rows that no range covers yet. Queries
+bounded in time (watermarks, incremental refreshes, time windows) only visit the
+partitions of their range, and old partitions can be detached, e.g. to archive or
+drop them, without rewriting the table.
+
+ensure() creates the ranges up to the newest data plus one range ahead, so new rows
+normally land in their own partition; rows already in a default partition are moved
+into the ranges created for them. loader.py and ingest.py call it before writing.
+
+Usage (from the backend folder):
+    python partitions.py ensure                 # create the missing partitions
+    python partitions.py status                 # list partitions and their sizes
+    python partitions.py detach --before 2015   # detach solutions older than 2015
+"""
+
+import argparse
+import calendar
+import re
+import time
+
+from config import app, db
+
+# First year of solutions with a partition of its own (Codeforces opened in 2010)
+FIRST_YEAR = 2010
+
+# Number of contest ids per participations partition
+CONTEST_RANGE = 500
+
+
+def year_start(year):
+    """Unix time of January 1st of a year, UTC"""
+    return calendar.timegm((year, 1, 1, 0, 0, 0))
+
+
+def solution_ranges(newest):
+    """
+    Args:
+        newest (int): Latest "timeSeconds" to cover
+
+    Returns:
+        list[tuple]: (partition name, lower bound, upper bound) of the yearly
+            partitions through the year after the newest one
+    """
+    last = time.gmtime(newest).tm_year + 1
+    return [(f"solutions_y{year}", year_start(year), year_start(year + 1)) for year in range(FIRST_YEAR, last + 1)]
+
+
+def participation_ranges(newest):
+    """
+    Args:
+        newest (int): Highest contest id to cover
+
+    Returns:
+        list[tuple]: (partition name, lower bound, upper bound) of the contest id
+            ranges through the one after the newest contest
+    """
+    return [(f"participations_c{start:06d}", start, start + CONTEST_RANGE)
+            for start in range(0, (newest // CONTEST_RANGE + 2) * CONTEST_RANGE, CONTEST_RANGE)]
+
+
+# Partitioned table -> (quoted partition key column, function listing its ranges)
+PARTITIONED = {
+    "solutions": ('"timeSeconds"', solution_ranges),
+    "participations": ("contest_id", participation_ranges),
+}
+
+# Partitioned tables whose primary key holds the partition key only because Postgres
+# requires it -> columns still identifying a row, kept unique by loader.py and ingest.py
+UNIQUE_KEYS = {
+    "solutions": ["user_handle", "problem_contest_id", "problem_index"],
+}
+
+
+def is_partitioned(connection, table):
+    """Tell whether a table exists and is partitioned"""
+    return connection.execute(db.text(
+        "SELECT relkind = 'p' FROM pg_class WHERE relname = :table AND relnamespace = 'public'::regnamespace"
+    ), {"table": table}).scalar() or False
+
+
+def partitions(connection, table):
+    """
+    Args:
+        connection (sqlalchemy.engine.Connection): Database connection
+        table (str): Partitioned table
+
+    Returns:
+        dict: Partition name -> (lower bound, upper bound), or None for the default partition
+    """
+    rows = connection.execute(db.text(
+        """
+        SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+        FROM pg_inherits AS inheritance
+        JOIN pg_class AS child ON inheritance.inhrelid = child.oid
+        WHERE inheritance.inhparent = CAST(:table AS regclass)
+        """
+    ), {"table": table}).all()
+    found = {}
+    for name, bound in rows:
+        match = re.search(r"FROM \('?(-?\d+)'?\) TO \('?(-?\d+)'?\)", bound)
+        found[name] = (int(match.group(1)), int(match.group(2))) if match else None
+    return found
+
+
+def ensure(connection, newest_time=None, newest_contest=None):
+    """
+    Create the missing partitions of every partitioned table, moving the rows of
+    their range out of the default partition. Tables that are not partitioned (a
+    database not migrated yet) are skipped.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection, in the caller's transaction
+        newest_time (int): Latest "timeSeconds" about to be written, if known
+        newest_contest (int): Highest contest id about to be written, if known
+
+    Returns:
+        list[str]: Names of the created partitions
+    """
+    newest = {
+        "solutions": max(int(time.time()), newest_time or 0, connection.execute(db.text(
+            'SELECT COALESCE(MAX("timeSeconds"), 0) FROM solutions')).scalar() or 0),
+        "participations": max(newest_contest or 0, connection.execute(db.text(
+            "SELECT GREATEST((SELECT MAX(id) FROM contests), (SELECT MAX(contest_id) FROM participations))"
+        )).scalar() or 0),
+    }
+
+    created = []
+    for table, (column, ranges) in PARTITIONED.items():
+        if not is_partitioned(connection, table):
+            continue
+        default = f"{table}_default"
+        existing = partitions(connection, table)
+        if default not in existing:
+            connection.execute(db.text(f"CREATE TABLE {default} PARTITION OF {table} DEFAULT"))
+
+        for name, lower, upper in ranges(newest[table]):
+            if name in existing:
+                continue
+            in_range = f"{column} >= {lower} AND {column} < {upper}"
+            stray = connection.execute(db.text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})")).scalar()
+            if not stray:
+                connection.execute(db.text(
+                    f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ({lower}) TO ({upper})"
+                ))
+            else:
+                # A new range may not overlap rows of the default partition: move them first
+                connection.execute(db.text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+                connection.execute(db.text(
+                    f"WITH moved AS (DELETE FROM {default} WHERE {in_range} RETURNING *) "
+                    f"INSERT INTO {name} SELECT * FROM moved"
+                ))
+                connection.execute(db.text(
+                    f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper})"
+                ))
+            created.append(name)
+    return created
+
+
+def detach(connection, table, below):
+    """
+    Detach the partitions whose whole range lies below a bound. Detached partitions
+    remain as standalone tables that can be archived or dropped.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Database connection
+        table (str): Partitioned table
+        below (int): Bound of the partition key
+
+    Returns:
+        list[str]: Names of the detached partitions
+    """
+    detached = []
+    for name, bounds in sorted(partitions(connection, table).items()):
+        if bounds is not None and bounds[1] <= below:
+            connection.execute(db.text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            detached.append(name)
+    return detached
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the partitions of solutions and participations")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("ensure", help="Create the missing partitions")
+    subparsers.add_parser("status", help="List the partitions")
+    detach_parser = subparsers.add_parser("detach", help="Detach old partitions")
+    detach_parser.add_argument("--before", type=int, help="Detach solutions partitions of years before this one")
+    detach_parser.add_argument("--below-contest", type=int,
+                               help="Detach participations partitions of contest ids below this one")
+    args = parser.parse_args()
+
+    with app.app_context(), db.engine.begin() as connection:
+        if args.command == "ensure":
+            for name in ensure(connection):
+                print(f"Created {name}")
+        elif args.command == "status":
+            for table in PARTITIONED:
+                for name, bounds in sorted(partitions(connection, table).items()):
+                    rows, size = connection.execute(db.text(
+                        "SELECT reltuples::BIGINT, pg_size_pretty(pg_total_relation_size(oid)) "
+                        "FROM pg_class WHERE relname = :name"
+                    ), {"name": name}).one()
+                    print(f"{name}: {bounds or 'default'}, ~{max(rows, 0)} rows, {size}")
+        else:
+            if args.before is not None:
+                for name in detach(connection, "solutions", year_start(args.before)):
+                    print(f"Detached {name}")
+            if args.below_contest is not None:
+                for name in detach(connection, "participations", args.below_contest):
+                    print(f"Detached {name}")
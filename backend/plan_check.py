@@ -0,0 +1,176 @@
+"""
+Query Plan Regression Check
+
+Runs EXPLAIN (ANALYZE, BUFFERS) on the queries behind the API and the incremental
+refresh (routes.py, topic_engine.py, user_engine.py, rollups.py) against the
+configured database, seeded with representative data, and fails when a plan:
+    - scans a table sequentially where an index is expected (e.g. solutions in an
+      incremental refresh, whose cost must follow the size of the delta)
+    - exceeds its planner cost budget
+Scans of partitions count as scans of their partitioned table (see partitions.py);
+tables and partitions of a few pages, e.g. the empty partitions ahead of the data, are
+read sequentially by any good plan and exempt.
+Every statement runs inside a savepoint that is rolled back, so the database is left
+unchanged. The exit status is 1 when any check fails, for use in CI.
+
+Usage (from the backend folder):
+    python plan_check.py                   # check every query
+    python plan_check.py --max-cost 50000  # also cap the cost of every query
+"""
+
+from collections import namedtuple
+import argparse
+import json
+import sys
+
+from config import app, db
+import rollups
+import routes
+import topic_engine
+import user_engine
+
+# A query to explain: `setup` statements run first inside the same savepoint,
+# `no_seq_scan` lists tables that must be reached through an index, and `max_cost`
+# is the planner cost budget (None for queries that read whole tables by design)
+PlanCheck = namedtuple("PlanCheck", ["name", "sql", "setup", "no_seq_scan", "max_cost"])
+
+# Cost budget of the queries whose work should follow the size of a delta
+INCREMENTAL_COST = 10_000
+
+# Relations smaller than this many pages may be scanned sequentially
+MIN_CHECKED_PAGES = 8
+
+
+def plan_checks():
+    """
+    Returns:
+        list[PlanCheck]: Checks of the API reads, watermarks and incremental refresh
+    """
+    checks = [
+        PlanCheck("topic frame: problems", topic_engine.PROBLEMS_QUERY, [], (), None),
+        PlanCheck("topic frame: problem tags", topic_engine.PROBLEM_TAGS_QUERY, [], (), None),
+        PlanCheck("user frame", user_engine.USERS_QUERY.format(sample=""), [], (), None),
+        PlanCheck("blog topics", routes.BLOG_TOPICS_QUERY, [], (), None),
+        PlanCheck("topics by month", routes.TOPICS_BY_MONTH_QUERY.format(conditions="TRUE"), [], (), None),
+        PlanCheck("rating bands by month", routes.RATING_BANDS_BY_MONTH_QUERY.format(conditions="TRUE"), [], (),
+                  None),
+        PlanCheck("rating trajectory", routes.RATING_TRAJECTORY_QUERY, [], ("user_rating_month",),
+                  INCREMENTAL_COST),
+    ]
+    for name, sql in rollups.WATERMARKS.items():
+        checks.append(PlanCheck(f"watermark {name}", sql, [], ("solutions",), INCREMENTAL_COST))
+    for name, sql in rollups.TOUCHED_KEYS.items():
+        checks.append(PlanCheck(f"touched keys {name}", sql, [], ("solutions",), INCREMENTAL_COST))
+    for rollup in rollups.ROLLUPS:
+        checks.append(PlanCheck(
+            f"incremental refresh {rollup.table}",
+            rollup.source.format(scope=rollup.scope),
+            [f"DELETE FROM {rollup.table} WHERE {rollup.stale}"],
+            ("solutions",),
+            INCREMENTAL_COST,
+        ))
+    return checks
+
+
+def plan_nodes(plan):
+    """Yield a plan node and all of its descendants"""
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def relations():
+    """
+    Returns:
+        dict: Table or partition name -> (name of the table it belongs to, number of pages)
+    """
+    rows = db.session.execute(db.text(
+        """
+        SELECT rel.relname, COALESCE(parent.relname, rel.relname), rel.relpages
+        FROM pg_class AS rel
+        LEFT JOIN pg_inherits AS inheritance ON inheritance.inhrelid = rel.oid
+        LEFT JOIN pg_class AS parent ON inheritance.inhparent = parent.oid
+        WHERE rel.relkind = 'r' AND rel.relnamespace = 'public'::regnamespace
+        """
+    )).all()
+    return {name: (table, pages) for name, table, pages in rows}
+
+
+def explain(check, params, max_cost=None, tables=None):
+    """
+    Explain one query and compare its plan with the expectations.
+
+    Args:
+        check (PlanCheck): Query to explain
+        params (dict): Query parameters
+        max_cost (float): Cost budget applied on top of the check's own, or None
+        tables (dict): Relation name -> (table, pages), see relations()
+
+    Returns:
+        tuple: (root plan node, list of failure messages)
+    """
+    savepoint = db.session.begin_nested()
+    try:
+        for sql in check.setup:
+            db.session.execute(db.text(sql), params)
+        result = db.session.execute(
+            db.text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {check.sql}"), params
+        ).scalar()
+    finally:
+        savepoint.rollback()
+
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]["Plan"]
+    tables = tables or {}
+    failures = []
+    for node in plan_nodes(plan):
+        if node["Node Type"] != "Seq Scan":
+            continue
+        name = node["Relation Name"]
+        table, pages = tables.get(name, (name, MIN_CHECKED_PAGES))
+        if table in check.no_seq_scan and pages >= MIN_CHECKED_PAGES:
+            failures.append(f"sequential scan on {name}")
+    budgets = [budget for budget in (check.max_cost, max_cost) if budget is not None]
+    if budgets and plan["Total Cost"] > min(budgets):
+        failures.append(f"cost {plan['Total Cost']:.0f} over budget {min(budgets):.0f}")
+    return plan, failures
+
+
+def run(max_cost=None):
+    """
+    Explain every check, printing one line per query.
+
+    Args:
+        max_cost (float): Cost budget applied to every query, or None
+
+    Returns:
+        int: Number of failed checks
+    """
+    # The incremental checks see the keys a refresh would see right now
+    params = rollups.read_watermarks() or rollups.current_watermarks()
+    rollups.collect_touched_keys(params)
+    # Any user with a trajectory will do for the per-user reads
+    params["handle"] = db.session.execute(db.text("SELECT MIN(user_handle) FROM user_rating_month")).scalar()
+    tables = relations()
+
+    failed = 0
+    for check in plan_checks():
+        plan, failures = explain(check, params, max_cost, tables)
+        buffers = plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0)
+        print(f"{'FAIL' if failures else 'ok  '} {check.name}: cost {plan['Total Cost']:.0f}, "
+              f"{plan['Actual Total Time']:.1f} ms, {buffers} buffers")
+        for failure in failures:
+            print(f"       {failure}")
+        failed += bool(failures)
+    db.session.rollback()
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the query plans of the API and refresh queries")
+    parser.add_argument("--max-cost", type=float, help="Planner cost budget applied to every query")
+    args = parser.parse_args()
+
+    with app.app_context():
+        failed = run(args.max_cost)
+    print(f"{failed} of {len(plan_checks())} checks failed")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,85 @@
+"""
+Concurrent Query Execution
+
+Runs independent pieces of database work at the same time. Each task gets its own
+application context, hence its own SQLAlchemy session and pooled connection, so
+for example the two reads behind the topic frame overlap instead of queueing on
+one connection. Request handlers themselves already run in worker threads (Connexion
+serves the Flask app through its ASGI adapter), so blocking queries never stall the
+event loop; this module shortens the critical path of a single slow request.
+
+Reads made through this module use the "analytics" bind configured in config.py (a
+read replica or a pool separate from the primary), with a statement timeout, so a
+cache fill can neither exhaust the primary pool nor run unbounded. With
+ANALYTICS_BACKEND=duckdb they run on the embedded engine of columnar.py instead.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+
+from config import analytics_backend, app, db, query_workers
+
+# Name of the database bind serving analytical reads
+ANALYTICS = "analytics"
+
+# Pool shared by every fan-out; keep it below the analytics connection pool size
+_query_pool = ThreadPoolExecutor(max_workers=query_workers, thread_name_prefix="db-query")
+
+
+def _in_app_context(func, args, kwargs):
+    with app.app_context():
+        return func(*args, **kwargs)
+
+
+def submit(func, *args, **kwargs):
+    """
+    Run a function on the query pool inside its own application context. The task
+    sees the context variables of the caller, e.g. the metrics scope.
+
+    Args:
+        func (callable): Function to run
+        *args: Positional arguments of func
+        **kwargs: Keyword arguments of func
+
+    Returns:
+        concurrent.futures.Future: Result of func
+    """
+    return _query_pool.submit(contextvars.copy_context().run, _in_app_context, func, args, kwargs)
+
+
+def read(sql, params=None, timeout_ms=None):
+    """
+    Run a read query on the analytics bind, or on DuckDB when it is the configured backend.
+
+    Args:
+        sql (str): SQL text
+        params (dict): Query parameters
+        timeout_ms (int): Statement timeout for the rest of the transaction in
+            milliseconds, instead of the bind's default (Postgres only)
+
+    Returns:
+        list: Result rows
+    """
+    if analytics_backend == "duckdb":
+        import columnar
+
+        return columnar.read(sql, params)
+    bind = {"bind": db.engines[ANALYTICS]}
+    if timeout_ms is not None:
+        db.session.execute(db.text("SELECT set_config('statement_timeout', :timeout, true)"),
+                           {"timeout": str(timeout_ms)}, bind_arguments=bind)
+    return db.session.execute(db.text(sql), params or {}, bind_arguments=bind).all()
+
+
+def fetch_all(*queries):
+    """
+    Execute independent read queries concurrently on the analytics bind.
+
+    Args:
+        *queries (str | tuple): SQL text, or a (SQL text, parameters) pair
+
+    Returns:
+        list[list]: Rows of every query, in the order of the queries
+    """
+    futures = [submit(read, *(query if isinstance(query, tuple) else (query,))) for query in queries]
+    return [future.result() for future in futures]
@@ -0,0 +1,325 @@
+"""
+Aggregate Rollup Layer
+
+Maintains precomputed aggregate tables backing the blog and user endpoints in
+routes.py, so that requests read prepared rows instead of grouping over blogs,
+participations and solutions (topic statistics come from topic_engine.py). Monthly
+rollups, keyed by the month contests started, back the trend endpoints: topic
+frequency and solvability, rating band populations and user rating trajectories. Watermarks
+stored in rollup_state record how far the source tables have been folded in, which
+lets a refresh recompute only the rollup rows whose keys were touched since the
+previous run.
+
+Usage (from the backend folder):
+    python rollups.py refresh          # fold in rows added since the last refresh
+    python rollups.py refresh --full   # rebuild every rollup from scratch
+"""
+
+from collections import namedtuple
+import argparse
+import time
+
+from config import app, db
+from models import (Base, BlogTopicRollup, RatingBandMonthRollup, RollupState, TopicMonthRollup,
+                    UserFeatures, UserRatingMonth)
+
+# Tables owned by this module, created on the first refresh
+ROLLUP_TABLES = [
+    BlogTopicRollup.__table__,
+    UserFeatures.__table__,
+    TopicMonthRollup.__table__,
+    UserRatingMonth.__table__,
+    RatingBandMonthRollup.__table__,
+    RollupState.__table__,
+]
+
+# Month a contest started, e.g. '2024-03' (UTC), for a contests table aliased c
+# (contests without a known start time belong to no month and are left out of the
+# rollups)
+CONTEST_MONTH = """to_char(to_timestamp(c."startTimeSeconds") AT TIME ZONE 'UTC', 'YYYY-MM')"""
+
+# (lowest rating, name) of the Codeforces rating bands, in increasing order
+RATING_BANDS = [
+    (0, "newbie"),
+    (1200, "pupil"),
+    (1400, "specialist"),
+    (1600, "expert"),
+    (1900, "candidate master"),
+    (2100, "master"),
+    (2300, "international master"),
+    (2400, "grandmaster"),
+    (2600, "international grandmaster"),
+    (3000, "legendary grandmaster"),
+]
+
+
+def rating_band(column, part):
+    """
+    Args:
+        column (str): SQL expression of a rating
+        part (int): 0 for the lowest rating of its band, 1 for the band name
+
+    Returns:
+        str: SQL CASE expression mapping the rating to its band (ratings below 0 are newbies)
+    """
+    cases = " ".join(f"WHEN {column} >= {band[0]} THEN {band[part]!r}" for band in reversed(RATING_BANDS[1:]))
+    return f"CASE {cases} ELSE {RATING_BANDS[0][part]!r} END"
+
+
+# Watermark name -> query returning its current value in the source tables.
+# Contests and blogs only grow, and solutions carry their submission time, so the
+# maximum of each column is enough to tell new rows from the ones already folded in.
+WATERMARKS = {
+    "contests_start_time": 'SELECT COALESCE(MAX("startTimeSeconds"), 0) FROM contests',
+    "solutions_time": 'SELECT COALESCE(MAX("timeSeconds"), 0) FROM solutions',
+    "blogs_id": "SELECT COALESCE(MAX(id), 0) FROM blogs",
+}
+
+# Temporary table name -> query collecting the keys touched since the stored watermarks
+TOUCHED_KEYS = {
+    "touched_users": """
+        SELECT s.user_handle
+        FROM solutions AS s
+        WHERE s."timeSeconds" > :solutions_time
+        UNION
+        SELECT p.user_handle
+        FROM participations AS p
+        JOIN contests AS c ON p.contest_id = c.id
+        WHERE c."startTimeSeconds" > :contests_start_time
+        """,
+    "touched_blog_tags": """
+        SELECT DISTINCT bt.tag
+        FROM blog_tags AS bt
+        WHERE bt.blog_id > :blogs_id
+        """,
+    "touched_months": f"""
+        SELECT DISTINCT {CONTEST_MONTH} AS month
+        FROM contests AS c
+        WHERE c."startTimeSeconds" > :contests_start_time
+        """,
+}
+
+# A rollup is rebuilt from `source`, whose {scope} placeholder is TRUE for a full
+# refresh and `scope` for an incremental one; `stale` selects the rows to replace.
+Rollup = namedtuple("Rollup", ["table", "source", "scope", "stale"])
+
+ROLLUPS = [
+    Rollup(
+        table="blog_topic_rollup",
+        source="""
+            INSERT INTO blog_topic_rollup (tag, avg_rating, avg_number_of_comments, number_of_blogs)
+            SELECT bt.tag,
+                   AVG(b.rating),
+                   AVG("numberOfComments"),
+                   COUNT(*)
+            FROM blogs AS b
+            JOIN blog_tags AS bt ON b.id = bt.blog_id
+            WHERE {scope}
+            GROUP BY bt.tag
+            """,
+        scope="bt.tag IN (SELECT tag FROM touched_blog_tags)",
+        stale="tag IN (SELECT tag FROM touched_blog_tags)",
+    ),
+    Rollup(
+        # One pass producing every per-user feature. Each user contributes a single
+        # row taken at their latest contest, and solutions are aggregated per user
+        # before joining, so nothing fans out over the user's participations.
+        table="user_features",
+        source="""
+            INSERT INTO user_features (user_handle, rating, experience, number_of_solutions,
+                                       avg_solutions_rating, avg_solutions_solvability)
+            WITH latest_participation AS (
+                SELECT DISTINCT ON (p.user_handle)
+                       p.user_handle, p.new_rating, p.rating_change, c."startTimeSeconds"
+                FROM participations AS p
+                JOIN contests AS c ON p.contest_id = c.id
+                WHERE c."startTimeSeconds" IS NOT NULL AND {scope}
+                ORDER BY p.user_handle, c."startTimeSeconds" DESC, c.id DESC
+            ),
+            solved AS (
+                SELECT s.user_handle,
+                       count(*) AS number_of_solutions,
+                       AVG(pb.rating) AS avg_solutions_rating,
+                       AVG(pb.success_trials::DECIMAL /
+                           NULLIF(pb.success_trials + pb.unsuccess_trials, 0))
+                           AS avg_solutions_solvability
+                FROM solutions AS s
+                JOIN problems AS pb ON s.problem_contest_id = pb.contest_id
+                                     AND s.problem_index = pb.index
+                WHERE {scope}
+                GROUP BY s.user_handle
+            )
+            SELECT lp.user_handle,
+                   lp.new_rating,
+                   ((lp."startTimeSeconds" - u."registrationTimeSeconds")
+                    / (3600 * 24 * 365)),
+                   COALESCE(sv.number_of_solutions, 0),
+                   sv.avg_solutions_rating,
+                   sv.avg_solutions_solvability
+            FROM latest_participation AS lp
+            JOIN users AS u ON u.handle = lp.user_handle
+            LEFT JOIN solved AS sv ON sv.user_handle = lp.user_handle
+            WHERE lp.rating_change <= 250
+            """,
+        # Unqualified, as it applies to both participations and solutions
+        scope="user_handle IN (SELECT user_handle FROM touched_users)",
+        stale="user_handle IN (SELECT user_handle FROM touched_users)",
+    ),
+    Rollup(
+        # Problems count in the month their contest started; a month is recomputed
+        # whole when one of its contests is new
+        table="topic_month_rollup",
+        source=f"""
+            INSERT INTO topic_month_rollup (month, tag, number_of_problems, success_trials, unsuccess_trials)
+            SELECT {CONTEST_MONTH},
+                   pt.tag,
+                   COUNT(*),
+                   SUM(pb.success_trials),
+                   SUM(pb.unsuccess_trials)
+            FROM problems AS pb
+            JOIN contests AS c ON pb.contest_id = c.id
+            JOIN problem_tags AS pt ON pt.problem_contest_id = pb.contest_id
+                                    AND pt.problem_index = pb.index
+            WHERE c."startTimeSeconds" IS NOT NULL AND {{scope}}
+            GROUP BY 1, pt.tag
+            """,
+        scope=f"{CONTEST_MONTH} IN (SELECT month FROM touched_months)",
+        stale="month IN (SELECT month FROM touched_months)",
+    ),
+    Rollup(
+        # Rating at the end of every month of every user, taken at their last contest
+        # of the month
+        table="user_rating_month",
+        source=f"""
+            INSERT INTO user_rating_month (user_handle, month, rating, rating_change, number_of_contests)
+            SELECT p.user_handle,
+                   {CONTEST_MONTH},
+                   (array_agg(p.new_rating ORDER BY c."startTimeSeconds" DESC, c.id DESC))[1],
+                   SUM(p.rating_change),
+                   COUNT(*)
+            FROM participations AS p
+            JOIN contests AS c ON p.contest_id = c.id
+            WHERE c."startTimeSeconds" IS NOT NULL AND {{scope}}
+            GROUP BY p.user_handle, 2
+            """,
+        scope=f"{CONTEST_MONTH} IN (SELECT month FROM touched_months)",
+        stale="month IN (SELECT month FROM touched_months)",
+    ),
+    Rollup(
+        # Built from user_rating_month, refreshed just before
+        table="rating_band_month_rollup",
+        source=f"""
+            INSERT INTO rating_band_month_rollup (month, min_rating, band, number_of_users)
+            SELECT urm.month,
+                   {rating_band("urm.rating", 0)},
+                   {rating_band("urm.rating", 1)},
+                   COUNT(*)
+            FROM user_rating_month AS urm
+            WHERE {{scope}}
+            GROUP BY 1, 2, 3
+            """,
+        scope="urm.month IN (SELECT month FROM touched_months)",
+        stale="month IN (SELECT month FROM touched_months)",
+    ),
+]
+
+
+def read_watermarks():
+    """
+    Load the watermarks stored by the previous refresh.
+
+    Returns:
+        dict: Watermark name -> stored value; empty if no refresh has completed yet
+    """
+    rows = db.session.execute(db.text("SELECT name, value FROM rollup_state")).all()
+    return {name: value for name, value in rows}
+
+
+def current_watermarks():
+    """
+    Read the current value of every watermark from the source tables.
+
+    Returns:
+        dict: Watermark name -> current maximum in the source tables
+    """
+    return {name: db.session.execute(db.text(sql)).scalar() for name, sql in WATERMARKS.items()}
+
+
+def collect_touched_keys(stored):
+    """
+    Create the TOUCHED_KEYS temporary tables (dropped on commit) for the given
+    watermarks, with statistics so the planner knows how few keys they hold.
+
+    Args:
+        stored (dict): Watermark name -> value stored by the previous refresh
+    """
+    for name, sql in TOUCHED_KEYS.items():
+        db.session.execute(db.text(f"CREATE TEMP TABLE {name} ON COMMIT DROP AS {sql}"), stored)
+        db.session.execute(db.text(f"ANALYZE {name}"))
+
+
+def refresh(full=False):
+    """
+    Bring every rollup table up to date with the source tables.
+
+    An incremental refresh collects the tags, users and blog tags touched by contests,
+    solutions and blogs newer than the stored watermarks, deletes their rollup rows and
+    recomputes them from the full source data. Changes that are not tied to a newer
+    timestamp (e.g. updated success_trials of an old problem) need a full refresh.
+    The first refresh is always full, and so is the first refresh of a rollup table
+    added since the previous one.
+
+    Args:
+        full (bool): Rebuild all rollups instead of only the touched keys
+
+    Returns:
+        dict: Rollup table name -> number of rows written
+    """
+    inspector = db.inspect(db.engine)
+    created = {table.name for table in ROLLUP_TABLES if not inspector.has_table(table.name)}
+    Base.metadata.create_all(db.engine, tables=ROLLUP_TABLES)
+
+    stored = read_watermarks()
+    # Read the new watermarks before recomputing, so rows arriving mid-refresh are
+    # picked up again by the next run instead of being skipped
+    current = current_watermarks()
+    full = full or set(stored) != set(WATERMARKS)
+
+    if not full:
+        collect_touched_keys(stored)
+
+    written = {}
+    for rollup in ROLLUPS:
+        if full or rollup.table in created:
+            db.session.execute(db.text(f"TRUNCATE {rollup.table}"))
+            result = db.session.execute(db.text(rollup.source.format(scope="TRUE")))
+        else:
+            db.session.execute(db.text(f"DELETE FROM {rollup.table} WHERE {rollup.stale}"))
+            result = db.session.execute(db.text(rollup.source.format(scope=rollup.scope)))
+        written[rollup.table] = result.rowcount
+
+    for name, value in current.items():
+        db.session.execute(db.text(
+            """
+            INSERT INTO rollup_state (name, value) VALUES (:name, :value)
+            ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+            """
+        ), {"name": name, "value": value})
+
+    db.session.commit()
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the aggregate rollup tables")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = subparsers.add_parser("refresh", help="Refresh rollups from the source tables")
+    refresh_parser.add_argument("--full", action="store_true", help="Rebuild every rollup from scratch")
+    args = parser.parse_args()
+
+    with app.app_context():
+        started = time.time()
+        written = refresh(full=args.full)
+        for table, rows in written.items():
+            print(f"{table}: {rows} rows")
+        print(f"Refreshed in {time.time() - started:.1f}s")
@@ -1,8 +1,26 @@
-from functools import lru_cache
-from config import db
+from cache import cached
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from config import (analytics_backend, app, batch_workers, cache_poll_seconds, cache_stale_ttl_seconds,
+                    cache_ttl_seconds, db, shared_cache_dir)
+from flask import abort
+from formats import JSON, Payload, Table, negotiated, streamed
+from shared_store import SharedStore
+from sqlalchemy.exc import ProgrammingError
+from topic_engine import TopicFrame
+from user_engine import UserFrame, bootstrap_correlation, downsample, hexbin, histogram2d
+from werkzeug.exceptions import HTTPException
+import json
+import logging
+import metrics
+import notifications
 import numpy as np
+import queries
+import threading
 import time
 
+logger = logging.getLogger(__name__)
+
 supertopics = {
   "programming competitions": "Competitions and Platforms",
   "online judges": "Competitions and Platforms",
@@ -75,328 +93,547 @@ supertopics = {
 }
 
 
-def timed_cache(seconds):
+# Store sharing the cached values between the worker processes, if configured
+shared = SharedStore(shared_cache_dir) if shared_cache_dir else None
+
+
+def timed_cache(seconds, tables=()):
     """
-    Custom decorator that combines LRU caching with time-based cache invalidation.
-    Creates a caching layer that automatically clears after specified duration,
-    while maintaining the benefits of least-recently-used caching strategy.
+    Decorator caching endpoint results for a given duration.
+    Built on cache.TimedCache: each argument key expires on its own, only one caller
+    recomputes an expired key while the others keep getting the previous value,
+    values are refreshed in the background shortly before they expire (expired ones
+    are served for at most CACHE_STALE_TTL_SECONDS), and the number of cached keys
+    is bounded with least-recently-used eviction.
 
     Args:
         seconds (int): Cache validity duration in seconds
+        tables (tuple[str]): Tables the function reads, whose changes make its values stale
 
     Returns:
         function: Decorator that manages cached function results with time-based expiration
     """
 
     def decorator(func):
-        @lru_cache(maxsize=None)
-        def cached_func(*args, **kwargs):
-            """Inner cached function using LRU cache strategy"""
-            return func(*args, **kwargs)
-
-        def wrapper(*args, **kwargs):
-            """
-            Wrapper function that manages cache expiration.
-            Checks time elapsed since last reset and clears cache when expired.
-            """
-            result = cached_func(*args, **kwargs)
-            if time.time() - wrapper.last_reset > seconds:
-                cached_func.cache_clear()
-                wrapper.last_reset = time.time()
-            return result
-
-        wrapper.last_reset = time.time()
-        return wrapper
+        # Background refreshes run outside of any request, so they need their own app context
+        cache = cached(ttl=seconds, stale_ttl=min(seconds, cache_stale_ttl_seconds), context=app.app_context,
+                       shared=shared)(func)
+        cached_datasets[func.__name__] = cache
+        return depends_on(tables)(cache)
 
     return decorator
 
 
-@timed_cache(seconds=3600 * 24)
+def depends_on(tables):
+    """
+    Decorator recording the source tables of a cache, so that the table change
+    notifications make its values stale.
+
+    Args:
+        tables (tuple[str]): Tables read by the cached function, all of them in
+            notifications.WATCHED_TABLES
+
+    Returns:
+        function: Decorator returning the cache unchanged
+    """
+
+    unwatched = set(tables) - set(notifications.WATCHED_TABLES)
+    if unwatched:
+        raise ValueError(f"Tables without change notifications: {', '.join(sorted(unwatched))}")
+
+    def decorator(cache):
+        for table in tables:
+            caches_by_table.setdefault(table, []).append(cache)
+        return cache
+
+    return decorator
+
+
+# Cached functions by name, as referenced in cache_versions
+cached_datasets = {}
+
+# Names of the cached functions requiring arguments (e.g. a handle), not warmed up
+keyed_datasets = set()
+
+# Caches by the tables they read
+caches_by_table = {}
+
+
+def mark_changed(tables):
+    """
+    Mark stale the caches reading from changed tables; they keep serving their
+    current values while these are recomputed in the background.
+
+    Args:
+        tables (set): Names of the changed tables, or None when any table may have changed
+    """
+    if tables is None:
+        tables = caches_by_table
+    for cache in {cache for table in tables for cache in caches_by_table.get(table, ())}:
+        cache.mark_stale()
+
+
+def listen_for_changes():
+    """Start marking caches stale as soon as their tables change (see notifications.py)"""
+    notifications.Listener(mark_changed).start()
+
+# Versions of cache_versions seen by this worker (None until first read) and when they were last read
+_seen_versions = None
+_versions_checked_at = 0.0
+_versions_lock = threading.Lock()
+
+
+def sync_cache_versions():
+    """
+    Refresh cached datasets whose version was bumped by ingest.py, as a fallback for
+    missed table change notifications (or when they are disabled).
+    Reads the small cache_versions table at most once per cache_poll_seconds;
+    changed datasets keep serving their current value while they are
+    recomputed in the background.
+    """
+    global _seen_versions, _versions_checked_at
+    # Parquet files of the DuckDB backend are not ingested into, and Postgres may be absent
+    if analytics_backend != "postgres" or time.monotonic() - _versions_checked_at < cache_poll_seconds:
+        return
+    # One request per worker performs the check, the others carry on
+    if not _versions_lock.acquire(blocking=False):
+        return
+    try:
+        _versions_checked_at = time.monotonic()
+        try:
+            versions = dict(db.session.execute(db.text(
+                """SELECT dataset, version FROM cache_versions;"""
+            )).all())
+        except ProgrammingError:
+            # Nothing has been ingested yet, so the table does not exist
+            db.session.rollback()
+            versions = {}
+
+        # Values cached before the first read were computed after the worker started
+        if _seen_versions is not None:
+            for dataset, version in versions.items():
+                if _seen_versions.get(dataset) != version and dataset in cached_datasets:
+                    cached_datasets[dataset].mark_stale()
+        _seen_versions = versions
+    finally:
+        _versions_lock.release()
+
+
+def warm_up():
+    """
+    Start loading every cached dataset in the background, so that the first
+    requests of a freshly started worker find them cached or already in flight.
+    """
+
+    def load(dataset):
+        with app.app_context():
+            dataset()
+
+    # Plain threads rather than the query pool, whose workers the loads themselves use
+    for name, dataset in cached_datasets.items():
+        if name in keyed_datasets:
+            continue
+        threading.Thread(target=load, args=(dataset,), name=f"warm-up-{name}", daemon=True).start()
+
+
+@timed_cache(seconds=cache_ttl_seconds, tables=("problems", "contests", "problem_tags"))
+def topic_frame():
+    """
+    Load problems and problem tags into the in-memory columnar engine.
+    The topic endpoints below are computed from this frame with vectorized
+    NumPy operations, so they share a single database read per refresh.
+
+    Returns:
+        TopicFrame: Column arrays of all problems and tags
+    """
+    return TopicFrame.load()
+
+
+# Topic results keyed by (frame token, filters). A refreshed frame produces new keys
+# and the results of the replaced one are dropped, and the number of rows cached for
+# each endpoint is bounded.
+topic_query_cache = cached(ttl=3600 * 24, maxsize=1024, context=app.app_context,
+                           maxweight=500_000, weigher=len, shared=shared)
+
+
+@negotiated
 def get_topics():
     """
-    Fetch and cache unique problem tags from database.
-    Results are cached for 24 hours to reduce database load.
+    Fetch unique problem tags.
 
     Returns:
         list[str]: Alphabetically sorted unique problem tags
     """
-    # Raw SQL execution for maximum performance
-    topics = db.session.execute(db.text(
-        """SELECT DISTINCT tag FROM problem_tags;"""
-    )).all()
-    # Convert SQLAlchemy Row objects to simple strings
-    return [topic[0] for topic in topics]
+    return _topics(topic_frame())
+
+
+@topic_query_cache
+def _topics(frame):
+    return Payload(frame.topics())
+
+
+def topic_filters(min_rating=None, max_rating=None, start_time_from=None, start_time_to=None, tags=None):
+    """
+    Normalize the optional topic filter query parameters into a hashable cache key,
+    so that equivalent requests (e.g. the same tags in another order) share one entry.
 
+    Returns:
+        tuple: (min_rating, max_rating, start_time_from, start_time_to, sorted tags or None)
+    """
+    return (min_rating, max_rating, start_time_from, start_time_to,
+            tuple(sorted(set(tags))) if tags else None)
 
-@timed_cache(seconds=3600 * 24)
-def get_topics_distribution_by_rating():
+
+@negotiated
+def get_topics_distribution_by_rating(**filters):
     """
     Calculate distribution of problems across different difficulty ratings for each tag.
     Provides insights into which tags appear at different difficulty levels.
 
+    Args:
+        **filters: Optional min_rating, max_rating, start_time_from, start_time_to and tags
+
     Returns:
         list[dict]: Dictionary entries with:
             - topic (str): Problem tag name
             - rating (int): Problem difficulty rating
             - number_of_tasks (int): Count of problems in this category
     """
-    # Complex join between problem tags and problem metadata
-    topic_rating_distribution = db.session.execute(db.text(
-        """
-        SELECT pt.tag, p.rating, count(*)
-        FROM problem_tags AS pt
-        JOIN problems AS p ON pt.problem_contest_id = p.contest_id 
-                             AND pt.problem_index = p.index
-        GROUP BY pt.tag, p.rating
-        ORDER BY pt.tag, p.rating
-        """
-    )).all()
-
-    # Transform raw SQL results into structured dictionaries
-    return [{
-        "topic": item[0],
-        "rating": item[1],
-        "number_of_tasks": item[2]
-    } for item in topic_rating_distribution]
-
-
-@timed_cache(seconds=3600 * 24)
-def get_topics_correlation():
+    return _topics_distribution_by_rating(topic_frame(), topic_filters(**filters))
+
+
+@topic_query_cache
+def _topics_distribution_by_rating(frame, filters):
+    # Bincount over (tag, rating) codes of the incidence entries
+    tags, ratings, counts = frame.distribution_by_rating(*frame.masks(*filters))
+
+    return Payload(Table(topic=frame.tag_names[tags], rating=ratings, number_of_tasks=counts))
+
+
+@negotiated
+def get_topics_correlation(**filters):
     """
     Calculate co-occurrence frequency of tag pairs within problems.
     Identifies which tags commonly appear together in the same problems.
 
+    Args:
+        **filters: Optional min_rating, max_rating, start_time_from, start_time_to and tags
+
     Returns:
         list[dict]: Dictionary entries with:
             - topic1 (str): First tag in pair
             - topic2 (str): Second tag in pair
             - number_of_tasks (int): Count of shared problems
     """
-    # Self-join on problem_tags to find tag correlations
-    topics_correlation = db.session.execute(db.text(
-        """
-        SELECT pt1.tag, pt2.tag, count(*)
-        FROM problem_tags AS pt1
-        JOIN problem_tags AS pt2
-            ON pt1.problem_contest_id = pt2.problem_contest_id 
-            AND pt1.problem_index = pt2.problem_index
-        GROUP BY pt1.tag, pt2.tag
-        ORDER BY pt1.tag, pt2.tag
-        """
-    )).all()
-
-    return [{
-        "topic1": item[0],
-        "topic2": item[1],
-        "number_of_tasks": item[2]
-    } for item in topics_correlation]
-
-
-@timed_cache(seconds=3600 * 24)
-def get_topics_solvability():
+    return _topics_correlation(topic_frame(), topic_filters(**filters))
+
+
+@topic_query_cache
+def _topics_correlation(frame, filters):
+    # Sparse Aᵀ·A of the problem -> tag incidence matrix
+    first, second, counts = frame.correlation(*frame.masks(*filters))
+
+    return Payload(Table(topic1=frame.tag_names[first], topic2=frame.tag_names[second], number_of_tasks=counts))
+
+
+@negotiated
+def get_topics_solvability(**filters):
     """
     Calculate success rates for problems grouped by tags.
     Measures relative difficulty of different topics based on user submissions.
 
+    Args:
+        **filters: Optional min_rating, max_rating, start_time_from, start_time_to and tags
+
     Returns:
         list[dict]: Dictionary entries with:
             - topic (str): Problem tag name
             - solvability (float): Ratio of successful submissions to total attempts
     """
-    # Calculate success ratios using database-level division
-    topic_trials = db.session.execute(db.text(
-        """
-        SELECT pt.tag, 
-               SUM(p.success_trials), 
-               (SUM(p.success_trials) + SUM(p.unsuccess_trials))
-        FROM problem_tags AS pt
-        JOIN problems AS p ON pt.problem_contest_id = p.contest_id 
-                            AND pt.problem_index = p.index
-        GROUP BY pt.tag
-        """
-    )).all()
+    return _topics_solvability(topic_frame(), topic_filters(**filters))
+
+
+@topic_query_cache
+def _topics_solvability(frame, filters):
+    tags, success, total = frame.solvability(*frame.masks(*filters))
 
     # Convert to solvability percentage while handling division by zero
-    return [{
-        "topic": item[0],
-        "solvability": item[1] / item[2] if item[2] > 0 else 0.0
-    } for item in topic_trials]
+    solvability = np.divide(success, total, out=np.zeros(len(total)), where=total > 0)
+    return Payload(Table(topic=frame.tag_names[tags], solvability=solvability))
+
 
+@timed_cache(seconds=cache_ttl_seconds, tables=("user_features",))
+def user_frame():
+    """
+    Load the per-user features precomputed by rollups.py into the in-memory columnar
+    engine. The user rating endpoints below share this single database read.
 
-@timed_cache(seconds=3600 * 24)
-def get_rating_distribution_by_experience():
+    Returns:
+        UserFrame: Column arrays of all users
+    """
+    return UserFrame.load()
+
+
+@depends_on(("user_features",))
+@cached(ttl=3600, maxsize=8, context=app.app_context)
+def user_sample(sample_percent):
+    """
+    Read a random sample of the users, answering approximate requests while the
+    user frame loads.
+
+    Args:
+        sample_percent (float): Percentage of the users to read
+
+    Returns:
+        UserFrame: Column arrays of the sampled users
+    """
+    return UserFrame.load(sample_percent=sample_percent)
+
+
+# User feature -> (correlation key, name of the feature in the data entries)
+RATING_DISTRIBUTIONS = {
+    "experience": ("rating_experience_correlation", "time_registration_years"),
+    "number_of_solutions": ("rating_solutions_count_correlation", "number_of_solved_problems"),
+    "avg_solutions_rating": ("rating_correlation", "avg_rating_of_solved_problems"),
+    "avg_solutions_solvability": ("rating_solvability_correlation", "avg_solvability_of_solved_problems"),
+}
+
+# Probability covered by the confidence intervals of approximate correlations
+CONFIDENCE = 0.95
+
+
+def reduction(mode="points", bins=50, y_bins=None, points=2000):
+    """
+    Normalize the optional reduction query parameters into a hashable cache key,
+    dropping the parameters the chosen mode does not use.
+
+    Returns:
+        tuple: (mode, bins, y_bins, points)
+    """
+    if mode == "points":
+        return mode, None, None, None
+    if mode == "sample":
+        return mode, bins, None, points
+    return mode, bins, y_bins or (bins if mode == "hist2d" else None), None
+
+
+def distribution_weight(payload):
+    """Number of cells or users of a reduced user distribution, used to weigh cached ones"""
+    result = payload.value
+    for reduced in ("histogram", "hexbin"):
+        if reduced in result:
+            return result[reduced]["counts"].size
+    return len(result["data"])
+
+
+# Reduced user distributions keyed by (frame token, feature, reduction); a refreshed
+# frame produces new keys and the distributions of the replaced one are dropped. Clients choose bins, y_bins and points, so the cells and users
+# cached are bounded: a few default distributions of every user plus the requested
+# grids and samples (a 500 x 500 histogram weighs 250,000).
+rating_distribution_cache = cached(ttl=3600 * 24, maxsize=64, context=app.app_context,
+                                   maxweight=4_000_000, weigher=distribution_weight, shared=shared)
+
+
+def estimated(counts, fraction):
+    """Scale the counts of a sample holding a fraction of the users up to estimates for all users"""
+    return counts if fraction >= 1.0 else np.rint(counts / fraction).astype(np.int64)
+
+
+@rating_distribution_cache
+def _rating_distribution(frame, feature, reduction):
+    mode, bins, y_bins, points = reduction
+    correlation_key, name = RATING_DISTRIBUTIONS[feature]
+    rating, values = frame.pairs(feature)
+    result = {correlation_key: float(np.corrcoef(rating, values)[0, 1])}
+    if frame.fraction < 1.0:
+        result.update(
+            approximate=True,
+            sample_size=len(rating),
+            confidence=CONFIDENCE,
+            confidence_interval=list(bootstrap_correlation(rating, values, CONFIDENCE)),
+        )
+
+    # The feature goes along x and the rating along y, as in the charts
+    if mode == "hist2d":
+        x_edges, y_edges, counts = histogram2d(values, rating, bins, y_bins)
+        result["histogram"] = {
+            "x": name,
+            "y": "rating",
+            "x_edges": x_edges,
+            "y_edges": y_edges,
+            "counts": estimated(counts, frame.fraction),
+        }
+    elif mode == "hexbin":
+        width, height, centers_x, centers_y, counts = hexbin(values, rating, bins, y_bins)
+        result["hexbin"] = {
+            "x": name,
+            "y": "rating",
+            "width": width,
+            "height": height,
+            "centers_x": centers_x,
+            "centers_y": centers_y,
+            "counts": estimated(counts, frame.fraction),
+        }
+    else:
+        if mode == "sample":
+            kept = downsample(values, rating, points, bins)
+            result["sampled_from"] = len(rating)
+            rating, values = rating[kept], values[kept]
+        result["data"] = Table(rating=rating, **{name: values})
+    return Payload(result)
+
+
+def rating_distribution(feature, approximate=False, sample_percent=5.0, **reduction_parameters):
+    """
+    Reduce one user distribution. Approximate requests are answered from a sample of
+    the users while the user frame is not loaded, and start loading it in the
+    background, so that later requests get the exact answer.
+
+    Args:
+        feature (str): Key of RATING_DISTRIBUTIONS
+        approximate (bool): Whether a sample may be used rather than waiting for all users
+        sample_percent (float): Percentage of the users sampled
+        **reduction_parameters: Optional mode, bins, y_bins and points
+
+    Returns:
+        Payload: Reduced distribution
+    """
+    frame = user_frame.peek() if approximate else user_frame()
+    if frame is None:
+        user_frame.prefetch()
+        frame = user_sample(sample_percent)
+        if len(frame.ratings) < 3:
+            # Too few pages sampled to estimate anything (a small share of a small table)
+            frame = user_frame()
+    return _rating_distribution(frame, feature, reduction(**reduction_parameters))
+
+
+@negotiated
+def get_rating_distribution_by_experience(**parameters):
     """
     Analyze relationship between user ratings and their platform experience.
     Combines registration time with contest participation data.
 
+    Args:
+        **parameters: Optional mode (points, hist2d, hexbin or sample), bins, y_bins,
+            points, approximate and sample_percent; see the swagger.yml description
+
     Returns:
         dict: Contains:
             - rating_experience_correlation (float): Pearson correlation coefficient
-            - data (list[dict]): Individual entries with:
+            - data (list[dict]): Individual entries (all users, or a sample) with:
                 - rating (float): User rating
                 - time_registration_years (float): Years since registration
+            - histogram / hexbin (dict): Bin counts instead of data in the binned modes
+            - approximate, sample_size, confidence, confidence_interval: When answered from a sample
     """
-    # CTE for getting users' last contest participation
-    rated_experience = db.session.execute(db.text(
-        """
-        WITH user_last_contest AS (
-            SELECT p.user_handle, 
-                   MAX(contests.id) AS contest_id,
-                   MAX("startTimeSeconds") AS startTimeSeconds
-            FROM participations AS p
-            JOIN contests ON p.contest_id = contests.id
-            GROUP BY p.user_handle
-        )
-        SELECT p.new_rating AS rating,
-                ((ulc.startTimeSeconds - "registrationTimeSeconds") 
-                 / (3600 * 24 * 365)) AS experience
-        FROM users AS u
-        JOIN user_last_contest AS ulc ON u.handle = ulc.user_handle
-        JOIN participations AS p ON u.handle = p.user_handle 
-                                  AND p.contest_id = ulc.contest_id
-        WHERE p.rating_change <= 250
-        ORDER BY p.new_rating
-        """
-    )).all()
-
-    # Convert to NumPy array for efficient calculations
-    rated_experience = np.array(rated_experience, dtype='float32')
-    rating = rated_experience[:, 0]
-    experience = rated_experience[:, 1]
-
-    return {
-        "rating_experience_correlation": np.corrcoef(rating, experience)[0, 1],
-        "data": [{
-            "rating": float(item[0]),
-            "time_registration_years": float(item[1])
-        } for item in rated_experience]
-    }
-
-
-@timed_cache(seconds=3600 * 24)
-def get_rating_distribution_by_solutions_amount():
+    return rating_distribution("experience", **parameters)
+
+
+@negotiated
+def get_rating_distribution_by_solutions_amount(**parameters):
     """
     Analyze relationship between user ratings and their total solutions submitted.
     Helps identify if higher-rated users solve more problems.
 
+    Args:
+        **parameters: Optional mode, bins, y_bins, points, approximate and sample_percent
+
     Returns:
         dict: Contains:
             - rating_solutions_count_correlation (float): Pearson correlation
-            - data (list[dict]): Individual entries with:
+            - data (list[dict]): Individual entries (all users, or a sample) with:
                 - rating (float): User rating
                 - number_of_solved_problems (float): Total solutions
+            - histogram / hexbin (dict): Bin counts instead of data in the binned modes
+            - approximate, sample_size, confidence, confidence_interval: When answered from a sample
     """
-    # Join participations with solutions count
-    rated_solutions_number = db.session.execute(db.text(
-        """
-        SELECT p.new_rating AS rating, 
-               count(*) AS number_of_solutions
-        FROM participations AS p
-        JOIN solutions AS s ON p.user_handle = s.user_handle
-        WHERE p.rating_change <= 250
-        GROUP BY p.user_handle, p.new_rating
-        ORDER BY p.new_rating
-        """
-    )).all()
-
-    rated_solutions_number = np.array(rated_solutions_number, dtype='float32')
-    return {
-        "rating_solutions_count_correlation": np.corrcoef(
-            rated_solutions_number[:, 0],
-            rated_solutions_number[:, 1]
-        )[0, 1],
-        "data": [{
-            "rating": float(item[0]),
-            "number_of_solved_problems": float(item[1])
-        } for item in rated_solutions_number]
-    }
-
-
-@timed_cache(seconds=3600 * 24)
-def get_rating_distribution_by_solutions_rating():
+    return rating_distribution("number_of_solutions", **parameters)
+
+
+@negotiated
+def get_rating_distribution_by_solutions_rating(**parameters):
     """
     Analyze relationship between user ratings and average rating of solved problems.
     Shows if users solve problems matching their skill level.
 
+    Args:
+        **parameters: Optional mode, bins, y_bins, points, approximate and sample_percent
+
     Returns:
         dict: Contains:
             - rating_correlation (float): Pearson correlation coefficient
-            - data (list[dict]): Individual entries with:
+            - data (list[dict]): Individual entries (all users, or a sample) with:
                 - rating (float): User rating
                 - avg_rating_of_solved_problems (float): Average problem rating
+            - histogram / hexbin (dict): Bin counts instead of data in the binned modes
+            - approximate, sample_size, confidence, confidence_interval: When answered from a sample
     """
-    # Multi-table join across participations, solutions, and problems
-    rating_correlation = db.session.execute(db.text(
-        """
-        SELECT pt.new_rating AS rating,
-                AVG(pb.rating) AS avg_solutions_rating
-        FROM participations AS pt
-        JOIN solutions AS s ON pt.user_handle = s.user_handle
-        JOIN problems AS pb ON s.problem_contest_id = pb.contest_id 
-                             AND s.problem_index = pb.index
-        WHERE pt.rating_change <= 250
-        GROUP BY pt.user_handle, pt.new_rating
-        ORDER BY pt.new_rating
-        """
-    )).all()
-
-    rating_correlation = np.array(rating_correlation, dtype='float32')
-    return {
-        "rating_correlation": np.corrcoef(
-            rating_correlation[:, 0],
-            rating_correlation[:, 1]
-        )[0, 1],
-        "data": [{
-            "rating": float(item[0]),
-            "avg_rating_of_solved_problems": float(item[1])
-        } for item in rating_correlation]
-    }
-
-
-@timed_cache(seconds=3600 * 24)
-def get_rating_distribution_by_solutions_solvability():
+    return rating_distribution("avg_solutions_rating", **parameters)
+
+
+@negotiated
+def get_rating_distribution_by_solutions_solvability(**parameters):
     """
     Analyze relationship between user ratings and solvability of attempted problems.
     Measures if higher-rated users attempt harder problems.
 
+    Args:
+        **parameters: Optional mode, bins, y_bins, points, approximate and sample_percent
+
     Returns:
         dict: Contains:
             - rating_solvability_correlation (float): Pearson correlation
-            - data (list[dict]): Individual entries with:
+            - data (list[dict]): Individual entries (all users, or a sample) with:
                 - rating (float): User rating
                 - avg_solvability_of_solved_problems (float): Success rate
+            - histogram / hexbin (dict): Bin counts instead of data in the binned modes
+            - approximate, sample_size, confidence, confidence_interval: When answered from a sample
+    """
+    return rating_distribution("avg_solutions_solvability", **parameters)
+
+
+@negotiated
+def get_user(handle):
     """
-    # Calculate solvability using database-level division
-    rated_solvability = db.session.execute(db.text(
-        """
-        SELECT pt.new_rating AS rating,
-                AVG(pb.success_trials::DECIMAL / 
-                   NULLIF(pb.success_trials + pb.unsuccess_trials, 0)) 
-                   AS avg_solutions_solvability
-        FROM participations AS pt
-        JOIN solutions AS s ON pt.user_handle = s.user_handle
-        JOIN problems AS pb ON s.problem_contest_id = pb.contest_id 
-                             AND s.problem_index = pb.index
-        WHERE pt.rating_change <= 250
-        GROUP BY pt.user_handle, pt.new_rating
-        ORDER BY pt.new_rating
-        """
-    )).all()
-
-    rated_solvability = np.array(rated_solvability, dtype='float32')
-    return {
-        "rating_solvability_correlation": np.corrcoef(
-            rated_solvability[:, 1],
-            rated_solvability[:, 0]
-        )[0, 1],
-        "data": [{
-            "rating": float(item[0]),
-            "avg_solvability_of_solved_problems": float(item[1])
-        } for item in rated_solvability]
-    }
-
-
-@timed_cache(seconds=3600 * 24)
+    Place one user in the user rating distributions: their features, named as in the
+    distribution endpoints, with their percentile among the plotted users. Answered
+    from the cached user frame by a hash lookup and binary searches.
+
+    Args:
+        handle (str): User handle
+
+    Returns:
+        dict: Contains:
+            - handle (str): User handle
+            - rating, time_registration_years, number_of_solved_problems,
+              avg_rating_of_solved_problems, avg_solvability_of_solved_problems (dict):
+                - value (float): The user's value (None if undefined)
+                - percentile (float): Share of the users with a lower value, ties
+                  counting half, in percent (None for the solution features of
+                  users without solutions)
+    """
+    found = user_frame().lookup(handle)
+    if found is None:
+        abort(404, f"User {handle} is not part of the user distributions")
+
+    result = {"handle": handle}
+    for feature, (value, percentile) in found.items():
+        name = RATING_DISTRIBUTIONS[feature][1] if feature in RATING_DISTRIBUTIONS else feature
+        result[name] = {"value": value, "percentile": percentile}
+    return Payload(result)
+
+
+# Blog statistics per tag are precomputed by rollups.py
+BLOG_TOPICS_QUERY = """
+    SELECT tag, avg_rating, avg_number_of_comments, number_of_blogs
+    FROM blog_topic_rollup
+    ORDER BY tag
+    """
+
+
+@negotiated
+@timed_cache(seconds=cache_ttl_seconds, tables=("blog_topic_rollup",))
 def get_blog_topics_data():
     """
     Aggregate blog statistics grouped by tags and supertopics.
@@ -410,25 +647,254 @@ def get_blog_topics_data():
             - number_of_blogs (int): Total blogs with this tag
             - supertopic (str): Mapped broad category from supertopics
     """
-    # Aggregate blog statistics with SQL functions
-    topics_data = db.session.execute(db.text(
-        """
-        SELECT bt.tag, 
-               AVG(b.rating), 
-               AVG("numberOfComments"), 
-               COUNT(*)
-        FROM blogs AS b
-        JOIN blog_tags AS bt ON b.id = bt.blog_id
-        GROUP BY bt.tag
-        ORDER BY bt.tag
-        """
-    )).all()
+    topics_data = queries.read(BLOG_TOPICS_QUERY)
 
     # Enhance data with supertopic classification
-    return [{
-        "topic": item[0],
-        "avg_rating": float(item[1]) if item[1] else 0.0,
-        "avg_number_of_comments": float(item[2]) if item[2] else 0.0,
-        "number_of_blogs": item[3],
-        "supertopic": supertopics.get(item[0], "Uncategorized")
-    } for item in topics_data]
+    topics = [item[0] for item in topics_data]
+    return Payload(Table(
+        topic=np.array(topics, dtype=object),
+        avg_rating=np.array([float(item[1]) if item[1] else 0.0 for item in topics_data]),
+        avg_number_of_comments=np.array([float(item[2]) if item[2] else 0.0 for item in topics_data]),
+        number_of_blogs=np.array([item[3] for item in topics_data], dtype=np.int64),
+        supertopic=np.array([supertopics.get(topic, "Uncategorized") for topic in topics], dtype=object),
+    ))
+
+
+# Monthly trends are precomputed by rollups.py, keyed by the month contests started
+TOPICS_BY_MONTH_QUERY = """
+    SELECT month, tag, number_of_problems, success_trials, unsuccess_trials
+    FROM topic_month_rollup
+    WHERE {conditions}
+    ORDER BY month, tag
+    """
+
+RATING_BANDS_BY_MONTH_QUERY = """
+    SELECT month, band, min_rating, number_of_users
+    FROM rating_band_month_rollup
+    WHERE {conditions}
+    ORDER BY month, min_rating
+    """
+
+RATING_TRAJECTORY_QUERY = """
+    SELECT month, rating, rating_change, number_of_contests
+    FROM user_rating_month
+    WHERE user_handle = :handle
+    ORDER BY month
+    """
+
+
+def trend_filters(month_from=None, month_to=None, tags=None):
+    """
+    Normalize the optional trend query parameters into keyword arguments of the cached
+    trend datasets, leaving out absent ones so that requests without parameters share
+    the entry loaded by warm_up(). Months that do not exist, e.g. '2024-13', abort
+    with 400 (the pattern of swagger.yml only checks the digits).
+
+    Returns:
+        dict: Given parameters, with tags sorted and deduplicated
+    """
+    for name, month in (("month_from", month_from), ("month_to", month_to)):
+        if month is not None:
+            try:
+                datetime.strptime(month, "%Y-%m")
+            except ValueError:
+                abort(400, f"{name} must be a month as YYYY-MM, got {month!r}")
+    filters = {"month_from": month_from, "month_to": month_to, "tags": tuple(sorted(set(tags))) if tags else None}
+    return {name: value for name, value in filters.items() if value is not None}
+
+
+def trend_conditions(month_from=None, month_to=None, tags=None):
+    """
+    Build the WHERE condition of a monthly rollup query.
+
+    Returns:
+        tuple: (SQL condition, query parameters)
+    """
+    conditions, params = ["TRUE"], {}
+    if month_from is not None:
+        conditions.append("month >= :month_from")
+        params["month_from"] = month_from
+    if month_to is not None:
+        conditions.append("month <= :month_to")
+        params["month_to"] = month_to
+    if tags:
+        names = [f"tag_{position}" for position in range(len(tags))]
+        conditions.append(f"tag IN ({', '.join(':' + name for name in names)})")
+        params.update(zip(names, tags))
+    return " AND ".join(conditions), params
+
+
+@negotiated
+def get_topics_by_month(**filters):
+    """
+    Track how often every tag appears and how solvable its problems are, month by month.
+
+    Args:
+        **filters: Optional month_from, month_to ('YYYY-MM') and tags
+
+    Returns:
+        list[dict]: Dictionary entries with:
+            - month (str): Month the contests started, e.g. '2024-03'
+            - topic (str): Problem tag name
+            - number_of_tasks (int): Count of the month's problems with this tag
+            - solvability (float): Ratio of successful submissions to total attempts
+    """
+    return _topics_by_month(**trend_filters(**filters))
+
+
+@timed_cache(seconds=cache_ttl_seconds, tables=("topic_month_rollup",))
+def _topics_by_month(month_from=None, month_to=None, tags=None):
+    conditions, params = trend_conditions(month_from, month_to, tags)
+    rows = queries.read(TOPICS_BY_MONTH_QUERY.format(conditions=conditions), params)
+
+    success = np.array([row[3] for row in rows], dtype=np.int64)
+    total = success + np.array([row[4] for row in rows], dtype=np.int64)
+    return Payload(Table(
+        month=np.array([row[0] for row in rows], dtype=object),
+        topic=np.array([row[1] for row in rows], dtype=object),
+        number_of_tasks=np.array([row[2] for row in rows], dtype=np.int64),
+        solvability=np.divide(success, total, out=np.zeros(len(total)), where=total > 0),
+    ))
+
+
+@negotiated
+def get_rating_bands_by_month(**filters):
+    """
+    Count the active users of every rating band, month by month. A user counts once
+    per month with a rated contest, in the band of their rating at the end of it.
+
+    Args:
+        **filters: Optional month_from and month_to ('YYYY-MM')
+
+    Returns:
+        list[dict]: Dictionary entries with:
+            - month (str): Month, e.g. '2024-03'
+            - band (str): Codeforces rank of the band, e.g. 'expert'
+            - min_rating (int): Lowest rating of the band
+            - number_of_users (int): Count of the band's active users
+    """
+    return _rating_bands_by_month(**trend_filters(**filters))
+
+
+@timed_cache(seconds=cache_ttl_seconds, tables=("rating_band_month_rollup",))
+def _rating_bands_by_month(month_from=None, month_to=None):
+    conditions, params = trend_conditions(month_from, month_to)
+    rows = queries.read(RATING_BANDS_BY_MONTH_QUERY.format(conditions=conditions), params)
+
+    return Payload(Table(
+        month=np.array([row[0] for row in rows], dtype=object),
+        band=np.array([row[1] for row in rows], dtype=object),
+        min_rating=np.array([row[2] for row in rows], dtype=np.int64),
+        number_of_users=np.array([row[3] for row in rows], dtype=np.int64),
+    ))
+
+
+# Trajectories keyed by handle, refreshed on changes of user_rating_month (notified, or
+# bumped in cache_versions by ingest.py) and at the latest within the hour
+rating_trajectory_cache = cached(ttl=3600, maxsize=4096, context=app.app_context, shared=shared)
+
+
+@negotiated
+def get_rating_trajectory(handle):
+    """
+    Follow the rating of one user month by month.
+
+    Args:
+        handle (str): User handle
+
+    Returns:
+        dict: Contains:
+            - handle (str): User handle
+            - data (list[dict]): One entry per month with a rated contest, with:
+                - month (str): Month, e.g. '2024-03'
+                - rating (int): Rating after the user's last contest of the month
+                - rating_change (int): Sum of the month's rating changes
+                - number_of_contests (int): Count of the month's contests
+    """
+    payload = _rating_trajectory(handle)
+    if payload is None:
+        abort(404, f"User {handle} has no rated contest")
+    return payload
+
+
+@depends_on(("user_rating_month",))
+@rating_trajectory_cache
+def _rating_trajectory(handle):
+    rows = queries.read(RATING_TRAJECTORY_QUERY, {"handle": handle})
+    if not rows:
+        # Cached like any other answer, so unknown handles do not query again
+        return None
+
+    return Payload({"handle": handle, "data": Table(
+        month=np.array([row[0] for row in rows], dtype=object),
+        rating=np.array([row[1] for row in rows], dtype=np.int64),
+        rating_change=np.array([row[2] for row in rows], dtype=np.int64),
+        number_of_contests=np.array([row[3] for row in rows], dtype=np.int64),
+    )})
+
+
+cached_datasets[_rating_trajectory.__name__] = _rating_trajectory
+keyed_datasets.add(_rating_trajectory.__name__)
+
+
+# Datasets of /batch by API path, answered with their default parameters
+BATCH_DATASETS = {
+    "topics": get_topics,
+    "topics_distribution_by_rating": get_topics_distribution_by_rating,
+    "topics_correlation": get_topics_correlation,
+    "topics_solvability": get_topics_solvability,
+    "users_rating_distribution_by_experience": get_rating_distribution_by_experience,
+    "users_rating_distribution_by_solutions_amount": get_rating_distribution_by_solutions_amount,
+    "users_rating_distribution_by_solutions_rating": get_rating_distribution_by_solutions_rating,
+    "users_rating_distribution_by_solutions_solvability": get_rating_distribution_by_solutions_solvability,
+    "blogs_topics_data": get_blog_topics_data,
+    "topics_by_month": get_topics_by_month,
+    "users_rating_bands_by_month": get_rating_bands_by_month,
+}
+
+# Threads filling batch datasets; separate from the query pool, whose workers the fills use
+batch_pool = ThreadPoolExecutor(max_workers=batch_workers, thread_name_prefix="batch")
+
+
+def batch_line(dataset):
+    """
+    Compute one dataset of a batch (or take it from the caches) and encode it as a
+    line of the response. Runs in batch_pool.
+
+    Args:
+        dataset (str): Key of BATCH_DATASETS
+
+    Returns:
+        bytes: JSON line {"dataset", "data"}, or {"dataset", "error"} if it failed
+    """
+    try:
+        with app.app_context(), metrics.scoped(dataset):
+            # The payload function under the negotiated endpoint, and its cached JSON encoding
+            body = BATCH_DATASETS[dataset].__wrapped__().encode(JSON).body
+    except HTTPException as error:
+        return json.dumps({"dataset": dataset, "error": error.description}).encode() + b"\n"
+    except Exception:
+        logger.exception("Batch dataset %s failed", dataset)
+        return json.dumps({"dataset": dataset, "error": "Internal Server Error"}).encode() + b"\n"
+    return b'{"dataset": ' + json.dumps(dataset).encode() + b', "data": ' + body + b"}\n"
+
+
+def get_batch(datasets):
+    """
+    Answer several endpoints in one response. The datasets are filled concurrently,
+    those missing from the caches each by one worker, and streamed back as
+    newline-delimited JSON in the order they complete, so the response takes about
+    as long as its slowest dataset.
+
+    Args:
+        datasets (list[str]): Paths of the endpoints (keys of BATCH_DATASETS), answered
+            with their default parameters
+
+    Returns:
+        Response: application/x-ndjson stream with one line per dataset:
+            - dataset (str): Requested dataset
+            - data: Its response, as in the JSON format of its endpoint
+            - error (str): Instead of data, if the dataset could not be computed
+    """
+    futures = [batch_pool.submit(batch_line, dataset) for dataset in dict.fromkeys(datasets)]
+    return streamed(future.result() for future in as_completed(futures))
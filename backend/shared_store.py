@@ -0,0 +1,270 @@
+"""
+Cross-Process Cache Store
+
+Lets the worker processes of one host share cached values instead of each computing
+and holding its own copy. A value is written once to a file of a memory-backed
+directory (e.g. /dev/shm) with pickle protocol 5, its NumPy arrays stored out of
+band as raw, aligned buffers after the pickle stream. Readers map the file and
+unpickle with the arrays pointing into the mapping, so every worker reads the same
+physical pages without copying them; arrays loaded this way are read-only.
+
+File layout: a header (magic, computation time, pickle length, number of buffers),
+the offset and length of every buffer, the pickle stream, then the buffers, each
+aligned to 64 bytes. Files are written under a temporary name and renamed, so readers
+see either the old or the new value, and workers holding the old mapping keep it
+valid until they drop it.
+
+Computations are serialized across processes with fcntl locks, so for every key
+one worker computes while the others wait and then map its result.
+
+Files are named after their key: keys holding a frame are prefixed with its cache
+token, so the keys of a replaced frame are deleted together (retire), and bytes
+derived from a value (e.g. its encodings, see formats.Payload.share) are named after
+the value's key, so replacing the value deletes them. Temporary files left behind by
+a worker killed while writing are deleted once they are old.
+
+The directory must only be writable by the user running the API: loading a file
+unpickles it.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import pathlib
+import pickle
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CFSHM001"
+# magic, computed_at (Unix time), pickle length, number of buffers
+HEADER = struct.Struct("<8sdQQ")
+# offset and length of a buffer
+BUFFER = struct.Struct("<QQ")
+ALIGNMENT = 64
+
+# Locks are shared by the keys of a cache whose digests fall in the same stripe,
+# which bounds the number of lock files
+LOCK_STRIPES = 64
+
+# Seconds after which a temporary file is known to belong to a dead writer
+TEMPORARY_MAX_AGE = 600
+
+
+def digest(key):
+    """
+    Stable name of a cache key across processes. Objects carrying a cache_token
+    attribute (e.g. the frames) are identified by it, everything else by its repr.
+
+    Args:
+        key (tuple): Cache key
+
+    Returns:
+        str: Hex digest of the key, prefixed with the cache tokens it holds
+    """
+    tokens = []
+
+    def describe(value):
+        if isinstance(value, tuple):
+            return "(" + ",".join(describe(item) for item in value) + ")"
+        token = getattr(value, "cache_token", None)
+        if token is None:
+            return repr(value)
+        tokens.append(token)
+        return f"<{token}>"
+
+    key_digest = hashlib.blake2b(describe(key).encode(), digest_size=16).hexdigest()
+    return "-".join(tokens + [key_digest])
+
+
+def derived_digest(key_digest, suffix):
+    """
+    Name of bytes derived from the value of a key, e.g. one of its encodings.
+
+    Args:
+        key_digest (str): Digest of the key of the value
+        suffix (str): Description of the derived bytes
+
+    Returns:
+        str: Digest deleted together with the value's
+    """
+    return f"{key_digest}-{hashlib.blake2b(suffix.encode(), digest_size=8).hexdigest()}"
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class SharedStore:
+    """
+    Directory of cached values shared by processes.
+
+    Args:
+        directory (str | pathlib.Path): Directory holding the files, ideally on a
+            memory-backed file system such as /dev/shm; created if missing
+    """
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+    def _path(self, name, key_digest):
+        return self.directory / name / f"{key_digest}.bin"
+
+    @contextlib.contextmanager
+    def lock(self, name, key_digest):
+        """
+        Hold the cross-process lock of a key while the with block runs.
+
+        Args:
+            name (str): Name of the cache
+            key_digest (str): Digest of the key
+        """
+        folder = self.directory / name
+        folder.mkdir(mode=0o700, exist_ok=True)
+        stripe = int(key_digest[-8:], 16) % LOCK_STRIPES
+        with open(folder / f"{stripe}.lock", "a") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def get(self, name, key_digest):
+        """
+        Map a stored value.
+
+        Args:
+            name (str): Name of the cache
+            key_digest (str): Digest of the key
+
+        Returns:
+            tuple: (value, Unix time it was computed), or None if it is not stored
+        """
+        try:
+            with open(self._path(name, key_digest), "rb") as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: an empty file cannot be mapped
+            return None
+
+        view = memoryview(mapped)
+        magic, computed_at, pickle_length, count = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            return None
+        buffers = []
+        for position in range(count):
+            offset, length = BUFFER.unpack_from(view, HEADER.size + position * BUFFER.size)
+            buffers.append(view[offset:offset + length])
+        start = HEADER.size + count * BUFFER.size
+        # The arrays keep the views, hence the mapping, alive
+        return pickle.loads(view[start:start + pickle_length], buffers=buffers), computed_at
+
+    def put(self, name, key_digest, value, max_age, computed_at=None):
+        """
+        Store a value, replacing the previous value of the key together with the bytes
+        derived from it, and delete the files of the cache older than max_age.
+
+        Args:
+            name (str): Name of the cache
+            key_digest (str): Digest of the key
+            value: Picklable value
+            max_age (float): Seconds after which the files of the cache are useless
+            computed_at (float): Unix time the computation of the value started, or None
+                for now
+
+        Returns:
+            bool: Whether the value was stored (False e.g. when the directory is full)
+        """
+        buffers = []
+        data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+        raws = [buffer.raw() for buffer in buffers]
+
+        offsets = []
+        position = _aligned(HEADER.size + len(raws) * BUFFER.size + len(data))
+        for raw in raws:
+            offsets.append(position)
+            position = _aligned(position + raw.nbytes)
+
+        path = self._path(name, key_digest)
+        temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(mode=0o700, exist_ok=True)
+            with open(temporary, "wb") as file:
+                file.write(HEADER.pack(MAGIC, time.time() if computed_at is None else computed_at,
+                                       len(data), len(raws)))
+                for offset, raw in zip(offsets, raws):
+                    file.write(BUFFER.pack(offset, raw.nbytes))
+                file.write(data)
+                for offset, raw in zip(offsets, raws):
+                    file.seek(offset)
+                    file.write(raw)
+            os.replace(temporary, path)
+        except OSError as error:
+            logger.warning("Could not store %s/%s in the shared cache: %r", name, key_digest, error)
+            temporary.unlink(missing_ok=True)
+            return False
+
+        self._delete(path.parent.glob(f"{key_digest}-*.bin"))
+        self._prune(path.parent, max_age)
+        return True
+
+    def derive(self, name, key_digest, suffix, make, max_age):
+        """
+        Bytes derived from the stored value of a key, made by one process and mapped
+        by all of them.
+
+        Args:
+            name (str): Name of the cache
+            key_digest (str): Digest of the key of the value
+            suffix (str): Description of the derived bytes, unique for the value
+            make (callable): Function returning the bytes
+            max_age (float): Seconds after which the files of the cache are useless
+
+        Returns:
+            bytes | memoryview: The bytes, mapped unless they could not be stored
+        """
+        derived = derived_digest(key_digest, suffix)
+        with self.lock(name, derived):
+            found = self.get(name, derived)
+            if found is None:
+                body = make()
+                # A PickleBuffer is stored out of band, so it unpickles to a view of the mapping
+                if not self.put(name, derived, pickle.PickleBuffer(body), max_age):
+                    return body
+                found = self.get(name, derived)
+        return found[0] if found is not None else body
+
+    def retire(self, token):
+        """
+        Delete the values of every cache whose key holds a replaced frame.
+
+        Args:
+            token (str): Cache token of the frame
+        """
+        self._delete(self.directory.glob(f"*/*{token}-*.bin"))
+
+    @staticmethod
+    def _delete(paths):
+        # Workers mapping a deleted file keep their mapping valid
+        for path in paths:
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+
+    @classmethod
+    def _prune(cls, folder, max_age):
+        """
+        Delete value files not replaced for max_age seconds (e.g. keys of old frames
+        still used by a worker after their retirement), and temporary files of
+        writers that died
+        """
+        now = time.time()
+        for pattern, oldest in (("*.bin", now - max_age), ("*.tmp", now - TEMPORARY_MAX_AGE)):
+            for path in folder.glob(pattern):
+                with contextlib.suppress(FileNotFoundError):
+                    if path.stat().st_mtime < oldest:
+                        path.unlink()
@@ -0,0 +1,223 @@
+"""
+Static API Snapshots
+
+Every endpoint of the API is read-only and changes at most once a day, so its
+responses can be built ahead of time and served without a database:
+    - build evaluates every routes.py endpoint of swagger.yml (with its default
+      parameters) in every response format, and writes the bodies, precompressed with
+      brotli and gzip at their highest levels, to a new version folder mirroring the
+      /api paths, e.g. versions/20250101T000000Z/api/topics.json(.br, .gz). The
+      `current` link then switches to it atomically and old versions are deleted.
+    - serve answers /api/... from the current version (short-lived caching, so new
+      snapshots are picked up) and /v/<version>/api/... from a given version (cached
+      forever, since it never changes), with the same ETags and content negotiation
+      as the live API. It never connects to Postgres, so the dashboard stays up during
+      database maintenance.
+Requests with query parameters are not part of a snapshot and get 404.
+
+Usage (from the backend folder):
+    python snapshot.py build --dir snapshots             # needs the database
+    python snapshot.py serve --dir snapshots             # development server, no database
+    SNAPSHOT_DIR=snapshots gunicorn -c gunicorn.conf.py "snapshot:create_snapshot_app()"
+"""
+
+from email.utils import formatdate
+import argparse
+import functools
+import gzip
+import json
+import os
+import pathlib
+import re
+import shutil
+import time
+
+import brotli
+import connexion
+from flask import Response, abort, jsonify, request
+from flask_cors import CORS
+import yaml
+
+# Content coding -> (file suffix, function compressing bytes), in order of preference.
+# Snapshots are compressed once, offline, so the highest levels are worth it.
+CODINGS = {
+    "br": (".br", lambda body: brotli.compress(body, quality=11)),
+    "gzip": (".gz", lambda body: gzip.compress(body, compresslevel=9, mtime=0)),
+}
+
+# Bodies smaller than this are stored uncompressed only
+MIN_COMPRESSED_SIZE = 1024
+
+# Seconds clients may cache a response of /api/..., which changes with the next snapshot
+MAX_AGE = int(os.getenv("SNAPSHOT_MAX_AGE", "300"))
+# Cache-Control of /v/<version>/api/..., whose responses never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def snapshot_routes(specification):
+    """
+    Args:
+        specification (pathlib.Path): swagger.yml
+
+    Returns:
+        list[tuple]: (API path, operationId) of every GET route without path
+            parameters, whose values could not all be enumerated, nor required query
+            parameters (e.g. /batch)
+    """
+    spec = yaml.safe_load(specification.read_text())
+    return [(path, methods["get"]["operationId"]) for path, methods in spec["paths"].items()
+            if "get" in methods and "{" not in path
+            and not any(parameter.get("required") for parameter in methods["get"].get("parameters", []))]
+
+
+def build(directory, keep=3):
+    """
+    Evaluate every endpoint and publish the responses as a new snapshot version.
+    Must run inside an application context.
+
+    Args:
+        directory (pathlib.Path): Snapshot folder
+        keep (int): Number of versions kept, the new one included
+
+    Returns:
+        str: The new version
+    """
+    from config import app, basedir
+    from formats import COLUMNS_JSON, JSON, MSGPACK
+    import routes
+
+    extensions = {JSON: ".json", COLUMNS_JSON: ".columns.json", MSGPACK: ".msgpack"}
+    version = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    versions = directory / "versions"
+    staging = versions / f".{version}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    manifest = {"version": version, "created_at": time.time(), "routes": {}}
+    for path, operation in snapshot_routes(basedir / "swagger.yml"):
+        function = getattr(routes, operation.split(".", 1)[1])
+        variants = manifest["routes"][path] = {}
+        # JSON first: it is the default when the Accept header matches nothing
+        for media_type, extension in extensions.items():
+            with app.test_request_context(
+                    f"/api{path}", headers={"Accept": media_type, "Accept-Encoding": "identity"}):
+                response = function()
+            body = response.get_data()
+            name = f"api{path}{extension}"
+            target = staging / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(body)
+            codings = []
+            if len(body) >= MIN_COMPRESSED_SIZE:
+                for coding, (suffix, compress) in CODINGS.items():
+                    (staging / f"{name}{suffix}").write_bytes(compress(body))
+                    codings.append(coding)
+            etag, _ = response.get_etag()
+            variants[media_type] = {"file": name, "etag": etag, "codings": codings}
+        print(f"{path}: {len(variants)} formats")
+
+    (staging / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    staging.rename(versions / version)
+
+    # Switch the current version atomically
+    link = directory / "current"
+    temporary = directory / "current.tmp"
+    temporary.unlink(missing_ok=True)
+    temporary.symlink_to(pathlib.Path("versions") / version)
+    os.replace(temporary, link)
+
+    for old in sorted(path.name for path in versions.iterdir() if not path.name.startswith("."))[:-keep]:
+        shutil.rmtree(versions / old)
+    return version
+
+
+def create_snapshot_app(directory=None):
+    """
+    Build the application serving snapshots, without any database access.
+
+    Args:
+        directory (str): Snapshot folder (defaults to the SNAPSHOT_DIR environment variable)
+
+    Returns:
+        connexion.App: ASGI application serving the snapshots
+    """
+    directory = pathlib.Path(directory or os.environ["SNAPSHOT_DIR"]).resolve()
+    versions = directory / "versions"
+
+    @functools.lru_cache(maxsize=16)
+    def manifest(version):
+        return json.loads((versions / version / "manifest.json").read_text())
+
+    @functools.lru_cache(maxsize=512)
+    def read(version, name):
+        # Versions never change, so their files can be kept in memory
+        return (versions / version / name).read_bytes()
+
+    def respond(version, path, cache_control):
+        if request.args:
+            abort(404, "Snapshots only hold the responses to the default parameters")
+        try:
+            variants = manifest(version)["routes"][f"/{path}"]
+        except (FileNotFoundError, KeyError):
+            abort(404)
+
+        media_type = request.accept_mimetypes.best_match(list(variants), default=next(iter(variants)))
+        variant = variants[media_type]
+        # Weak ETags, like the live API, shared by the compressed variants
+        headers = {
+            "ETag": f'W/"{variant["etag"]}"',
+            "Last-Modified": formatdate(manifest(version)["created_at"], usegmt=True),
+            "Cache-Control": cache_control,
+            "Vary": "Accept, Accept-Encoding",
+            "X-Snapshot-Version": version,
+        }
+        if request.if_none_match and request.if_none_match.contains_weak(variant["etag"]):
+            return Response(status=304, headers=headers)
+
+        name = variant["file"]
+        coding = request.accept_encodings.best_match(variant["codings"])
+        if coding is not None:
+            name += CODINGS[coding][0]
+            headers["Content-Encoding"] = coding
+        return Response(read(version, name), mimetype=media_type, headers=headers)
+
+    def current(path):
+        try:
+            version = pathlib.Path(os.readlink(directory / "current")).name
+        except FileNotFoundError:
+            abort(503, "No snapshot has been built yet")
+        return respond(version, path, f"public, max-age={MAX_AGE}")
+
+    def pinned(version, path):
+        if not re.fullmatch(r"\d{8}T\d{6}Z", version):
+            abort(404)
+        return respond(version, path, IMMUTABLE)
+
+    def home():
+        return jsonify({"message": "Hello from Flask!"})
+
+    snapshot_app = connexion.App(__name__)
+    CORS(snapshot_app.app, resources={r"/api/*": {"origins": ["*"]}, r"/v/*": {"origins": ["*"]}})
+    snapshot_app.app.add_url_rule("/api/<path:path>", view_func=current)
+    snapshot_app.app.add_url_rule("/v/<version>/api/<path:path>", view_func=pinned)
+    snapshot_app.app.add_url_rule("/", view_func=home)
+    return snapshot_app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or serve static snapshots of the API")
+    parser.add_argument("command", choices=["build", "serve"])
+    parser.add_argument("--dir", type=pathlib.Path, default=pathlib.Path("snapshots"), help="Snapshot folder")
+    parser.add_argument("--keep", type=int, default=3, help="Number of versions kept by build")
+    parser.add_argument("--port", type=int, default=8000, help="Port of the development server")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from config import app
+
+        with app.app_context():
+            started = time.time()
+            built = build(args.dir, args.keep)
+        print(f"Snapshot {built} built in {time.time() - started:.1f}s")
+    else:
+        create_snapshot_app(args.dir).run(host="0.0.0.0", port=args.port)
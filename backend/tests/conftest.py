@@ -0,0 +1,18 @@
+"""
+Shared test setup. The tests need no database: config.py only builds the connection
+URLs at import, so placeholder settings let the backend modules be imported.
+
+Usage (from the backend folder):
+    python -m pytest tests
+"""
+
+import os
+import pathlib
+import sys
+
+for name, value in {"DB_USER": "test", "DB_PASSWORD": "test", "DB_HOST": "localhost",
+                    "DB_PORT": "5432", "DB_NAME": "test", "WARM_UP_CACHES": "0",
+                    "LISTEN_TABLE_CHANGES": "0"}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
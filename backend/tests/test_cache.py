@@ -0,0 +1,241 @@
+"""Tests of the TimedCache behaviours, with short ttls instead of a fake clock"""
+
+import gc
+import threading
+import time
+import uuid
+import weakref
+
+import pytest
+
+from cache import MAX_STALE_TTL, cached
+
+
+def wait_until(condition, timeout=2.0):
+    """Poll a condition, since refreshes run in the background pool"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+class Counter:
+    """Function counting its calls, optionally blocked until released"""
+
+    def __init__(self, block=False):
+        self.__name__ = "counter"
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+
+    def __call__(self, key):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        self.release.wait(5)
+        return key, call
+
+
+def test_concurrent_callers_of_a_cold_key_compute_once():
+    function = Counter(block=True)
+    cache = cached(ttl=60)(function)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache("key"))) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: function.calls == 1)
+    time.sleep(0.05)
+    function.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert function.calls == 1
+    assert results == [("key", 1)] * 16
+
+
+def test_stale_value_is_served_while_one_refresh_runs():
+    function = Counter()
+    cache = cached(ttl=0.05, refresh_ahead=0.0, stale_ttl=60)(function)
+    assert cache("key") == ("key", 1)
+    time.sleep(0.06)
+
+    function.release.clear()
+    # Every caller gets the expired value at once, and only one refresh starts
+    assert [cache("key") for _ in range(10)] == [("key", 1)] * 10
+    wait_until(lambda: function.calls == 2)
+    time.sleep(0.05)
+    assert function.calls == 2
+    function.release.set()
+    wait_until(lambda: cache("key") == ("key", 2))
+
+
+def test_value_past_its_stale_window_is_recomputed():
+    function = Counter()
+    cache = cached(ttl=0.02, refresh_ahead=0.0, stale_ttl=0.02)(function)
+    cache("key")
+    time.sleep(0.05)
+    assert cache("key") == ("key", 2)
+
+
+def test_default_stale_window_is_the_ttl_at_most_max_stale_ttl():
+    assert cached(ttl=60)(Counter()).stale_ttl == 60
+    assert cached(ttl=3600 * 24 * 7)(Counter()).stale_ttl == MAX_STALE_TTL
+    assert cached(ttl=3600 * 24 * 7, stale_ttl=10)(Counter()).stale_ttl == 10
+
+
+def test_refresh_ahead_replaces_a_value_before_it_expires():
+    function = Counter()
+    cache = cached(ttl=0.5, refresh_ahead=0.8)(function)
+    assert cache("key") == ("key", 1)
+    time.sleep(0.15)
+
+    # Past the refresh point but fresh: served as is and refreshed in the background
+    assert cache("key") == ("key", 1)
+    wait_until(lambda: function.calls == 2)
+    wait_until(lambda: cache("key") == ("key", 2))
+
+
+def test_least_recently_used_keys_are_evicted_over_maxsize():
+    cache = cached(ttl=60, maxsize=2)(Counter())
+    cache("a")
+    cache("b")
+    cache("a")
+    cache("c")
+
+    assert len(cache) == 2
+    assert cache.peek("b") is None
+    assert cache.peek("a") == ("a", 1)
+    assert cache.peek("c") == ("c", 3)
+
+
+def test_keys_are_evicted_over_maxweight():
+    cache = cached(ttl=60, maxweight=10, weigher=len)(lambda size: "x" * size)
+    cache(4)
+    cache(5)
+    assert len(cache) == 2
+    cache(3)
+
+    assert cache.peek(4) is None
+    assert cache.peek(5) == "x" * 5
+    assert cache.peek(3) == "x" * 3
+
+
+def test_newest_value_is_kept_even_above_maxweight():
+    cache = cached(ttl=60, maxweight=10, weigher=len)(lambda size: "x" * size)
+    cache(4)
+    cache(20)
+    assert len(cache) == 1
+    assert cache.peek(20) == "x" * 20
+
+
+def test_mark_stale_refreshes_in_the_background():
+    function = Counter()
+    cache = cached(ttl=60)(function)
+    cache("key")
+    cache.mark_stale()
+
+    # The old value is served once more while the refresh runs
+    assert cache("key") == ("key", 1)
+    wait_until(lambda: cache("key") == ("key", 2))
+    assert function.calls == 2
+
+
+def test_mark_stale_during_a_computation_refreshes_its_value():
+    function = Counter(block=True)
+    cache = cached(ttl=60)(function)
+    thread = threading.Thread(target=cache, args=("key",))
+    thread.start()
+    wait_until(lambda: function.calls == 1)
+    # The change arrives while the computation may still read the old data
+    cache.mark_stale()
+    function.release.set()
+    thread.join()
+
+    assert cache("key") == ("key", 1)
+    wait_until(lambda: cache("key") == ("key", 2))
+    assert function.calls == 2
+
+
+class Frame:
+    """Object identified in cache keys by its cache token, like the frames"""
+
+    def __init__(self):
+        self.cache_token = uuid.uuid4().hex
+
+
+def test_keys_do_not_keep_their_frames_alive():
+    cache = cached(ttl=60)(lambda frame, filters: filters)
+    frame = Frame()
+    assert cache(frame, "a") == "a"
+    # Another object with the same token shares the entry
+    same = Frame()
+    same.cache_token = frame.cache_token
+    assert cache.peek(same, "a") == "a"
+
+    reference = weakref.ref(frame)
+    del frame, same
+    gc.collect()
+    assert reference() is None
+    assert len(cache) == 1
+
+
+def test_values_computed_from_a_replaced_frame_are_dropped():
+    frames = cached(ttl=60)(lambda: Frame())
+    results = cached(ttl=60)(lambda frame, filters: filters)
+    first = frames()
+    results(first, "a")
+    results(first, filters="b")
+
+    frames.mark_stale()
+    frames()
+    wait_until(lambda: frames() is not first)
+    assert len(results) == 0
+    results(frames(), "a")
+    assert len(results) == 1
+
+
+def test_raising_function_is_retried_and_not_cached():
+    calls = []
+
+    def flaky(key):
+        calls.append(key)
+        if len(calls) == 1:
+            raise RuntimeError("database unavailable")
+        return key
+
+    cache = cached(ttl=60)(flaky)
+    with pytest.raises(RuntimeError):
+        cache("key")
+    assert len(cache) == 0
+    assert cache("key") == "key"
+    assert cache("key") == "key"
+    assert len(calls) == 2
+
+
+def test_waiters_of_a_failed_computation_get_its_error():
+    release = threading.Event()
+
+    def failing(key):
+        release.wait(5)
+        raise ValueError(key)
+
+    cache = cached(ttl=60)(failing)
+    errors = []
+
+    def call():
+        try:
+            cache("key")
+        except ValueError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 4
+    assert len(cache) == 0
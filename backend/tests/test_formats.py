@@ -0,0 +1,152 @@
+"""Tests of content negotiation, compression and conditional requests on a dummy endpoint"""
+
+from email.utils import formatdate
+import gzip
+import json
+
+import brotli
+from flask import Flask
+import msgpack
+import numpy as np
+import pytest
+
+import formats
+from formats import COLUMNS_JSON, JSON, MIN_COMPRESSED_SIZE, MSGPACK, Payload, Table, negotiated
+from shared_store import SharedStore
+
+ROWS = 200
+LARGE = Payload({"data": Table(id=np.arange(ROWS), score=np.linspace(0.0, 1.0, ROWS)), "total": ROWS})
+SMALL = Payload(["a", "b"])
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.add_url_rule("/large", "large", negotiated(lambda: LARGE))
+    app.add_url_rule("/small", "small", negotiated(lambda: SMALL))
+    return app.test_client()
+
+
+def test_json_is_the_default(client):
+    for accept in (None, "*/*", "text/html"):
+        response = client.get("/large", headers={"Accept": accept} if accept else {})
+        assert response.mimetype == JSON
+        assert response.json["total"] == ROWS
+        assert response.json["data"][1] == {"id": 1, "score": pytest.approx(1 / (ROWS - 1))}
+        assert response.headers["Vary"] == "Accept, Accept-Encoding"
+        assert response.headers["Cache-Control"] == "no-cache"
+
+
+def test_columnar_json(client):
+    response = client.get("/large", headers={"Accept": COLUMNS_JSON})
+    assert response.mimetype == COLUMNS_JSON
+    data = json.loads(response.data)["data"]
+    assert data["id"] == list(range(ROWS))
+    assert len(data["score"]) == ROWS
+
+
+def test_msgpack_keeps_arrays_binary(client):
+    response = client.get("/large", headers={"Accept": f"{JSON};q=0.5, {MSGPACK}"})
+    assert response.mimetype == MSGPACK
+    data = msgpack.unpackb(response.data)["data"]
+    assert data["id"]["dtype"] == "int64" and data["id"]["shape"] == [ROWS]
+    assert np.frombuffer(data["id"]["data"], dtype="<i8").tolist() == list(range(ROWS))
+    assert np.frombuffer(data["score"]["data"], dtype="<f8")[-1] == 1.0
+
+
+@pytest.mark.parametrize("accept_encoding, coding", [
+    ("br, gzip", "br"),
+    ("gzip, deflate", "gzip"),
+    ("gzip;q=1.0, br;q=0.5", "gzip"),
+    ("identity", None),
+    (None, None),
+])
+def test_compression_follows_accept_encoding(client, accept_encoding, coding):
+    identity = client.get("/large").data
+    assert len(identity) >= MIN_COMPRESSED_SIZE
+    response = client.get("/large", headers={"Accept-Encoding": accept_encoding} if accept_encoding else {})
+
+    assert response.headers.get("Content-Encoding") == coding
+    decompress = {"br": brotli.decompress, "gzip": gzip.decompress, None: bytes}[coding]
+    assert decompress(response.data) == identity
+
+
+def test_small_bodies_are_not_compressed(client):
+    response = client.get("/small", headers={"Accept-Encoding": "br, gzip"})
+    assert len(response.data) < MIN_COMPRESSED_SIZE
+    assert "Content-Encoding" not in response.headers
+    assert response.json == ["a", "b"]
+
+
+def test_compressed_variants_share_a_weak_etag(client):
+    etags = {client.get("/large", headers={"Accept-Encoding": coding}).headers["ETag"]
+             for coding in ("br", "gzip", "identity")}
+    assert len(etags) == 1
+    assert etags.pop().startswith('W/"')
+    # Another format is another representation
+    assert client.get("/large", headers={"Accept": MSGPACK}).headers["ETag"] != client.get("/large").headers["ETag"]
+
+
+def test_if_none_match(client):
+    etag = client.get("/large").headers["ETag"]
+    response = client.get("/large", headers={"If-None-Match": etag, "Accept-Encoding": "br"})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+
+    # Weak comparison also matches the strong form and lists of tags
+    strong = etag.removeprefix("W/")
+    assert client.get("/large", headers={"If-None-Match": f'"other", {strong}'}).status_code == 304
+    assert client.get("/large", headers={"If-None-Match": '"other"'}).status_code == 200
+    assert client.get("/large", headers={"If-None-Match": "*"}).status_code == 304
+
+
+def test_if_modified_since(client):
+    last_modified = client.get("/large").headers["Last-Modified"]
+    assert last_modified == formatdate(LARGE.last_modified, usegmt=True)
+
+    assert client.get("/large", headers={"If-Modified-Since": last_modified}).status_code == 304
+    later = formatdate(LARGE.last_modified + 60, usegmt=True)
+    assert client.get("/large", headers={"If-Modified-Since": later}).status_code == 304
+    earlier = formatdate(LARGE.last_modified - 60, usegmt=True)
+    assert client.get("/large", headers={"If-Modified-Since": earlier}).status_code == 200
+
+
+def test_if_none_match_takes_precedence(client):
+    last_modified = client.get("/large").headers["Last-Modified"]
+    response = client.get("/large", headers={"If-None-Match": '"other"', "If-Modified-Since": last_modified})
+    assert response.status_code == 200
+
+
+def test_payload_encodes_and_compresses_once():
+    payload = Payload([1, 2, 3] * 1000)
+    encoding = payload.encode(JSON)
+    assert payload.encode(JSON) is encoding
+    assert encoding.compressed("br") is encoding.compressed("br")
+    assert json.loads(encoding.body) == [1, 2, 3] * 1000
+
+
+def test_shared_payloads_map_the_same_encodings(tmp_path, monkeypatch):
+    encoded = []
+    encode = formats.ENCODERS[JSON]
+    monkeypatch.setitem(formats.ENCODERS, JSON, lambda value: encoded.append(value) or encode(value))
+    store = SharedStore(tmp_path)
+    assert store.put("cache", "key", Payload([1, 2, 3] * 1000), max_age=60)
+
+    first, second = store.get("cache", "key")[0], store.get("cache", "key")[0]
+    for payload in (first, second):
+        payload.share(store, "cache", "key", 60)
+    encoding = first.encode(JSON)
+    assert isinstance(encoding.body, memoryview)
+    assert json.loads(bytes(encoding.body)) == [1, 2, 3] * 1000
+
+    # The other payload maps the stored encodings instead of encoding again
+    other = second.encode(JSON)
+    assert len(encoded) == 1
+    assert other.etag == encoding.etag
+    assert bytes(other.compressed("gzip")) == bytes(encoding.compressed("gzip"))
+    assert len(list(tmp_path.glob("cache/key-*.bin"))) == 2
+
+    # Replacing the payload deletes its encodings
+    store.put("cache", "key", Payload([]), max_age=60)
+    assert list(tmp_path.glob("cache/key-*.bin")) == []
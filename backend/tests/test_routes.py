@@ -0,0 +1,19 @@
+"""Tests of the query parameter normalization of the endpoints"""
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+import routes
+
+
+def test_trend_filters_drop_absent_parameters_and_sort_tags():
+    assert routes.trend_filters() == {}
+    assert routes.trend_filters(month_from="2024-01", tags=["math", "dp", "math"]) == {
+        "month_from": "2024-01", "tags": ("dp", "math")}
+
+
+@pytest.mark.parametrize("month", ["2024-13", "2024-00", "2024-1x"])
+@pytest.mark.parametrize("name", ["month_from", "month_to"])
+def test_trend_filters_reject_impossible_months(name, month):
+    with pytest.raises(BadRequest):
+        routes.trend_filters(**{name: month})
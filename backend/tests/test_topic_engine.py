@@ -0,0 +1,131 @@
+"""Tests of the TopicFrame statistics against plain Python counts of literal rows"""
+
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import topic_engine
+from topic_engine import TopicFrame
+
+# (contest_id, index, rating, success_trials, unsuccess_trials, startTimeSeconds)
+PROBLEMS = [
+    (1, "A", 800, 90, 10, 1000),
+    (1, "B", 1200, 40, 60, 1000),
+    (2, "A", 800, 30, 20, 2000),
+    (2, "B", 1600, 5, 45, 2000),
+    (3, "A", 1200, 7, 3, 3000),
+    # Contest known only from the problems dump: no start time
+    (4, "A", 1600, 2, 8, None),
+]
+
+# (problem_contest_id, problem_index, tag), unordered like the query results
+PROBLEM_TAGS = [
+    (2, "B", "math"),
+    (1, "A", "math"),
+    (1, "B", "dp"),
+    (2, "A", "greedy"),
+    (1, "A", "greedy"),
+    (2, "B", "dp"),
+    (1, "B", "math"),
+    (2, "B", "graphs"),
+    (4, "A", "greedy"),
+    # Problem ingested between the two reads: skipped
+    (9, "Z", "math"),
+]
+
+FILTERS = [
+    {},
+    {"min_rating": 1000},
+    {"max_rating": 1200, "start_time_from": 1500},
+    {"start_time_to": 1000},
+    {"tags": ["math", "dp", "unknown"]},
+    {"min_rating": 800, "max_rating": 1200, "start_time_from": 1000, "start_time_to": 2000,
+     "tags": ["greedy", "math"]},
+]
+
+
+@pytest.fixture
+def frame(monkeypatch):
+    monkeypatch.setattr(topic_engine, "fetch_all", lambda *queries: (PROBLEMS, PROBLEM_TAGS))
+    return TopicFrame.load()
+
+
+def expected_entries(min_rating=None, max_rating=None, start_time_from=None, start_time_to=None, tags=None):
+    """Problems passing the filters, mapped to their kept tags"""
+    problems = {}
+    for contest_id, index, rating, success, failures, start_time in PROBLEMS:
+        if ((min_rating is None or rating >= min_rating) and (max_rating is None or rating <= max_rating)
+                and (start_time_from is None or start_time is not None and start_time >= start_time_from)
+                and (start_time_to is None or start_time is not None and start_time <= start_time_to)):
+            problems[(contest_id, index)] = (rating, success, failures, [])
+    for contest_id, index, tag in PROBLEM_TAGS:
+        if (contest_id, index) in problems and (tags is None or tag in tags):
+            problems[(contest_id, index)][3].append(tag)
+    return problems.values()
+
+
+def test_load_builds_sorted_tags_and_csr_arrays(frame):
+    assert frame.topics() == ["dp", "graphs", "greedy", "math"]
+    assert frame.indptr.tolist() == [0, 2, 4, 5, 8, 8, 9]
+    # Tags of every problem, sorted by code
+    assert [frame.tag_names[frame.indices[start:end]].tolist()
+            for start, end in zip(frame.indptr[:-1], frame.indptr[1:])] == [
+        ["greedy", "math"], ["dp", "math"], ["greedy"], ["dp", "graphs", "math"], [], ["greedy"]]
+    assert frame.ratings.tolist() == [800, 1200, 800, 1600, 1200, 1600]
+    assert np.isnan(frame.start_times).tolist() == [False] * 5 + [True]
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_distribution_by_rating(frame, filters):
+    expected = Counter((tag, rating) for rating, _, _, tags in expected_entries(**filters) for tag in tags)
+    codes, ratings, counts = frame.distribution_by_rating(*frame.masks(**filters))
+
+    assert {(frame.tag_names[code], rating.item()): count.item()
+            for code, rating, count in zip(codes, ratings, counts)} == expected
+    # Ordered by tag, then rating
+    assert list(zip(codes, ratings)) == sorted(zip(codes, ratings))
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_correlation(frame, filters):
+    expected = Counter((first, second) for _, _, _, tags in expected_entries(**filters)
+                       for first in tags for second in tags)
+    first, second, counts = frame.correlation(*frame.masks(**filters))
+    pairs = {(frame.tag_names[a], frame.tag_names[b]): count.item() for a, b, count in zip(first, second, counts)}
+
+    assert pairs == expected
+    # The diagonal counts the problems of every tag, and pairs are symmetric
+    problems_per_tag = Counter(tag for _, _, _, tags in expected_entries(**filters) for tag in tags)
+    assert {a: count for (a, b), count in pairs.items() if a == b} == problems_per_tag
+    assert all(pairs[(b, a)] == count for (a, b), count in pairs.items())
+
+
+def test_correlation_without_filters(frame):
+    first, second, counts = frame.correlation()
+    pairs = {(frame.tag_names[a], frame.tag_names[b]): count.item() for a, b, count in zip(first, second, counts)}
+
+    assert pairs[("math", "math")] == 3
+    assert pairs[("dp", "math")] == pairs[("math", "dp")] == 2
+    assert pairs[("graphs", "dp")] == 1
+    assert ("greedy", "dp") not in pairs
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_solvability(frame, filters):
+    expected = {}
+    for _, success, failures, tags in expected_entries(**filters):
+        for tag in tags:
+            tag_success, tag_total = expected.get(tag, (0, 0))
+            expected[tag] = (tag_success + success, tag_total + success + failures)
+    codes, success, total = frame.solvability(*frame.masks(**filters))
+
+    assert {frame.tag_names[code]: (s.item(), t.item()) for code, s, t in zip(codes, success, total)} == expected
+    assert success.dtype == total.dtype == np.int64
+
+
+def test_unknown_tags_only_match_nothing(frame):
+    problems, tags = frame.masks(tags=["unknown"])
+    assert not tags.any()
+    for statistic in (frame.distribution_by_rating, frame.correlation, frame.solvability):
+        assert all(len(column) == 0 for column in statistic(problems, tags))
@@ -0,0 +1,154 @@
+"""Tests of the user distribution reductions and percentile ranks"""
+
+import numpy as np
+import pytest
+
+from user_engine import FEATURES, UserFrame, bootstrap_correlation, downsample, hexbin, histogram2d
+
+EMPTY = np.array([], dtype=np.float64)
+
+
+@pytest.fixture
+def points():
+    generator = np.random.default_rng(1)
+    x = generator.normal(size=2000)
+    y = 0.5 * x + generator.normal(size=2000)
+    # Undefined features are NaN and must be ignored
+    x[:10] = np.nan
+    return x, y
+
+
+def test_histogram2d_edges_span_the_data():
+    x = np.array([0.0, 2.5, 5.0, 10.0])
+    y = np.array([100.0, 100.0, 300.0, 200.0])
+    x_edges, y_edges, counts = histogram2d(x, y, 4, 2)
+
+    assert x_edges.tolist() == [0.0, 2.5, 5.0, 7.5, 10.0]
+    assert y_edges.tolist() == [100.0, 200.0, 300.0]
+    # Values on an inner edge go to the upper bin, the maxima to the last bin
+    assert counts.tolist() == [[1, 0], [1, 0], [0, 1], [0, 1]]
+    assert counts.dtype == np.int64
+
+
+def test_histogram2d_drops_nan_and_counts_every_point(points):
+    x, y = points
+    _, _, counts = histogram2d(x, y, 7, 3)
+    assert counts.shape == (7, 3)
+    assert counts.sum() == 1990
+
+
+def test_histogram2d_single_bin(points):
+    x_edges, y_edges, counts = histogram2d(*points, 1, 1)
+    assert counts.tolist() == [[1990]]
+    assert x_edges[0] == np.nanmin(points[0]) and x_edges[1] == np.nanmax(points[0])
+
+
+def test_histogram2d_constant_and_empty_input():
+    x_edges, _, counts = histogram2d(np.full(3, 7.0), np.arange(3.0), 2, 1)
+    assert x_edges.tolist() == [6.5, 7.0, 7.5]
+    assert counts.sum() == 3
+
+    x_edges, y_edges, counts = histogram2d(EMPTY, EMPTY, 2, 2)
+    assert x_edges.tolist() == [0.0, 0.5, 1.0]
+    assert counts.tolist() == [[0, 0], [0, 0]]
+
+
+@pytest.mark.parametrize("bins", [1, 2, 5, 40])
+def test_hexbin_centers_stay_within_the_data(points, bins):
+    x, y = points
+    width, height, centers_x, centers_y, counts = hexbin(x, y, bins)
+
+    assert counts.sum() == 1990
+    assert (counts > 0).all()
+    assert np.nanmin(x) <= centers_x.min() and centers_x.max() <= np.nanmax(x)
+    assert np.nanmin(y) <= centers_y.min() and centers_y.max() <= np.nanmax(y)
+    assert width == pytest.approx((np.nanmax(x) - np.nanmin(x)) / bins)
+    # Centers are unique and ordered
+    codes = list(zip(centers_x, centers_y))
+    assert codes == sorted(set(codes))
+
+
+def test_hexbin_single_bin_corners():
+    x = np.array([0.0, 1.0, 1.0, 0.0, 0.5])
+    y = np.array([0.0, 0.0, 1.0, 1.0, 0.5])
+    _, _, centers_x, centers_y, counts = hexbin(x, y, 1, 1)
+
+    assert centers_x.tolist() == [0.0, 0.0, 0.5, 1.0, 1.0]
+    assert centers_y.tolist() == [0.0, 1.0, 0.5, 0.0, 1.0]
+    assert counts.tolist() == [1] * 5
+
+    # A point on the right edge, between two corners, goes to the middle center
+    x, y = np.append(x, 1.0), np.append(y, 0.5)
+    _, _, centers_x, centers_y, counts = hexbin(x, y, 1, 1)
+    assert dict(zip(zip(centers_x, centers_y), counts)) == {
+        (0.0, 0.0): 1, (0.0, 1.0): 1, (0.5, 0.5): 2, (1.0, 0.0): 1, (1.0, 1.0): 1}
+
+
+def test_hexbin_empty_input():
+    width, height, centers_x, centers_y, counts = hexbin(EMPTY, EMPTY, 10)
+    assert (width, height) == (0.1, 1 / 5)
+    assert len(centers_x) == len(centers_y) == len(counts) == 0
+
+
+def test_downsample_keeps_every_point_within_budget(points):
+    x, y = points
+    assert downsample(x, y, 5000, 10).tolist() == list(range(10, 2000))
+    assert len(downsample(EMPTY, EMPTY, 10, 10)) == 0
+
+
+@pytest.mark.parametrize("bins", [1, 3, 20])
+def test_downsample_picks_exactly_the_budget(points, bins):
+    x, y = points
+    kept = downsample(x, y, 300, bins)
+
+    assert len(kept) == 300
+    assert (np.diff(kept) > 0).all()
+    assert np.isfinite(x[kept]).all()
+    assert kept.tolist() == downsample(x, y, 300, bins).tolist()
+
+
+def test_downsample_keeps_one_point_per_occupied_cell(points):
+    x, y = points
+    bins = 20
+    kept = downsample(x, y, 300, bins)
+    _, _, all_counts = histogram2d(x, y, bins, bins)
+    _, _, kept_counts = histogram2d(np.append(x[kept], [np.nanmin(x), np.nanmax(x)]),
+                                    np.append(y[kept], [np.min(y), np.max(y)]), bins, bins)
+    # Both grids span the same extent thanks to the two added corner points
+    assert ((all_counts > 0) <= (kept_counts > 0)).all()
+
+
+def user_frame(ratings):
+    ratings = np.array(ratings, dtype=np.float64)
+    features = {name: np.arange(len(ratings), dtype=np.float64) for name in FEATURES}
+    return UserFrame(np.array([f"user{row}" for row in range(len(ratings))], dtype=object), ratings, features)
+
+
+def test_percentile_counts_ties_as_half_below():
+    frame = user_frame([1000, 1500, 1500, 1500, 2000])
+
+    assert frame.percentile("rating", 1500) == 50.0
+    assert frame.percentile("rating", 1000) == 10.0
+    assert frame.percentile("rating", 2000) == 90.0
+    assert frame.percentile("rating", 1200) == 20.0
+    assert frame.percentile("rating", 0) == 0.0
+    assert frame.percentile("rating", 3000) == 100.0
+
+
+def test_percentile_of_identical_values_is_the_median():
+    frame = user_frame([1200] * 4)
+    assert frame.percentile("rating", 1200) == 50.0
+
+
+def test_lookup_ranks_a_user_in_every_distribution():
+    frame = user_frame([1000, 1500, 2000])
+    rating, percentile = frame.lookup("user1")["rating"]
+    assert (rating, percentile) == (1500.0, 50.0)
+    assert frame.lookup("nobody") is None
+
+
+def test_bootstrap_interval_contains_the_correlation(points):
+    x, y = (values[10:] for values in points)
+    lower, upper = bootstrap_correlation(x, y)
+    assert lower < np.corrcoef(x, y)[0, 1] < upper
+    assert np.isnan(bootstrap_correlation(x[:2], y[:2])).all()
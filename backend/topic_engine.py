@@ -0,0 +1,212 @@
+"""
+Columnar Topic Analytics Engine
+
+Keeps problems and their tags in memory as NumPy column arrays, so the topic
+statistics are computed with vectorized operations instead of SQL round trips:
+    - one array per problem attribute (rating, trials, contest start time)
+    - tags dictionary-encoded as integer codes into a sorted array of tag names
+    - a CSR problem -> tag incidence matrix (indptr / indices)
+
+Tag co-occurrence is the sparse product Aᵀ·A of the incidence matrix: every problem
+contributes the pairs of its own tags, so the work grows with the number of
+(problem, tag) entries rather than with a self-join over problem_tags.
+"""
+
+import uuid
+
+import numpy as np
+
+from queries import fetch_all
+
+# Every problem with the start time of its contest
+PROBLEMS_QUERY = """
+    SELECT p.contest_id, p.index, p.rating, p.success_trials, p.unsuccess_trials,
+           c."startTimeSeconds"
+    FROM problems AS p
+    JOIN contests AS c ON p.contest_id = c.id
+    """
+
+PROBLEM_TAGS_QUERY = """SELECT problem_contest_id, problem_index, tag FROM problem_tags;"""
+
+
+class TopicFrame:
+    """
+    Problems and their tags as column arrays.
+
+    Args:
+        ratings (np.ndarray): Difficulty rating of every problem
+        success_trials (np.ndarray): Successful submissions of every problem
+        unsuccess_trials (np.ndarray): Failed submissions of every problem
+        start_times (np.ndarray): Start time of every problem's contest, NaN when unknown
+        tag_names (np.ndarray): Sorted tag names; a tag code indexes this array
+        indptr (np.ndarray): CSR row pointers, tags of problem p are indices[indptr[p]:indptr[p + 1]]
+        indices (np.ndarray): CSR tag codes of every (problem, tag) entry
+    """
+
+    def __init__(self, ratings, success_trials, unsuccess_trials, start_times, tag_names, indptr, indices):
+        self.ratings = ratings
+        self.success_trials = success_trials
+        self.unsuccess_trials = unsuccess_trials
+        self.start_times = start_times
+        self.tag_names = tag_names
+        self.indptr = indptr
+        self.indices = indices
+        # Problem of every incidence entry (the CSR row indices, expanded)
+        self.entry_problems = np.repeat(np.arange(len(ratings)), np.diff(indptr))
+        # Identifies this frame in the keys of the shared cache, in every process mapping it
+        self.cache_token = uuid.uuid4().hex
+
+    @classmethod
+    def load(cls):
+        """
+        Read problems and problem tags from the database, both queries at the same time.
+
+        Returns:
+            TopicFrame: Column arrays of all problems and tags
+        """
+        problems, problem_tags = fetch_all(PROBLEMS_QUERY, PROBLEM_TAGS_QUERY)
+
+        row_of = {(contest_id, index): row for row, (contest_id, index, *_) in enumerate(problems)}
+        # The reads see separate snapshots: skip tags of problems ingested in between
+        problem_tags = [item for item in problem_tags if (item[0], item[1]) in row_of]
+        columns = np.array([item[2:5] for item in problems], dtype=np.int64).reshape(-1, 3)
+        # Floats, so that contests without a known start time (NULL) become NaN and
+        # fail every start time filter
+        start_times = np.array([item[5] for item in problems], dtype=np.float64)
+
+        # Dictionary-encode tags and sort the entries by problem to build the CSR arrays
+        entry_problems = np.fromiter((row_of[(item[0], item[1])] for item in problem_tags),
+                                     dtype=np.int64, count=len(problem_tags))
+        tag_names, tag_codes = np.unique(np.array([item[2] for item in problem_tags], dtype=object),
+                                         return_inverse=True)
+        order = np.lexsort((tag_codes, entry_problems))
+        indptr = np.zeros(len(problems) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(entry_problems, minlength=len(problems)), out=indptr[1:])
+
+        return cls(
+            ratings=columns[:, 0],
+            success_trials=columns[:, 1],
+            unsuccess_trials=columns[:, 2],
+            start_times=start_times,
+            tag_names=tag_names.astype(str),
+            indptr=indptr,
+            indices=tag_codes[order].astype(np.int64),
+        )
+
+    def masks(self, min_rating=None, max_rating=None, start_time_from=None, start_time_to=None, tags=None):
+        """
+        Translate filters into boolean masks over problems and tag codes.
+        Every filter is optional and bounds are inclusive. Problems of contests
+        without a known start time are dropped by either start time filter.
+
+        Args:
+            min_rating (int): Lowest problem rating
+            max_rating (int): Highest problem rating
+            start_time_from (int): Earliest contest start time (Unix seconds)
+            start_time_to (int): Latest contest start time (Unix seconds)
+            tags (Iterable[str]): Tags to keep; unknown tags are ignored
+
+        Returns:
+            tuple: (problem mask or None, tag mask or None)
+        """
+        problems = None
+        for values, bound, keep in ((self.ratings, min_rating, np.greater_equal),
+                                    (self.ratings, max_rating, np.less_equal),
+                                    (self.start_times, start_time_from, np.greater_equal),
+                                    (self.start_times, start_time_to, np.less_equal)):
+            if bound is not None:
+                problems = keep(values, bound) if problems is None else problems & keep(values, bound)
+        selected = None
+        if tags is not None:
+            selected = np.isin(self.tag_names, list(tags))
+        return problems, selected
+
+    def _entries(self, problems=None, tags=None):
+        """Problem rows and tag codes of the incidence entries passing the masks"""
+        if problems is None and tags is None:
+            return self.entry_problems, self.indices
+        keep = np.ones(len(self.indices), dtype=bool)
+        if problems is not None:
+            keep &= problems[self.entry_problems]
+        if tags is not None:
+            keep &= tags[self.indices]
+        return self.entry_problems[keep], self.indices[keep]
+
+    def topics(self):
+        """
+        Returns:
+            list[str]: Names of all tags
+        """
+        return self.tag_names.tolist()
+
+    def distribution_by_rating(self, problems=None, tags=None):
+        """
+        Count problems for every (tag, rating) pair.
+
+        Args:
+            problems (np.ndarray): Optional boolean mask of problems to count
+            tags (np.ndarray): Optional boolean mask of tag codes to report
+
+        Returns:
+            tuple: Parallel arrays (tag codes, ratings, counts) of the non-empty pairs,
+                ordered by tag and rating
+        """
+        entry_problems, entry_tags = self._entries(problems, tags)
+        rating_values, rating_codes = np.unique(self.ratings[entry_problems], return_inverse=True)
+        counts = np.bincount(entry_tags * len(rating_values) + rating_codes,
+                             minlength=len(self.tag_names) * len(rating_values))
+        counts = counts.reshape(len(self.tag_names), len(rating_values))
+        tag_rows, rating_columns = np.nonzero(counts)
+        return tag_rows, rating_values[rating_columns], counts[tag_rows, rating_columns]
+
+    def correlation(self, problems=None, tags=None):
+        """
+        Count problems shared by every ordered pair of tags, i.e. the sparse Aᵀ·A
+        of the incidence matrix.
+
+        Args:
+            problems (np.ndarray): Optional boolean mask of problems to count
+            tags (np.ndarray): Optional boolean mask of tag codes to report
+
+        Returns:
+            tuple: Parallel arrays (first tag codes, second tag codes, counts) of the
+                non-empty pairs, ordered by both tags
+        """
+        # Entries stay grouped by problem after filtering, so each problem's tags
+        # occupy a contiguous run starting at run_starts[problem]
+        entry_problems, entry_tags = self._entries(problems, tags)
+        tags_per_problem = np.bincount(entry_problems, minlength=len(self.ratings))
+        run_starts = np.cumsum(tags_per_problem) - tags_per_problem
+
+        # Pair every entry with all entries of the same problem
+        repeats = tags_per_problem[entry_problems]
+        first = np.repeat(entry_tags, repeats)
+        pair_starts = np.repeat(np.cumsum(repeats) - repeats, repeats)
+        partners = (np.arange(len(first)) - pair_starts
+                    + np.repeat(run_starts[entry_problems], repeats))
+        second = entry_tags[partners]
+
+        tag_count = len(self.tag_names)
+        counts = np.bincount(first * tag_count + second, minlength=tag_count * tag_count)
+        counts = counts.reshape(tag_count, tag_count)
+        first_tags, second_tags = np.nonzero(counts)
+        return first_tags, second_tags, counts[first_tags, second_tags]
+
+    def solvability(self, problems=None, tags=None):
+        """
+        Sum submissions of the problems of every tag.
+
+        Args:
+            problems (np.ndarray): Optional boolean mask of problems to count
+            tags (np.ndarray): Optional boolean mask of tag codes to report
+
+        Returns:
+            tuple: Parallel arrays (tag codes, successful trials, all trials) of the
+                tags having at least one counted problem
+        """
+        entry_problems, entry_tags = self._entries(problems, tags)
+        tag_count = len(self.tag_names)
+        success = np.bincount(entry_tags, weights=self.success_trials[entry_problems], minlength=tag_count)
+        failures = np.bincount(entry_tags, weights=self.unsuccess_trials[entry_problems], minlength=tag_count)
+        present = np.flatnonzero(np.bincount(entry_tags, minlength=tag_count))
+        return present, success[present].astype(np.int64), (success + failures)[present].astype(np.int64)
@@ -0,0 +1,345 @@
+"""
+Columnar User Feature Engine
+
+Keeps the per-user features of the user_features rollup in memory as NumPy column
+arrays, so the user rating endpoints can reduce hundreds of thousands of users to a
+compact payload with vectorized operations:
+    - histogram2d: counts on a rectangular grid of bins
+    - hexbin: counts on a hexagonal grid, listing only the non-empty cells
+    - downsample: a fixed number of users drawn per grid cell in proportion to its
+      population, so dense and sparse regions keep their relative density and no
+      occupied cell disappears
+    - lookup: one user's features and their percentiles in every distribution, by a
+      hash lookup of the handle and binary searches in sorted copies of the columns,
+      in time independent of the number of users
+    - sampled frames and bootstrap_correlation: a random share of the users read with
+      TABLESAMPLE (whole pages for small shares, see SYSTEM_SAMPLE_PERCENT), and
+      confidence intervals of correlations estimated from them, for fast approximate
+      answers while the full frame loads
+"""
+
+import uuid
+
+import numpy as np
+
+from config import analytics_backend
+from queries import read
+
+# Features stored for every user next to the rating
+FEATURES = ["experience", "number_of_solutions", "avg_solutions_rating", "avg_solutions_solvability"]
+
+# Features that are only defined for users with at least one solution
+SOLUTION_FEATURES = {"number_of_solutions", "avg_solutions_rating", "avg_solutions_solvability"}
+
+USERS_QUERY = f"""
+    SELECT user_handle, rating, {", ".join(FEATURES)}
+    FROM user_features {{sample}}
+    ORDER BY rating, user_handle
+    """
+
+# Sampling of user_features in each backend's dialect; the seed makes the sample of a
+# given table contents repeatable
+SAMPLE_CLAUSES = {
+    "postgres": "TABLESAMPLE {method} ({percent}) REPEATABLE ({seed})",
+    "duckdb": "TABLESAMPLE {percent} PERCENT (bernoulli, {seed})",
+}
+
+# Postgres's BERNOULLI keeps every row with the given probability but reads every page
+# of the table, so smaller samples use SYSTEM, which keeps whole pages and reads only
+# that share of them. Every user still has the same chance to be kept, so estimates
+# stay unbiased, but users stored together (e.g. rewritten by the same incremental
+# refresh) are kept together, so they vary somewhat more than the bootstrap interval,
+# which assumes independently drawn users, tells. DuckDB samples in memory, where
+# BERNOULLI is cheap.
+SYSTEM_SAMPLE_PERCENT = 10
+
+# Bootstrap resamples drawn for every confidence interval, and the number of indices
+# drawn at once, which bounds the memory of the vectorized resampling (about 20 MiB
+# at the peak, for the indices, the resampled variables and their products)
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_BLOCK = 1 << 19
+
+
+class UserFrame:
+    """
+    Users and their features as column arrays, ordered by rating.
+
+    Args:
+        handles (np.ndarray): Handle of every user
+        ratings (np.ndarray): Rating of every user
+        features (dict): Feature name -> array with the feature of every user (NaN if undefined)
+        fraction (float): Expected share of all users the frame holds, below 1 for a sample
+    """
+
+    def __init__(self, handles, ratings, features, fraction=1.0):
+        self.handles = handles
+        self.ratings = ratings
+        self.features = features
+        self.fraction = fraction
+        # Identifies this frame in the keys of the shared cache, in every process mapping it
+        self.cache_token = uuid.uuid4().hex
+        # Sorted values of every distribution a user is ranked in, as plotted by the
+        # rating distributions: users without solutions have no solution features
+        self.sorted_values = {"rating": np.sort(ratings)}
+        for name in FEATURES:
+            _, values = self.pairs(name)
+            self.sorted_values[name] = np.sort(values[np.isfinite(values)])
+        self._build_index()
+
+    def _build_index(self):
+        """Map every handle to its row"""
+        self._rows = {handle: row for row, handle in enumerate(self.handles.tolist())}
+
+    def __getstate__(self):
+        # The handle index is not a NumPy array, so it would be copied into every
+        # pickle of the shared cache; each process rebuilds it instead
+        state = dict(self.__dict__)
+        del state["_rows"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_index()
+
+    @classmethod
+    def load(cls, sample_percent=None, seed=0):
+        """
+        Read the user_features rollup from the database.
+
+        Args:
+            sample_percent (float): Percentage of the users to read, each user being
+                kept with this probability (by pages below SYSTEM_SAMPLE_PERCENT on
+                Postgres), or None for all users
+            seed (int): Seed of the sample
+
+        Returns:
+            UserFrame: Column arrays of all users, or of the sampled ones
+        """
+        sample = "" if sample_percent is None else SAMPLE_CLAUSES[analytics_backend].format(
+            method="SYSTEM" if sample_percent < SYSTEM_SAMPLE_PERCENT else "BERNOULLI",
+            percent=float(sample_percent), seed=int(seed))
+        rows = read(USERS_QUERY.format(sample=sample))
+
+        # None (e.g. users without solutions) becomes NaN in float columns. Transposed
+        # so that every column is contiguous (and can be shared without copying).
+        columns = np.array([item[1:] for item in rows], dtype=np.float64).reshape(-1, len(FEATURES) + 1)
+        columns = np.ascontiguousarray(columns.T)
+        return cls(
+            handles=np.array([item[0] for item in rows], dtype=object),
+            ratings=columns[0],
+            features={name: columns[position + 1] for position, name in enumerate(FEATURES)},
+            fraction=1.0 if sample_percent is None else sample_percent / 100.0,
+        )
+
+    def pairs(self, feature):
+        """
+        Select the (rating, feature) pairs of the users the feature applies to.
+
+        Args:
+            feature (str): One of FEATURES
+
+        Returns:
+            tuple: Parallel arrays (ratings, feature values), ordered by rating
+        """
+        values = self.features[feature]
+        if feature in SOLUTION_FEATURES:
+            keep = self.features["number_of_solutions"] > 0
+            return self.ratings[keep], values[keep]
+        return self.ratings, values
+
+    def percentile(self, name, value):
+        """
+        Percentile rank of a value in a distribution: the share of users below it,
+        counting ties as half below.
+
+        Args:
+            name (str): "rating" or one of FEATURES
+            value (float): Value to rank
+
+        Returns:
+            float: Percentile between 0 and 100
+        """
+        values = self.sorted_values[name]
+        below = np.searchsorted(values, value, side="left")
+        ties = np.searchsorted(values, value, side="right") - below
+        return float(100.0 * (below + 0.5 * ties) / len(values))
+
+    def lookup(self, handle):
+        """
+        Find a user and rank them in every distribution.
+
+        Args:
+            handle (str): User handle
+
+        Returns:
+            dict: "rating" and every feature -> (value, percentile). The value is None
+                if undefined, and the percentile None outside of the distribution (the
+                solution features of users without solutions); None if the handle is unknown
+        """
+        row = self._rows.get(handle)
+        if row is None:
+            return None
+        result = {"rating": (float(self.ratings[row]), self.percentile("rating", self.ratings[row]))}
+        for name in FEATURES:
+            value = float(self.features[name][row])
+            if not np.isfinite(value):
+                result[name] = (None, None)
+            elif name in SOLUTION_FEATURES and self.features["number_of_solutions"][row] == 0:
+                result[name] = (value, None)
+            else:
+                result[name] = (value, self.percentile(name, value))
+        return result
+
+
+def _finite(x, y):
+    """Drop the points with a NaN coordinate"""
+    keep = np.isfinite(x) & np.isfinite(y)
+    return x[keep], y[keep]
+
+
+def _extent(values):
+    """Lowest and highest value, widened when they coincide so bins have a size"""
+    if len(values) == 0:
+        return 0.0, 1.0
+    low, high = float(values.min()), float(values.max())
+    return (low, high) if high > low else (low - 0.5, high + 0.5)
+
+
+def histogram2d(x, y, x_bins, y_bins):
+    """
+    Count points on a rectangular grid spanning the data.
+
+    Args:
+        x (np.ndarray): Horizontal coordinates
+        y (np.ndarray): Vertical coordinates
+        x_bins (int): Number of bins along x
+        y_bins (int): Number of bins along y
+
+    Returns:
+        tuple: (x bin edges, y bin edges, counts), counts[i, j] being the number of
+            points in x bin i and y bin j
+    """
+    x, y = _finite(x, y)
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=(x_bins, y_bins), range=(_extent(x), _extent(y)))
+    return x_edges, y_edges, counts.astype(np.int64)
+
+
+def hexbin(x, y, x_bins, y_bins=None):
+    """
+    Count points on a hexagonal grid spanning the data. Hexagons are laid out as two
+    interleaved rectangular lattices, and every point goes to the nearer of the two
+    candidate centers (the same construction as matplotlib's hexbin).
+
+    Args:
+        x (np.ndarray): Horizontal coordinates
+        y (np.ndarray): Vertical coordinates
+        x_bins (int): Number of hexagons along x
+        y_bins (int): Number of hexagon rows along y; defaults to keeping them regular
+
+    Returns:
+        tuple: (hexagon width, row height, center x, center y, counts) of the non-empty
+            hexagons, ordered by center
+    """
+    x, y = _finite(x, y)
+    y_bins = y_bins or max(1, int(x_bins / np.sqrt(3)))
+    (x_low, x_high), (y_low, y_high) = _extent(x), _extent(y)
+    width, height = (x_high - x_low) / x_bins, (y_high - y_low) / y_bins
+
+    # Grid coordinates, and the distance to the nearest center of each lattice. The
+    # second lattice has x_bins x y_bins centers, so the points on the upper edges go
+    # to its last row and column rather than to centers outside the data (with one
+    # bin, half of the points would otherwise land on a center beyond the extent)
+    grid_x, grid_y = (x - x_low) / width, (y - y_low) / height
+    ix1, iy1 = np.round(grid_x), np.round(grid_y)
+    ix2, iy2 = np.minimum(np.floor(grid_x), x_bins - 1), np.minimum(np.floor(grid_y), y_bins - 1)
+    first = (grid_x - ix1) ** 2 + 3.0 * (grid_y - iy1) ** 2 < \
+        (grid_x - ix2 - 0.5) ** 2 + 3.0 * (grid_y - iy2 - 0.5) ** 2
+
+    # Centers on half-cell steps, so both lattices share one integer code space
+    center_x = np.where(first, 2 * ix1, 2 * ix2 + 1).astype(np.int64)
+    center_y = np.where(first, 2 * iy1, 2 * iy2 + 1).astype(np.int64)
+    codes, counts = np.unique(center_x * (2 * y_bins + 3) + center_y, return_counts=True)
+    center_x, center_y = np.divmod(codes, 2 * y_bins + 3)
+    return (width, height, x_low + center_x * width / 2, y_low + center_y * height / 2, counts)
+
+
+def downsample(x, y, points, bins, seed=0):
+    """
+    Pick at most `points` points keeping the shape of the distribution. The data is
+    gridded like histogram2d; every non-empty cell keeps one point when the budget
+    allows it (so outliers survive), and the rest of the budget is shared out in
+    proportion to the cell populations. Points are drawn at random within a cell with
+    a fixed seed, so the same data always gives the same sample.
+
+    Args:
+        x (np.ndarray): Horizontal coordinates
+        y (np.ndarray): Vertical coordinates
+        points (int): Maximum number of points to keep
+        bins (int): Number of grid cells along each axis
+        seed (int): Seed of the random choice within cells
+
+    Returns:
+        np.ndarray: Sorted indices of the kept points into x and y
+    """
+    valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if len(valid) <= points:
+        return valid
+
+    cells = []
+    for values in (x[valid], y[valid]):
+        low, high = _extent(values)
+        cells.append(np.minimum(((values - low) / (high - low) * bins).astype(np.int64), bins - 1))
+    _, cells = np.unique(cells[0] * bins + cells[1], return_inverse=True)
+    population = np.bincount(cells)
+
+    # One point per cell first, the remaining budget by largest remainder
+    quota = np.ones(len(population), dtype=np.int64) if len(population) <= points \
+        else np.zeros(len(population), dtype=np.int64)
+    share = (population - quota) * (points - quota.sum()) / (population - quota).sum()
+    quota += np.floor(share).astype(np.int64)
+    leftover = points - quota.sum()
+    quota[np.argsort(np.floor(share) - share, kind="stable")[:leftover]] += 1
+
+    # Rank points within their cell by a random priority and keep the first `quota`
+    priority = np.random.default_rng(seed).random(len(valid))
+    order = np.lexsort((priority, cells))
+    cell_starts = np.cumsum(population) - population
+    rank = np.empty(len(valid), dtype=np.int64)
+    rank[order] = np.arange(len(valid)) - cell_starts[cells[order]]
+    return valid[rank < quota[cells]]
+
+
+def bootstrap_correlation(x, y, confidence=0.95, resamples=BOOTSTRAP_RESAMPLES, seed=0):
+    """
+    Percentile bootstrap confidence interval of the Pearson correlation of a sample.
+    The resamples are drawn as a matrix of row indices, BOOTSTRAP_BLOCK indices at a
+    time, and their correlations computed together along the rows of the matrix.
+
+    Args:
+        x (np.ndarray): First variable of the sampled points
+        y (np.ndarray): Second variable of the sampled points
+        confidence (float): Probability covered by the interval
+        resamples (int): Number of bootstrap resamples
+        seed (int): Seed of the resampling, so the same sample gives the same interval
+
+    Returns:
+        tuple: (lower bound, upper bound), NaN if the sample has fewer than 3 points
+    """
+    if len(x) < 3:
+        return float("nan"), float("nan")
+    generator = np.random.default_rng(seed)
+    estimates = np.empty(resamples)
+    step = max(1, BOOTSTRAP_BLOCK // len(x))
+    for start in range(0, resamples, step):
+        rows = generator.integers(0, len(x), size=(min(step, resamples - start), len(x)))
+        x_resampled, y_resampled = x[rows], y[rows]
+        x_resampled -= x_resampled.mean(axis=1, keepdims=True)
+        y_resampled -= y_resampled.mean(axis=1, keepdims=True)
+        # Resamples repeating a single point have no correlation (NaN)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            estimates[start:start + len(rows)] = (x_resampled * y_resampled).sum(axis=1) / np.sqrt(
+                (x_resampled ** 2).sum(axis=1) * (y_resampled ** 2).sum(axis=1))
+    if np.isnan(estimates).all():
+        return float("nan"), float("nan")
+    lower, upper = np.nanpercentile(estimates, [50.0 * (1.0 - confidence), 50.0 * (1.0 + confidence)])
+    return float(lower), float(upper)